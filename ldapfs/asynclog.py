@@ -0,0 +1,93 @@
+
+"""Logging from a background thread so requests never wait on log I/O."""
+
+import sys
+import threading
+import logging
+import Queue
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncHandler(logging.Handler):
+    """Pass log records to other handlers from a background writer thread.
+
+    Emitting a record only puts it on a bounded queue. Records are dropped,
+    and counted, rather than blocking a request when the queue is full.
+    Until the writer is started, e.g. before Fuse forks, and after it has
+    stopped, records are handled synchronously so nothing is lost.
+
+       Setup with: logging.getLogger().addHandler(AsyncHandler([handler]))
+    """
+
+    DEFAULT_QUEUE_SIZE = 10000      # records waiting to be written
+
+    def __init__(self, handlers, queue_size=DEFAULT_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.handlers = handlers
+        self.queue = Queue.Queue(queue_size)
+        self.dropped = 0
+        self.writer = None
+
+    def start(self):
+        """Start the writer thread."""
+        if self.writer:
+            return
+        self.writer = threading.Thread(target=self._write, name='log-writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def stop(self):
+        """Write any queued records and stop the writer thread."""
+        writer = self.writer
+        if not writer:
+            return
+        self.queue.put(None)
+        writer.join()
+        self.writer = None
+        if self.dropped:
+            LOG.warning('%d log records were dropped', self.dropped)
+            self.dropped = 0
+
+    def close(self):
+        """Stop the writer thread and close the target handlers."""
+        self.stop()
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+    def emit(self, record):
+        if not self.writer:
+            self._handle(record)
+            return
+        if record.exc_info:
+            # Format the traceback now, it may not survive until written
+            self.format(record)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        """Handle queued records until stopped (writer thread)."""
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self._handle(record)
+
+    def _handle(self, record):
+        """Pass a record to the target handlers."""
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:   # pylint: disable-msg=W0703
+                    sys.stderr.write('Error writing log record\n')
+
+    def close(self):
+        self.stop()
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
@@ -0,0 +1,243 @@
+
+"""Microbenchmarks of LdapFS hot paths with stored baselines.
+
+Usage: ldapfs-bench [-k <pattern>] [-s <file>] [-c <file> [-t <percent>]]
+
+Each benchmark times one call of a hot path, from name and DN handling to
+full FUSE operations against the fake backend. Results can be saved as a
+baseline and later runs compared against it, flagging regressions."""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import timeit
+
+from . import name
+from . import fs
+from . import replay
+from . import fakeldap
+from .ldapcon import Entry
+
+BENCHMARKS = []     # (name, setup function returning the callable to time)
+HOST = 'bench'
+BASE_DN = 'dc=example,dc=com'
+TREE = 'depth=1, fanout=100, attrs=8, group_size=10000'
+
+
+def benchmark(setup):
+    """Register a benchmark, named after its setup function."""
+    BENCHMARKS.append((setup.__name__, setup))
+    return setup
+
+
+@benchmark
+def path_create():
+    """Split a file path into its host, base DN and DN parts."""
+    hosts = {HOST: {'base_dns': [BASE_DN]}}
+    fspath = '/{}/{}/ou=u1/cn=e1.1/description'.format(HOST, BASE_DN)
+    return lambda: name.Path(fspath, hosts)
+
+
+@benchmark
+def dn_create():
+    """Create the DN of an LDAP object from path parts."""
+    parts = [BASE_DN, 'ou=u1', 'cn=e1.1']
+    return lambda: name.DN.create(parts)
+
+
+@benchmark
+def dn_create_invalid():
+    """Fail to create a DN from parts ending with an attribute."""
+    parts = [BASE_DN, 'ou=u1', 'description']
+    return lambda: name.DN.create(parts)
+
+
+@benchmark
+def dn_to_filename():
+    """Turn a child DN into its file name below its parent."""
+    parent_dn = 'ou=u1,{}'.format(BASE_DN)
+    dn = 'cn=e1.1,{}'.format(parent_dn)
+    return lambda: name.DN.to_filename(dn, parent_dn)
+
+
+def _entry(values):
+    """Return an Entry with a member attribute of the given size."""
+    return Entry('cn=e1.1,{}'.format(BASE_DN),
+                 {'objectClass': ['top', 'person'], 'cn': ['e1.1'],
+                  'member': ['cn=m{},{}'.format(index, BASE_DN)
+                             for index in range(values)]})
+
+
+@benchmark
+def entry_text_small():
+    """Render a 10 value attribute as text."""
+    entry = _entry(10)
+    return lambda: entry.text('member')
+
+
+@benchmark
+def entry_text_huge():
+    """Render a 100000 value attribute as text."""
+    entry = _entry(100000)
+    return lambda: entry.text('member')
+
+
+@benchmark
+def entry_text_all_attributes():
+    """Render the .attributes file of an entry."""
+    entry = _entry(10)
+    return lambda: entry.text(Entry.ALL_ATTRIBUTES)
+
+
+@benchmark
+def entry_size_huge():
+    """Work out the file size of a 100000 value attribute."""
+    entry = _entry(100000)
+    return lambda: entry.size('member')
+
+
+@benchmark
+def stat_create():
+    """Create the stat structure of a file."""
+    return lambda: fs.Stat(isdir=False, size=100)
+
+
+@benchmark
+def getattr_dir():
+    """getattr of an LDAP object with 100 children."""
+    ldapfs = _ldapfs()
+    return lambda: ldapfs.getattr('/{}/{}/ou=u1'.format(HOST, BASE_DN))
+
+
+@benchmark
+def getattr_attribute():
+    """getattr of an attribute file."""
+    ldapfs = _ldapfs()
+    return lambda: ldapfs.getattr('/{}/{}/ou=u1/cn=e1.1/description'
+                                  .format(HOST, BASE_DN))
+
+
+@benchmark
+def readdir_large():
+    """List an LDAP object with 100 children."""
+    ldapfs = _ldapfs()
+    return lambda: list(ldapfs.readdir('/{}/{}/ou=u1'.format(HOST, BASE_DN),
+                                       0))
+
+
+@benchmark
+def read_attribute():
+    """Read an attribute file."""
+    ldapfs = _ldapfs()
+    return lambda: ldapfs.read('/{}/{}/ou=u1/cn=e1.1/description'
+                               .format(HOST, BASE_DN), 4096, 0)
+
+
+@benchmark
+def read_huge_group():
+    """Read the start of a 10000 member group's member file."""
+    ldapfs = _ldapfs()
+    return lambda: ldapfs.read('/{}/{}/cn=group/member'.format(HOST, BASE_DN),
+                               4096, 0)
+
+
+_FS = []
+
+
+def _ldapfs():
+    """Return an LdapFS using the fake backend, shared by benchmarks."""
+    if not _FS:
+        config_dir = tempfile.mkdtemp(prefix='ldapfs-bench-')
+        try:
+            config = os.path.join(config_dir, 'ldapfs.cfg')
+            fakeldap.write_config(config, HOST, [BASE_DN],
+                                  {'log_async': 'false', 'stats': 'false'},
+                                  {'fake_tree': TREE})
+            _FS.append(replay.create_fs(config))
+        finally:
+            shutil.rmtree(config_dir)
+    return _FS[0]
+
+
+def run(pattern=None, min_time=0.2, repeat=5):
+    """Run the benchmarks, returning a dict of name to seconds per call.
+
+    Each is timed repeat times, calling it enough times to take at least
+    min_time seconds, and the fastest time per call is kept."""
+    results = {}
+    for bench_name, setup in BENCHMARKS:
+        if pattern and pattern not in bench_name:
+            continue
+        timer = timeit.Timer(setup())
+        number = 1
+        while timer.timeit(number) < min_time / 10:
+            number *= 10
+        results[bench_name] = min(timer.repeat(repeat, number)) / number
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return report lines and whether any benchmark regressed.
+
+    A benchmark regresses when it is more than threshold percent slower
+    than its baseline."""
+    lines = ['{:<30} {:>12} {:>12} {:>8}\n'.format('# benchmark', 'us/call',
+                                                   'baseline', 'change')]
+    regressed = False
+    for bench_name, seconds in sorted(results.items()):
+        base = baseline.get(bench_name)
+        if base:
+            change = (seconds - base) / base * 100
+            flag = ''
+            if change > threshold:
+                flag = ' REGRESSION'
+                regressed = True
+            lines.append('{:<30} {:>12.3f} {:>12.3f} {:>+7.1f}%{}\n'.format(
+                bench_name, seconds * 1000000, base * 1000000, change, flag))
+        else:
+            lines.append('{:<30} {:>12.3f} {:>12} {:>8}\n'.format(
+                bench_name, seconds * 1000000, '-', '-'))
+    return lines, regressed
+
+
+def main():
+    """Run the benchmark tool."""
+    parser = argparse.ArgumentParser(
+        description='Run LdapFS microbenchmarks.')
+    parser.add_argument('-k', '--pattern',
+                        help='Only run benchmarks with names containing this')
+    parser.add_argument('-s', '--save', metavar='FILE',
+                        help='Save the results as a baseline to FILE')
+    parser.add_argument('-c', '--compare', metavar='FILE',
+                        help='Compare the results with the baseline in FILE '
+                             'and exit with status 1 on any regression')
+    parser.add_argument('-t', '--threshold', type=float, default=20,
+                        help='Percent slower than the baseline counted as a '
+                             'regression [default: %(default)s]')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        try:
+            with open(args.compare) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (IOError, ValueError) as ex:
+            parser.error('Error reading baseline: {}'.format(ex))
+
+    try:
+        results = run(args.pattern)
+    finally:
+        for ldapfs in _FS:
+            ldapfs.fsdestroy()
+        del _FS[:]
+    lines, regressed = compare(results, baseline, args.threshold)
+    sys.stdout.writelines(lines)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+    if regressed:
+        sys.exit(1)
@@ -0,0 +1,122 @@
+
+"""Circuit breaking and admission control for the searches of one host.
+
+A CircuitBreaker watches the outcome of a host's recent searches. When too
+many of them fail, or take too long, it opens and searches fail at once
+instead of queueing behind a struggling server. After a while one trial
+search is let through and the breaker closes again if it succeeds.
+
+Admission caps the searches in flight to a host. Searches over the limit
+wait in a bounded queue and are turned away when it is full or when they
+have waited too long, so one slow host can't take every FUSE thread.
+"""
+
+import threading
+from collections import deque
+from time import time
+
+
+class CircuitBreaker(object):
+    """Open when too many of the last window calls failed or were slow."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, window=20, slow_call=0, reset=30):
+        self.threshold = threshold / 100.0  # fraction of bad calls to open
+        self.window = window                # calls looked at
+        self.slow_call = slow_call          # seconds, 0 if latency ignored
+        self.reset = reset                  # seconds open before a trial
+        self.outcomes = deque(maxlen=window)    # True for bad calls
+        self.state = self.CLOSED
+        self.opened = None
+        self.trial = False                  # trial call in progress
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """May a call be made now?"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and \
+               time() - self.opened >= self.reset:
+                self.state = self.HALF_OPEN
+                self.trial = False
+            if self.state == self.HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def cancel(self):
+        """Give back an allowed call that wasn't made after all."""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.trial = False
+
+    def record(self, elapsed, failed):
+        """Record the outcome of an allowed call."""
+        bad = failed or bool(self.slow_call and elapsed >= self.slow_call)
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.trial = False
+                if bad:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+            elif self.state == self.CLOSED:
+                self.outcomes.append(bad)
+                if len(self.outcomes) == self.window and \
+                   sum(self.outcomes) >= self.threshold * self.window:
+                    self._open()
+
+    def _open(self):
+        """Open the breaker, called with the lock held."""
+        self.state = self.OPEN
+        self.opened = time()
+        self.outcomes.clear()
+        self.trips += 1
+
+
+class Admission(object):
+    """Limit the calls in flight, queueing a bounded number over it."""
+
+    def __init__(self, limit, queue_size=0, timeout=0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout      # seconds to wait in the queue, 0 forever
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.condition = threading.Condition()
+
+    def enter(self):
+        """Wait for a call to be admitted, returning False if it isn't."""
+        with self.condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            if self.queued >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.queued += 1
+            deadline = time() + self.timeout if self.timeout else None
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self.condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        """End an admitted call, admitting the next queued one."""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
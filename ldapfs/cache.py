@@ -0,0 +1,145 @@
+
+"""A cache of LDAP search results served stale while being revalidated.
+
+Results are fresh for ttl seconds after they are fetched. For up to
+max_stale seconds more an expired result is still returned at once, while
+a background refresher fetches it again, so requests for hot entries never
+wait on the server as the entries expire. Older results are fetched again
+on the request path as usual, but are kept to be served when the server
+can't be reached, see get_offline.
+
+       Setup with: cache = EntryCache(ttl, max_stale); cache.start()
+"""
+
+import threading
+import logging
+import Queue
+from time import time
+
+from .exceptions import LdapException, NoSuchObject
+
+LOG = logging.getLogger(__name__)
+
+
+class EntryCache(object):
+    """Search results by key with stale-while-revalidate expiry."""
+
+    DEFAULT_SIZE = 100000       # max number of cached results
+    DEFAULT_QUEUE_SIZE = 10000  # refreshes waiting to run
+
+    def __init__(self, ttl, max_stale=0, size=DEFAULT_SIZE,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.size = size
+        self.results = {}       # key -> (result, fetch time)
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue(queue_size)
+        self.pending = set()    # keys queued for refresh
+        self.refresher = None
+        self.stats = {'hits': 0, 'stale_hits': 0, 'offline_hits': 0,
+                      'misses': 0, 'refreshes': 0, 'evictions': 0}
+
+    def start(self):
+        """Start the refresher thread."""
+        if self.refresher:
+            return
+        self.refresher = threading.Thread(target=self._refresh,
+                                          name='cache-refresher')
+        self.refresher.daemon = True
+        self.refresher.start()
+
+    def stop(self):
+        """Stop the refresher thread, dropping any queued refreshes."""
+        refresher = self.refresher
+        if not refresher:
+            return
+        with self.lock:
+            self.pending.clear()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        self.queue.put(None)
+        refresher.join()
+        self.refresher = None
+
+    def get(self, key, fetch):
+        """Return the result for the given key, fetching it if need be.
+
+        A stale result is returned at once and fetch queued to refresh it.
+
+           :raises: any exception raised by fetch
+        """
+        with self.lock:
+            result, fetched = self.results.get(key, (None, None))
+            age = time() - fetched if fetched is not None else None
+            if age is not None and age < self.ttl:
+                self.stats['hits'] += 1
+                return result
+            if age is not None and age < self.ttl + self.max_stale:
+                self.stats['stale_hits'] += 1
+                self._queue_refresh(key, fetch)
+                return result
+            self.stats['misses'] += 1
+        result = fetch()
+        self.put(key, result)
+        return result
+
+    def get_offline(self, key):
+        """Return the result for the given key whatever its age or None.
+
+        Used when the server can't be reached."""
+        with self.lock:
+            result, fetched = self.results.get(key, (None, None))
+            if fetched is None:
+                return None
+            self.stats['offline_hits'] += 1
+            return result
+
+    def put(self, key, result):
+        """Cache the result for the given key."""
+        with self.lock:
+            if key not in self.results and len(self.results) >= self.size:
+                LOG.debug('Entry cache full - clearing')
+                self.stats['evictions'] += len(self.results)
+                self.results.clear()
+            self.results[key] = (result, time())
+
+    def remove(self, key):
+        """Drop any result for the given key."""
+        with self.lock:
+            self.results.pop(key, None)
+
+    def _queue_refresh(self, key, fetch):
+        """Queue a refresh of the given key unless already queued.
+
+        Called with the lock held. Without a refresher the stale result is
+        served until it is too old and then fetched by a request."""
+        if not self.refresher or key in self.pending:
+            return
+        try:
+            self.queue.put_nowait((key, fetch))
+            self.pending.add(key)
+        except Queue.Full:
+            LOG.debug('Entry cache refresh queue full')
+
+    def _refresh(self):
+        """Fetch queued results again until stopped (refresher thread)."""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            key, fetch = item
+            with self.lock:
+                if key not in self.pending:
+                    continue
+                self.pending.discard(key)
+            try:
+                self.put(key, fetch())
+                self.stats['refreshes'] += 1
+            except NoSuchObject:
+                self.remove(key)
+            except LdapException as ex:
+                # Keep serving the stale result until it's too old
+                LOG.debug('Error refreshing %s: %s', key, ex)
+            except Exception:   # pylint: disable-msg=W0703
+                LOG.exception('Error refreshing %s', key)
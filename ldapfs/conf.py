@@ -31,8 +31,9 @@ class ConfigFile(object):
                     raise ConfigError('Error in config file "{}". Missing key '
                                       '"{}"'.format(self.config_path, key))
 
+            # Optional keys that are absent are left unset
             for key, parse_fn in parse_config or []:
-                if parse_fn:
+                if parse_fn and key in config:
                     config[key] = parse_fn(config[key])
         except ConfigError as ex:
             raise ConfigError('Error in config key "{}". {}'.format(key, ex))
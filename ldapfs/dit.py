@@ -0,0 +1,138 @@
+
+"""Generation of synthetic directory trees for testing and benchmarking.
+
+A tree's shape is given as comma separated key=value pairs, e.g.
+
+    depth=3, fanout=10, attrs=4, value_size=32, values=1, group_size=1000
+
+where the keys are those of DEFAULT_SHAPE. Entries use only standard
+schema so a generated tree can be loaded into a real LDAP server."""
+
+import ldap
+
+from .conf import ConfigError
+
+DEFAULT_SHAPE = {
+    'depth': 2,         # levels of organizational units below the base DN
+    'fanout': 10,       # children of each base DN and organizational unit
+    'attrs': 4,         # extra attributes of each leaf entry
+    'value_size': 32,   # min characters in each extra attribute value
+    'values': 1,        # values of each extra attribute
+    'group_size': 0,    # members of a group under the base DN, 0 for none
+}
+MIN_SHAPE = {'value_size': 1, 'values': 1}      # other keys may be 0
+# Multi-valued directory string attributes of inetOrgPerson
+EXTRA_ATTRS = ['description', 'title', 'l', 'street', 'ou', 'carLicense',
+               'departmentNumber', 'employeeType', 'givenName', 'initials',
+               'roomNumber', 'businessCategory', 'st', 'postOfficeBox',
+               'physicalDeliveryOfficeName', 'postalAddress']
+# Object classes of a base DN entry by the attribute type of its first RDN
+BASE_OBJECT_CLASSES = {
+    'dc': ['top', 'dcObject', 'organization'],
+    'o': ['top', 'organization'],
+    'ou': ['top', 'organizationalUnit'],
+}
+
+
+def parse_shape(shape_str):
+    """Return a shape dict for the given shape string.
+
+    Keys not given take their values from DEFAULT_SHAPE. ConfigError is
+    raised for an invalid shape."""
+    shape = DEFAULT_SHAPE.copy()
+    for key_value in shape_str.split(','):
+        if not key_value.strip():
+            continue
+        try:
+            key, value = [part.strip() for part in key_value.split('=')]
+            value = int(value)
+        except ValueError:
+            raise ConfigError('Invalid tree shape: "{}"'.format(shape_str))
+        if key not in shape or value < MIN_SHAPE.get(key, 0):
+            raise ConfigError('Invalid tree shape "{}" in "{}"'
+                              .format(key_value.strip(), shape_str))
+        shape[key] = value
+    if shape['attrs'] > len(EXTRA_ATTRS):
+        raise ConfigError('Tree shape attrs must be at most {}'
+                          .format(len(EXTRA_ATTRS)))
+    return shape
+
+
+def count(shape):
+    """Return the number of entries generated for each base DN."""
+    total = 1
+    level = 1
+    for _ in range(shape['depth'] + 1):
+        level *= shape['fanout']
+        total += level
+    return total + (1 if shape['group_size'] else 0)
+
+
+def generate(base_dn, shape=None):
+    """Yield (dn, attrs) for each entry of a tree below the given base DN.
+
+    The base DN entry comes first and every entry follows its parent. Each
+    level of organizational units below the base has fanout entries, and
+    the last of them fanout inetOrgPerson leaf entries each."""
+    shape = shape or DEFAULT_SHAPE
+    yield base_dn, _base_attrs(base_dn)
+    members = []
+    for dn, attrs in _generate_level(base_dn, shape, shape['depth'], ''):
+        if len(members) < shape['group_size'] and 'cn' in attrs:
+            members.append(dn)
+        yield dn, attrs
+    if shape['group_size']:
+        # Members beyond the number of leaf entries don't exist
+        members.extend(['uid=m{},{}'.format(index, base_dn) for index in
+                        range(len(members), shape['group_size'])])
+        yield 'cn=group,{}'.format(base_dn), {
+            'objectClass': ['top', 'groupOfNames'],
+            'cn': ['group'],
+            'member': members}
+
+
+def _generate_level(parent_dn, shape, depth, prefix):
+    """Yield the entries below the given parent DN."""
+    for index in range(shape['fanout']):
+        name = '{}{}'.format(prefix, index)
+        if depth:
+            dn = 'ou=u{},{}'.format(name, parent_dn)
+            yield dn, {'objectClass': ['top', 'organizationalUnit'],
+                       'ou': ['u{}'.format(name)]}
+            for entry in _generate_level(dn, shape, depth - 1,
+                                         '{}.'.format(name)):
+                yield entry
+        else:
+            yield 'cn=e{},{}'.format(name, parent_dn), \
+                _leaf_attrs(name, shape)
+
+
+def _base_attrs(base_dn):
+    """Return the attributes of the entry at a base DN."""
+    attr_type, value = ldap.dn.explode_dn(base_dn)[0].split('=', 1)
+    attr_type = attr_type.strip()
+    object_classes = BASE_OBJECT_CLASSES.get(attr_type.lower())
+    if object_classes is None:
+        attrs = {'objectClass': ['top', 'organizationalUnit',
+                                 'extensibleObject'],
+                 'ou': [value]}
+    else:
+        attrs = {'objectClass': object_classes}
+    attrs[attr_type] = [value]
+    if 'organization' in attrs['objectClass']:
+        attrs['o'] = [value]
+    return attrs
+
+
+def _leaf_attrs(name, shape):
+    """Return the attributes of a leaf entry."""
+    attrs = {'objectClass': ['top', 'person', 'organizationalPerson',
+                             'inetOrgPerson'],
+             'cn': ['e{}'.format(name)],
+             'sn': ['e{}'.format(name)]}
+    for attr in EXTRA_ATTRS[:shape['attrs']]:
+        # Values of an attribute must differ
+        attrs[attr] = ['{}-{}-'.format(name, index)
+                       .ljust(shape['value_size'], 'x')
+                       for index in range(shape['values'])]
+    return attrs
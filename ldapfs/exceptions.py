@@ -1,6 +1,9 @@
 
 """All LdapFS exceptions are defined here."""
 
+import errno
+
+
 class LdapfsException(Exception):
     """Base class for all LdapFS exceptions."""
     pass
@@ -26,6 +29,26 @@ class NoSuchHost(LdapException):
     pass
 
 
+class LdapUnavailable(LdapException):
+    """The LDAP host can't answer now, errno is reported to the kernel."""
+    errno = errno.EIO
+
+
+class LdapTimeout(LdapUnavailable):
+    """An LDAP call didn't complete within its deadline."""
+    errno = errno.ETIMEDOUT
+
+
+class HostDown(LdapUnavailable):
+    """The LDAP host is unreachable and being probed until it recovers."""
+    errno = errno.EHOSTDOWN
+
+
+class HostBusy(LdapUnavailable):
+    """The LDAP host's circuit breaker is open or too many calls wait on it."""
+    errno = errno.EAGAIN
+
+
 class ConfigError(LdapException):
     """Config parsing, formating or absence errors."""
     pass
@@ -0,0 +1,310 @@
+
+"""An in-memory LDAP directory for testing and benchmarking without servers.
+
+FakeConnection is an ldapcon.Connection whose connections are FakeLDAPObjects
+searching in-memory Directories instead of python-ldap LDAPObjects talking
+to servers. Everything above the python-ldap calls is the real code so
+LdapFS can be load tested and benchmarked offline."""
+
+import os
+import logging
+import itertools
+from time import sleep
+from collections import defaultdict
+import ldap
+from ldap.controls import SimplePagedResultsControl
+import ldif
+
+from .exceptions import LdapException
+from .ldapcon import Connection, Entry
+from .rootdse import RootDSE
+from . import dit
+
+LOG = logging.getLogger(__name__)
+
+
+class Directory(object):
+    """An in-memory tree of LDAP entries.
+
+    Entries are kept by normalised DN, with an index of each entry's
+    children. Entries need not have a parent in the directory, e.g. the
+    entries at base DNs."""
+
+    def __init__(self):
+        self.entries = {}                   # key -> (dn, attrs)
+        self.children = defaultdict(list)   # key -> child keys
+
+    @staticmethod
+    def key(dn):
+        """Return the normalised form of a DN, used as its key.
+
+           :raises: ldap.INVALID_DN_SYNTAX
+        """
+        try:
+            return ','.join(ldap.dn.explode_dn(dn)).lower()
+        except ldap.DECODING_ERROR:
+            raise ldap.INVALID_DN_SYNTAX({'desc': 'Invalid DN syntax',
+                                          'info': dn})
+
+    def add(self, dn, attrs):
+        """Add or replace the entry at the given DN."""
+        key = self.key(dn)
+        if key not in self.entries:
+            parts = ldap.dn.explode_dn(dn)
+            if len(parts) > 1:
+                self.children[','.join(parts[1:]).lower()].append(key)
+        self.entries[key] = (dn, attrs)
+
+    def load_ldif(self, ldif_file):
+        """Add the entries in the given LDIF file.
+
+           :raises: IOError, ValueError
+        """
+        with open(ldif_file) as in_file:
+            records = ldif.LDIFRecordList(in_file)
+            records.parse()
+        for dn, attrs in records.all_records:
+            self.add(dn, attrs)
+
+    def generate(self, base_dn, shape):
+        """Add a generated tree below the given base DN, see dit.generate."""
+        for dn, attrs in dit.generate(base_dn, shape):
+            self.add(dn, attrs)
+
+    def search(self, base, scope, attrlist=None, attrsonly=0):
+        """Return (dn, attrs) for the entries in scope of the base DN.
+
+        User attributes, or those named in attrlist, are returned. The
+        numSubordinates and hasSubordinates operational attributes are
+        only returned when named, as with a server.
+
+           :raises: ldap.NO_SUCH_OBJECT, ldap.INVALID_DN_SYNTAX
+        """
+        key = self.key(base)
+        if key not in self.entries:
+            raise ldap.NO_SUCH_OBJECT({'desc': 'No such object',
+                                       'info': base})
+        if scope == ldap.SCOPE_BASE:
+            keys = [key]
+        elif scope == ldap.SCOPE_ONELEVEL:
+            keys = self.children.get(key, [])
+        else:
+            keys = self._subtree(key)
+        wanted = [name.lower() for name in attrlist] if attrlist else None
+        return [self._result(child_key, wanted, attrsonly)
+                for child_key in keys if child_key in self.entries]
+
+    def naming_contexts(self):
+        """Return the DNs of the entries without a parent in the directory."""
+        children = set()
+        for key, child_keys in self.children.iteritems():
+            if key in self.entries:
+                children.update(child_keys)
+        return sorted(dn for key, (dn, _) in self.entries.iteritems()
+                      if key not in children)
+
+    def _subtree(self, key):
+        """Return the keys of an entry and all entries below it."""
+        keys = [key]
+        for child_key in self.children.get(key, []):
+            keys.extend(self._subtree(child_key))
+        return keys
+
+    def _result(self, key, wanted, attrsonly):
+        """Return the (dn, attrs) search result for an entry."""
+        dn, attrs = self.entries[key]
+        result = {}
+        for name, vals in attrs.iteritems():
+            if wanted is None or name.lower() in wanted:
+                result[name] = [] if attrsonly else list(vals)
+        if wanted:
+            children = len(self.children.get(key, []))
+            for name in Entry.SUBORDINATE_ATTRS:
+                if name.lower() in wanted:
+                    if name == 'numSubordinates':
+                        vals = [str(children)]
+                    else:
+                        vals = ['TRUE' if children else 'FALSE']
+                    result[name] = [] if attrsonly else vals
+        return dn, result
+
+
+class FakeLDAPObject(object):
+    """Stands in for a python-ldap LDAPObject connected to a Directory.
+
+    Only the calls made by ldapcon.Connection are supported. Operations are
+    answered when sent and their results kept until collected by result3,
+    which is delayed by latency seconds to simulate a server's response
+    time, or times out if that is longer than its timeout. The Root DSE
+    lists the directory's top entries as naming contexts and the paged
+    results control, which is supported for one level searches."""
+
+    DEFAULT_FILTER = '(objectClass=*)'
+    SUPPORTED_CONTROLS = [RootDSE.CONTROLS['paged_results']]
+
+    def __init__(self, directory, latency=0):
+        self.directory = directory
+        self.latency = latency
+        self.options = {}
+        self.msgids = itertools.count(1)
+        # msgid -> (result type, results or error, response controls)
+        self.results = {}
+
+    def _send(self, result_type, operation, *args):
+        """Run an operation, keeping its outcome for result3."""
+        msgid = next(self.msgids)
+        try:
+            result = operation(*args)
+        except ldap.LDAPError as ex:
+            result = ex
+        self.results[msgid] = (result_type, result, [])
+        return msgid
+
+    def set_option(self, option, value):
+        """Set an option, which has no effect on the fake."""
+        self.options[option] = value
+
+    def simple_bind(self, who='', cred=''):
+        """Send a bind, which always succeeds."""
+        # pylint: disable-msg=W0613
+        return self._send(ldap.RES_BIND, list)
+
+    def sasl_interactive_bind_s(self, who, auth, serverctrls=None,
+                                clientctrls=None, sasl_flags=0):
+        """Bind synchronously, which always succeeds after the latency."""
+        # pylint: disable-msg=R0913,W0613
+        if self.latency:
+            sleep(self.latency)
+
+    def search_ext(self, base, scope, filterstr=DEFAULT_FILTER, attrlist=None,
+                   attrsonly=0, serverctrls=None, clientctrls=None,
+                   timeout=-1, sizelimit=0):
+        """Send a search of the directory, or of the Root DSE.
+
+        Only the default filter is supported, and of the server controls
+        only the paged results control."""
+        # pylint: disable-msg=R0913,W0613
+        if filterstr.lower() != self.DEFAULT_FILTER.lower():
+            raise ldap.UNWILLING_TO_PERFORM({'desc': 'Unsupported filter',
+                                             'info': filterstr})
+        if not base and scope == ldap.SCOPE_BASE:
+            return self._send(ldap.RES_SEARCH_RESULT, self._root_dse)
+        msgid = self._send(ldap.RES_SEARCH_RESULT, self.directory.search,
+                           base, scope, attrlist, attrsonly)
+        for control in serverctrls or []:
+            if control.controlType == SimplePagedResultsControl.controlType:
+                self._page(msgid, control)
+        return msgid
+
+    def _root_dse(self):
+        """Return the search results for the Root DSE."""
+        return [('', {'namingContexts': self.directory.naming_contexts(),
+                      'supportedControl': list(self.SUPPORTED_CONTROLS)})]
+
+    def _page(self, msgid, control):
+        """Cut a search's results down to the page the control asks for.
+
+        The cookie is the offset of the page in the results."""
+        result_type, result, _ = self.results[msgid]
+        if isinstance(result, ldap.LDAPError):
+            return
+        offset = int(control.cookie or 0)
+        end = offset + control.size
+        cookie = str(end) if end < len(result) else ''
+        self.results[msgid] = (result_type, result[offset:end], [
+            SimplePagedResultsControl(False, size=control.size,
+                                      cookie=cookie)])
+
+    def result3(self, msgid, all=1, timeout=-1):
+        """Return the result of an operation after the latency.
+
+        ldap.TIMEOUT is raised if the latency is longer than the timeout,
+        and the operation's error raised if it failed."""
+        # pylint: disable-msg=W0622,W0613
+        if 0 <= timeout < self.latency:
+            sleep(timeout)
+            raise ldap.TIMEOUT({'desc': 'Timed out'})
+        if self.latency:
+            sleep(self.latency)
+        result_type, result, controls = self.results.pop(msgid)
+        if isinstance(result, ldap.LDAPError):
+            raise result
+        return result_type, result, msgid, controls
+
+    def abandon_ext(self, msgid, serverctrls=None, clientctrls=None):
+        """Drop the result of an operation."""
+        # pylint: disable-msg=W0613
+        self.results.pop(msgid, None)
+
+    def unbind(self):
+        """Drop the results of all operations."""
+        self.results.clear()
+
+
+class FakeConnection(Connection):
+    """A Connection to in-memory directories rather than LDAP servers.
+
+    Each host's directory is loaded from the LDIF file named by its
+    fake_ldif config or, failing that, generated below each of its base DNs
+    with the shape in its fake_tree config (see dit). Calls to a host are
+    delayed by the milliseconds in its fake_latency config."""
+
+    def __init__(self, hosts, **kwargs):
+        Connection.__init__(self, hosts, **kwargs)
+        self.directories = {}       # host -> Directory, kept over reconnects
+
+    def _connect(self, host, values, uri):
+        """Return a connection to the given host's directory.
+
+        All replicas of a host share its directory."""
+        directory = self.directories.get(host)
+        if directory is None:
+            directory = self.directories[host] = self._load(host, values)
+        con = FakeLDAPObject(directory,
+                             values.get('fake_latency', 0) / 1000.0)
+        try:
+            self._bind(host, values, con)
+        except ldap.LDAPError as ex:
+            raise LdapException('Error binding to {}: {}'.format(uri, ex))
+        return con
+
+    @staticmethod
+    def _load(host, values):
+        """Return a new directory for the given host."""
+        directory = Directory()
+        if values.get('fake_ldif'):
+            try:
+                directory.load_ldif(values['fake_ldif'])
+            except (IOError, ValueError) as ex:
+                raise LdapException('Error loading {} for host={}: {}'
+                                    .format(values['fake_ldif'], host, ex))
+        else:
+            for base_dn in values.get('base_dns', []):
+                directory.generate(base_dn, values.get('fake_tree'))
+        LOG.debug('Loaded %d entries for host=%s', len(directory.entries),
+                  host)
+        return directory
+
+
+def write_config(path, host, base_dns, base_config=None, host_config=None):
+    """Write an LdapFS config file using the fake backend for one host.
+
+    The given dicts add to or replace the [ldapfs] and host settings, e.g.
+    to set fake_tree and fake_latency."""
+    base = {'log_file': os.devnull,
+            'log_format': '%%(funcName)s() - %%(message)s',
+            'log_levels': 'root:error',
+            'backend': 'fake'}
+    base.update(base_config or {})
+    values = {'host': host, 'port': 389, 'bind_dn': 'cn=fake',
+              'bind_password': 'fake',
+              'base_dns': ' '.join(['"{}"'.format(base_dn)
+                                    for base_dn in base_dns]),
+              'ldap_trace_level': 0}
+    values.update(host_config or {})
+    with open(path, 'w') as config_file:
+        for section, section_values in (('ldapfs', base), (host, values)):
+            config_file.write('[{}]\n'.format(section))
+            for key, value in sorted(section_values.items()):
+                config_file.write('{} = {}\n'.format(key, value))
+            config_file.write('\n')
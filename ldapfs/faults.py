@@ -0,0 +1,234 @@
+
+"""Latency and fault injection into LDAP calls for tail latency testing.
+
+Faults are injected by wrapping the python-ldap LDAPObjects, real or fake,
+of a Connection. They are given per operation, as a string such as:
+
+    search: delay=exp:20, stall=0.01:3000, error=0.02:BUSY, drop=0.001;
+    bind: delay=fixed:100
+
+where each operation's faults are any of:
+
+    delay=<distribution>    delay every call, times in milliseconds:
+                            fixed:<ms>, uniform:<min>:<max>, exp:<mean>
+                            or lognormal:<median>:<sigma>
+    stall=<rate>:<ms>       delay this fraction of calls by a long time
+    error=<rate>:<name>     fail this fraction of calls with the named
+                            python-ldap error, e.g. BUSY or UNAVAILABLE
+    drop=<rate>             drop the connection on this fraction of calls,
+                            all later calls on it fail with SERVER_DOWN
+
+The operations are search, bind and unbind.
+
+       Setup with: install(connection, parse_faults(faults_str))
+"""
+
+import ldap
+import random
+import logging
+import threading
+from time import sleep
+
+from .exceptions import ConfigError
+
+LOG = logging.getLogger(__name__)
+
+# Operation of each synchronous LDAPObject method faults are injected into
+OPERATIONS = {'search_st': 'search', 'search_s': 'search',
+              'search_ext_s': 'search',
+              'simple_bind_s': 'bind', 'sasl_interactive_bind_s': 'bind',
+              'unbind': 'unbind', 'unbind_s': 'unbind'}
+# Operation of each asynchronous method, whose faults are injected when
+# result3 waits for the result
+ASYNC_OPERATIONS = {'search_ext': 'search', 'simple_bind': 'bind'}
+
+
+class Faults(object):
+    """The faults to inject into calls of one operation."""
+
+    DISTRIBUTIONS = {
+        'fixed': (1, lambda rnd, ms: ms),
+        'uniform': (2, lambda rnd, low, high: rnd.uniform(low, high)),
+        'exp': (1, lambda rnd, mean: rnd.expovariate(1.0 / mean)),
+        'lognormal': (2, lambda rnd, median, sigma:
+                      median * rnd.lognormvariate(0, sigma)),
+    }
+
+    def __init__(self, delay=None, stall=(0, 0), error=(0, None), drop=0):
+        self.delay = delay      # (distribution name, params in ms)
+        self.stall = stall      # (rate, ms)
+        self.error = error      # (rate, python-ldap exception class)
+        self.drop = drop        # rate
+
+    def delay_time(self, rnd):
+        """Return a random delay in seconds for one call."""
+        delay = 0.0
+        if self.delay:
+            name, params = self.delay
+            delay = self.DISTRIBUTIONS[name][1](rnd, *params)
+        if self.stall[0] and rnd.random() < self.stall[0]:
+            delay += self.stall[1]
+        return max(delay, 0.0) / 1000.0
+
+    @classmethod
+    def parse(cls, faults_str):
+        """Return Faults for a comma separated list of faults.
+
+           :raises: ConfigError
+        """
+        faults = cls()
+        for fault in faults_str.split(','):
+            if not fault.strip():
+                continue
+            try:
+                key, value = [part.strip() for part in fault.split('=')]
+                params = value.split(':')
+                if key == 'delay':
+                    nparams = cls.DISTRIBUTIONS[params[0]][0]
+                    if len(params) != nparams + 1:
+                        raise ValueError()
+                    faults.delay = (params[0],
+                                    [float(param) for param in params[1:]])
+                elif key == 'stall':
+                    faults.stall = (float(params[0]), float(params[1]))
+                elif key == 'error':
+                    error = getattr(ldap, params[1])
+                    if not issubclass(error, ldap.LDAPError):
+                        raise ValueError()
+                    faults.error = (float(params[0]), error)
+                elif key == 'drop':
+                    faults.drop = float(value)
+                else:
+                    raise ValueError()
+            except (ValueError, KeyError, IndexError, AttributeError,
+                    TypeError):
+                raise ConfigError('Invalid fault "{}"'.format(fault.strip()))
+        return faults
+
+
+def parse_faults(faults_str):
+    """Return a dict of operation to Faults for the given faults string.
+
+       :raises: ConfigError
+    """
+    faults = {}
+    for op_faults in faults_str.split(';'):
+        if not op_faults.strip():
+            continue
+        try:
+            op, op_faults = op_faults.split(':', 1)
+        except ValueError:
+            raise ConfigError('Invalid faults "{}"'.format(op_faults.strip()))
+        op = op.strip()
+        if op not in OPERATIONS.values() + ASYNC_OPERATIONS.values():
+            raise ConfigError('Invalid faults operation "{}"'.format(op))
+        faults[op] = Faults.parse(op_faults)
+    return faults
+
+
+class FaultyLDAPObject(object):
+    """Wrap an LDAPObject, injecting faults into its calls."""
+
+    def __init__(self, con, faults, rnd=None):
+        self.con = con
+        self.faults = faults
+        self.rnd = rnd or random.Random()
+        self.dropped = False
+        self.pending = {}       # msgid -> operation of async calls
+
+    def __getattr__(self, attr_name):
+        attr = getattr(self.con, attr_name)
+        if attr_name in ASYNC_OPERATIONS:
+            return self._async_method(attr, ASYNC_OPERATIONS[attr_name])
+        elif attr_name == 'result3':
+            return self._result_method(attr)
+        faults = self.faults.get(OPERATIONS.get(attr_name))
+        if not faults:
+            return attr
+
+        def method(*args, **kwargs):
+            """Inject faults then make the call."""
+            self._inject(attr_name, faults)
+            return attr(*args, **kwargs)
+        return method
+
+    def _async_method(self, attr, op):
+        """Return a method starting an operation, noting its message id."""
+        def method(*args, **kwargs):
+            """Start the operation unless the connection was dropped."""
+            if self.dropped:
+                raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+            msgid = attr(*args, **kwargs)
+            self.pending[msgid] = op
+            return msgid
+        return method
+
+    def _result_method(self, attr):
+        """Return a result3 method injecting the faults of the operation."""
+        def method(msgid, *args, **kwargs):
+            """Inject faults then wait for the result."""
+            faults = self.faults.get(self.pending.pop(msgid, None))
+            if faults:
+                timeout = kwargs.get('timeout', args[1] if len(args) > 1
+                                     else -1)
+                self._inject('result3', faults, timeout)
+            return attr(msgid, *args, **kwargs)
+        return method
+
+    def _inject(self, name, faults, timeout=-1):
+        """Delay and/or fail a call as the faults dictate.
+
+        A delay longer than a given timeout raises ldap.TIMEOUT at the
+        timeout."""
+        if self.dropped:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        delay = faults.delay_time(self.rnd)
+        if timeout is not None and 0 <= timeout < delay:
+            sleep(timeout)
+            LOG.debug('Injected timeout in %s', name)
+            raise ldap.TIMEOUT({'desc': 'Timed out'})
+        if delay:
+            sleep(delay)
+        if faults.drop and self.rnd.random() < faults.drop:
+            LOG.debug('Injected dropped connection in %s', name)
+            self.dropped = True
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        rate, error = faults.error
+        if rate and self.rnd.random() < rate:
+            LOG.debug('Injected %s in %s', error.__name__, name)
+            raise error({'desc': 'Injected fault'})
+
+
+def install(connection, faults, hosts=None, seed=None):
+    """Inject faults into the calls a Connection makes to the given hosts.
+
+    Faults are injected into all hosts if none are given. Open connections
+    are wrapped as well as any made later. A seed makes the faults
+    injected repeatable."""
+    rnd = random.Random(seed)
+    lock = threading.Lock()
+    connect = connection._connect      # pylint: disable-msg=W0212
+    bind = connection._bind            # pylint: disable-msg=W0212
+
+    def wrap(host, con):
+        """Return the given LDAPObject wrapped if faults apply to its host."""
+        if hosts is not None and host not in hosts:
+            return con
+        with lock:
+            host_rnd = random.Random(rnd.random())
+        return FaultyLDAPObject(con, faults, host_rnd)
+
+    def faulty_connect(host, values, uri):
+        """Connect as usual and wrap the new connection."""
+        return wrap(host, connect(host, values, uri))
+
+    def faulty_bind(host, values, con):
+        """Bind the connection being made through a wrapper."""
+        return bind(host, values, wrap(host, con))
+
+    connection._connect = faulty_connect    # pylint: disable-msg=W0212
+    connection._bind = faulty_bind          # pylint: disable-msg=W0212
+    for host, values in connection.hosts.iteritems():
+        for replica in values.get('replicas', []):
+            if replica.con:
+                replica.con = wrap(host, replica.con)
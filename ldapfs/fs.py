@@ -1,13 +1,30 @@
 
-"""Fuse Stat structure for LdapFS."""
+"""Fuse Stat and file handle structures for LdapFS."""
 
 import fuse
+import os
 import stat
+import hashlib
 from time import time
 import logging
 
 LOG = logging.getLogger(__name__)
 
+# Directory entry types (the d_type of struct dirent) as used by fuse.Direntry
+DT_UNKNOWN = 0
+DT_DIR = stat.S_IFDIR >> 12
+DT_REG = stat.S_IFREG >> 12
+
+
+def inode(fspath):
+    """Return a stable inode number for the given path.
+
+    The same path always maps to the same inode number, whether it is
+    reported by getattr or readdir."""
+    digest = hashlib.md5(os.path.normpath(fspath)).hexdigest()
+    # Keep clear of the reserved inode numbers and within 63 bits
+    return int(digest[:15], 16) + 2
+
 
 # pylint: disable-msg=R0903
 class Stat(fuse.Stat):
@@ -31,11 +48,12 @@ class Stat(fuse.Stat):
              'st_blksize': 0,
              'st_ino': 0}
 
-    def __init__(self, isdir=True, size=DIR_SIZE):
+    def __init__(self, isdir=True, size=DIR_SIZE, nlink=1):
         fuse.Stat.__init__(self)
         now = int(time())
         inst_dict = {'st_mode': isdir and Stat.DIR_MODE or Stat.FILE_MODE,
                      'st_size': size,
+                     'st_nlink': nlink,
                      'st_blocks': self.size2blocks(size),
                      'st_atime': now,
                      'st_mtime': now,
@@ -49,7 +67,42 @@ class Stat(fuse.Stat):
         return '|'.join(['{}={}'.format(k, getattr(self, k))
                          for k in Stat.ATTRS])
 
+    @staticmethod
+    def dir_nlink(subdirs):
+        """Return the link count of a directory with the given subdirs.
+
+        A directory has a link for its own "." entry, one from its parent and
+        one for each subdirectory's "..". find and other fts based tools rely
+        on this to skip leaf directories. When the number of subdirectories
+        isn't known 1 is used, which tells those tools not to rely on it."""
+        return 1 if subdirs is None else subdirs + 2
+
     @staticmethod
     def size2blocks(size):
         """Return the number of blocks needed for the given size."""
         return (size + Stat.BLOCK_SIZE - 1) / Stat.BLOCK_SIZE
+
+
+class File(object):
+    """An open file handle holding a snapshot of the file's text.
+
+    The text is rendered once when the file is opened so all reads through
+    the handle are consistent and need no further LDAP requests."""
+
+    # Read by fuse-python from the handle returned by open
+    direct_io = False
+    keep_cache = False
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return 'File(size={})'.format(len(self.text or ''))
+
+    def read(self, size, offset):
+        """Return up to size bytes of the file's text from offset."""
+        return self.text[offset:offset + size]
+
+    def release(self):
+        """Free the file's text. The handle is no longer readable."""
+        self.text = None
@@ -0,0 +1,68 @@
+
+"""Instrumentation of FUSE entry points and LDAP calls."""
+
+import functools
+import types
+import logging
+from time import time
+
+LOG = logging.getLogger(__name__)
+
+
+class Instrument(object):
+    """Wrap methods of an object so each call is passed to recorders.
+
+    A recorder is a callable invoked after every call of a wrapped method as:
+
+        recorder(name, args, result, error, start, elapsed)
+
+    where error is the exception raised by the call (result is then None),
+    start is the time the call started and elapsed its duration in seconds.
+    Recorders must be cheap, they run on the request path.
+
+    Methods are only wrapped when there are recorders so there is no cost
+    at all when nothing is being recorded."""
+
+    def __init__(self):
+        self.recorders = []
+
+    def add(self, recorder):
+        """Add a recorder to be called for every wrapped method call."""
+        self.recorders.append(recorder)
+
+    def wrap(self, obj, attr_names, prefix):
+        """Replace the named methods of obj with instrumented versions.
+
+        Calls are recorded with the name prefix + method name, with any
+        leading underscores removed from the method name."""
+        if not self.recorders:
+            return
+        for attr_name in attr_names:
+            method = getattr(obj, attr_name)
+            setattr(obj, attr_name,
+                    self._wrapper(prefix + attr_name.lstrip('_'), method))
+
+    def _wrapper(self, name, method):
+        """Return an instrumented version of the given method."""
+        recorders = self.recorders
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            """Call the wrapped method and pass the outcome to recorders."""
+            start = time()
+            try:
+                result = method(*args, **kwargs)
+                if isinstance(result, types.GeneratorType):
+                    # e.g. readdir - time the work, not creating a generator
+                    result = list(result)
+            except Exception as ex:
+                elapsed = time() - start
+                for recorder in recorders:
+                    recorder(name, args, None, ex, start, elapsed)
+                raise
+            elapsed = time() - start
+            for recorder in recorders:
+                recorder(name, args, result, None, start, elapsed)
+            return result
+
+        return wrapper
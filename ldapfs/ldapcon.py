@@ -4,9 +4,18 @@
 Multiple LDAP servers and base-dns are supported at once."""
 
 import ldap
+import ldap.sasl
 import logging
+import random
+import threading
+from time import time
+from ldap.controls import SimplePagedResultsControl
 
 from .exceptions import LdapException, InvalidDN, NoSuchObject, NoSuchHost
+from .exceptions import LdapUnavailable, LdapTimeout, HostDown, HostBusy
+from .cache import EntryCache
+from .breaker import CircuitBreaker, Admission
+from .rootdse import RootDSE
 
 LOG = logging.getLogger(__name__)
 
@@ -15,11 +24,17 @@ class Entry(object):
     """A thin wrapper for an LDAP Entry with conversion to/from strings."""
 
     ALL_ATTRIBUTES = '=attributes'
+    # Operational attributes describing an entry's children. Servers support
+    # one or both of these.
+    SUBORDINATE_ATTRS = ['numSubordinates', 'hasSubordinates']
 
     def __init__(self, dn, attrs):
         self.dn = dn
         self.attrs = attrs
 
+    def __str__(self):
+        return 'Entry({})'.format(self.dn)
+
     def text(self, attr_name):
         """Return text representing the given attribute name.
 
@@ -52,47 +67,541 @@ class Entry(object):
         """Return the size of text representation of the given attribute."""
         return len(self.text(attr_name))
 
+    def subordinates(self):
+        """Return the number of child objects of this entry.
+
+        This is taken from the numSubordinates or hasSubordinates operational
+        attributes, if they were requested and the server supports them. None
+        is returned if the number of children isn't known."""
+        has_subordinates = None
+        for key, vals in self.attrs.iteritems():
+            key = key.lower()
+            if key == 'numsubordinates' and vals:
+                try:
+                    return int(vals[0])
+                except ValueError:
+                    LOG.debug('Invalid numSubordinates=%s for dn=%s',
+                              vals[0], self.dn)
+            elif key == 'hassubordinates' and vals:
+                has_subordinates = vals[0].upper()
+
+        # Only a leaf entry tells us how many children there are
+        return 0 if has_subordinates == 'FALSE' else None
+
+    def is_leaf(self):
+        """Return True if this entry has no children, False if it has.
+
+        None is returned if it isn't known, see subordinates()."""
+        subordinates = self.subordinates()
+        if subordinates is not None:
+            return subordinates == 0
+        for key, vals in self.attrs.iteritems():
+            if key.lower() == 'hassubordinates' and vals:
+                return vals[0].upper() == 'FALSE'
+        return None
+
+    def count(self, attr_name):
+        """Return the number of values of the given attribute."""
+        return len(self.attrs.get(attr_name) or [])
+
+    def value_text(self, attr_name, index):
+        """Return text representing a single value of the given attribute.
+
+        The value is selected by its index in the attribute's list of values.
+        AttributeError is raised if there is no such attribute or value."""
+        vals = self.attrs.get(attr_name)
+        if not vals or not 0 <= index < len(vals):
+            raise AttributeError()
+        return vals[index] + '\n'
+
+
+class Replica(object):
+    """One server of a host, with the recent latency of its searches."""
+
+    ALPHA = 0.2     # weight of each new search in the moving average
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.con = None
+        self.latency = None     # EWMA of search times in seconds
+        self.searches = 0
+        self.root_dse = RootDSE()
+        self.down_since = None
+        self.down_error = None
+        self.next_probe = 0
+
+    def is_up(self):
+        """Is the replica connected?"""
+        return self.con is not None and self.down_since is None
+
+    def observe(self, elapsed):
+        """Add the time taken by a search to the latency average."""
+        self.searches += 1
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.ALPHA * (elapsed - self.latency)
+
+    def state(self):
+        """Return text describing the replica."""
+        if self.down_since is not None:
+            return '{} down for {:.0f}s: {}'.format(
+                self.uri, time() - self.down_since, self.down_error)
+        if self.latency is None:
+            return '{} up'.format(self.uri)
+        return '{} up {:.1f}ms'.format(self.uri, self.latency * 1000)
+
 
 class Connection(object):
-    """An abstraction of an LDAP connection supporting multiple servers."""
+    """An abstraction of an LDAP connection supporting multiple servers.
+
+    Each host's calls are bounded by the deadlines in its config, all in
+    milliseconds and unlimited if absent or 0:
+
+        network_timeout     connecting to the server, 2000 by default
+        bind_timeout        each bind
+        search_timeout      each search
+        op_timeout          all searches made by one file system operation,
+                            counted from begin() in the calling thread
+
+    Searches past their deadline are abandoned and LdapTimeout raised.
+
+    A host's uris config lists the servers replicating its directory,
+    ldap://host:port if absent. ldaps:// and ldapi:// (Unix socket) URIs
+    are supported as well as StartTLS on ldap:// with start_tls, verified
+    against the CA certificates in tls_cacert unless tls_require_cert is
+    false. Binds are simple with bind_dn and bind_password, or with
+    sasl_mech EXTERNAL using the identity of the socket or certificate.
+    The Root DSE of each replica is read when it's connected, see
+    capabilities(). One level searches of replicas supporting paged
+    results are made in pages of page_size entries (default 1000, 0 to
+    disable) so large dirs can be listed within server size limits. With
+    discover_base_dns, the naming contexts of a host are added to its
+    base_dns.
+
+    Each search goes to the connected replica
+    with the lowest moving average latency, or now and then to another one
+    to keep its average current, and moves on to the next replica when
+    one can't be reached.
+
+    With an entry_cache_ttl, the results of get and get_children are cached
+    and served stale for up to entry_cache_max_stale seconds more while
+    refreshed in the background, see cache.EntryCache.
+
+    The hosts are connected in parallel by open(), or in the background
+    with lazy_connect, searches of a host waiting for it to be connected.
+
+    A host none of whose replicas can be reached is marked down. Searches
+    of it fail at once with HostDown, or are answered from the entry cache
+    whatever the age of the results, while a prober thread tries to
+    reconnect to each replica down every probe_interval seconds (host
+    config, default 10).
 
-    def __init__(self, hosts):
+    A host's searches can also be guarded by a circuit breaker, opened for
+    breaker_reset seconds (default 30) when breaker_threshold percent of
+    the last breaker_window searches (default 20) failed or took longer
+    than breaker_slow_call milliseconds, and by admission control limiting
+    the searches in flight to max_in_flight, with up to max_queued more
+    waiting for at most queue_timeout milliseconds. Searches turned away
+    raise HostBusy. Like HostDown, any LdapUnavailable error is answered
+    from the entry cache when it can be, see breaker."""
+
+    LEAF_CACHE_SIZE = 100000    # max number of cached leaf flags
+    DEFAULT_NETWORK_TIMEOUT = 2000  # milliseconds
+    DEFAULT_PROBE_INTERVAL = 10     # seconds
+    PROBE_TICK = 0.5                # seconds between checks for probes due
+    EXPLORE = 0.05                  # fraction of searches to any replica
+    DEFAULT_PAGE_SIZE = 1000        # entries per page of paged searches
+    # Errors meaning the server can't be reached
+    DOWN_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR)
+
+    def __init__(self, hosts, leaf_cache_ttl=0, entry_cache_ttl=0,
+                 entry_cache_max_stale=0, lazy_connect=False):
         self.hosts = hosts.copy()
+        # Maps (host, dn) to (is-leaf, expiry time) for recently seen objects
+        self.leaf_cache_ttl = leaf_cache_ttl
+        self.leaves = {}
+        self.leaf_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.entry_cache = None
+        if entry_cache_ttl:
+            self.entry_cache = EntryCache(entry_cache_ttl,
+                                          entry_cache_max_stale)
+        # Start time of the current file system operation in each thread
+        self.operation = threading.local()
+        self.state_lock = threading.Lock()  # guards hosts going down/up
+        self.stopping = threading.Event()
+        self.prober = None
+        self.breakers = {}      # host -> CircuitBreaker (optional)
+        self.admissions = {}    # host -> Admission (optional)
+        self.lazy_connect = lazy_connect
+        self.connectors = []    # threads connecting to the hosts
+        # Events set when each host being connected is done
+        self.connecting = {}
 
     def open(self):
-        """Open connections to all configured LDAP hosts."""
+        """Open connections to all configured LDAP hosts in parallel.
+
+        With lazy_connect, return at once and leave them connecting in the
+        background. A host's searches then wait for it to be done, and a
+        host that can't be reached is marked down.
+
+           :raises: LdapException unless lazy_connect
+        """
+        errors = []
+        connectors = []
         for host, values in self.hosts.iteritems():
-            values['con'] = self._connect(host, values)
+            self._add_guards(host, values)
+            self.connecting[host] = threading.Event()
+            connector = threading.Thread(
+                target=self._open_host, args=(host, values, errors),
+                name='connect-{}'.format(host))
+            connector.daemon = True
+            connectors.append(connector)
+        for connector in connectors:
+            connector.start()
+        self.connectors.extend(connectors)
+        if not self.lazy_connect:
+            self._join_connectors()
+            if errors:
+                raise errors[0]
+        if self.entry_cache:
+            self.entry_cache.start()
+        if not self.prober:
+            self.stopping.clear()
+            self.prober = threading.Thread(target=self._probe,
+                                           name='host-prober')
+            self.prober.daemon = True
+            self.prober.start()
+
+    def _add_guards(self, host, values):
+        """Create the host's circuit breaker and admission control."""
+        if values.get('breaker_threshold') and host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(
+                values['breaker_threshold'], values.get('breaker_window', 20),
+                values.get('breaker_slow_call', 0) / 1000.0,
+                values.get('breaker_reset', 30))
+        if values.get('max_in_flight') and host not in self.admissions:
+            self.admissions[host] = Admission(
+                values['max_in_flight'], values.get('max_queued', 0),
+                values.get('queue_timeout', 0) / 1000.0)
+
+    def _open_host(self, host, values, errors):
+        """Connect to a host, adding any error to errors (connector thread)."""
+        start = time()
+        try:
+            self._connect_replicas(host, values)
+            LOG.debug('Connected to LDAP host=%s in %.3fs', host,
+                      time() - start)
+        except LdapException as ex:
+            errors.append(ex)
+            if self.lazy_connect:
+                LOG.warning('LDAP host=%s is down, probing until it '
+                            'recovers: %s', host, ex)
+        finally:
+            self.connecting.pop(host).set()
+
+    def _join_connectors(self):
+        """Wait for the hosts being connected."""
+        for connector in self.connectors:
+            connector.join()
+        self.connectors = []
+
+    def _connect_replicas(self, host, values):
+        """Connect to each of the host's replicas.
+
+        Replicas that can't be reached are left down to be probed, and the
+        host too if none can be.
+
+           :raises: LdapException if none can be connected
+        """
+        uris = values.get('uris') or \
+            ['ldap://{}:{}'.format(host, values['port'])]
+        replicas = [Replica(uri) for uri in uris]
+        errors = []
+        for replica in replicas:
+            try:
+                replica.con = self._connect(host, values, replica.uri)
+                replica.root_dse = self._read_root_dse(host, values,
+                                                       replica.con)
+                values['connects'] = values.get('connects', 0) + 1
+            except LdapException as ex:
+                if len(uris) > 1:
+                    LOG.warning('Replica uri=%s of LDAP host=%s is down: %s',
+                                replica.uri, host, ex)
+                replica.down_since = time()
+                replica.down_error = str(ex)
+                errors.append(ex)
+        with self.state_lock:
+            values['replicas'] = replicas
+            if len(errors) == len(replicas):
+                self._mark_host_down(values, errors[0])
+                raise errors[0]
+            values.pop('down_since', None)
+            values.pop('down_error', None)
+        if values.get('discover_base_dns'):
+            self._discover_base_dns(host, values)
+
+    def _read_root_dse(self, host, values, con):
+        """Return the RootDSE of a new connection, empty if it can't be
+        read.
+
+           :raises: LdapException if the server can't be reached
+        """
+        msgid = None
+        try:
+            msgid = con.search_ext('', ldap.SCOPE_BASE,
+                                   attrlist=RootDSE.ATTRS)
+            results = con.result3(msgid, all=1, timeout=self._timeout(
+                values.get('search_timeout')))[1]
+        except self.DOWN_ERRORS as ex:
+            try:
+                con.unbind()
+            except ldap.LDAPError:
+                pass
+            raise LdapException('Error reading the Root DSE of host={}: {}'
+                                .format(host, ex))
+        except ldap.LDAPError as ex:
+            if isinstance(ex, ldap.TIMEOUT):
+                try:
+                    con.abandon_ext(msgid)
+                except ldap.LDAPError:
+                    pass
+            LOG.warning('Error reading the Root DSE of host=%s: %s', host,
+                        ex)
+            return RootDSE()
+        root_dse = RootDSE(results[0][1] if results else None)
+        LOG.debug('LDAP host=%s supports: %s', host, root_dse)
+        return root_dse
 
     @staticmethod
-    def _connect(host, values):
-        """Connect and return a connection to the given host."""
+    def _discover_base_dns(host, values):
+        """Add the naming contexts of the host's replicas to its base_dns."""
+        base_dns = list(values.get('base_dns', []))
+        known = set(dn.lower() for dn in base_dns)
+        for replica in values['replicas']:
+            for dn in replica.root_dse.naming_contexts:
+                if dn.lower() not in known:
+                    LOG.info('Found base DN=%s on LDAP host=%s', dn, host)
+                    base_dns.append(dn)
+                    known.add(dn.lower())
+        values['base_dns'] = base_dns
+
+    def capabilities(self, host):
+        """Return the capabilities of a host's best replica, see RootDSE.
+
+        The dict is empty if none is connected."""
+        try:
+            replica = self._route(self.hosts[host])
+        except KeyError:
+            return {}
+        return replica.root_dse.capabilities
+
+    def capabilities_text(self):
+        """Return text listing what each host's replicas support."""
+        lines = []
+        for host, values in sorted(self.hosts.items()):
+            for replica in values.get('replicas', []):
+                if replica.is_up():
+                    lines.append('{} {}: {}\n'.format(host, replica.uri,
+                                                      replica.root_dse))
+        return ''.join(lines)
+
+    def _connect(self, host, values, uri):
+        """Connect and return a connection to the given replica of a host."""
         try:
-            bind_uri = 'ldap://{}:{}'.format(host, values['port'])
-            LOG.debug('Binding to uri={}'.format(bind_uri))
-            con = ldap.initialize(bind_uri,
+            LOG.debug('Binding to uri=%s', uri)
+            con = ldap.initialize(uri,
                                   trace_level=values['ldap_trace_level'])
-            con.set_option(ldap.OPT_NETWORK_TIMEOUT, 2.0)
-            con.simple_bind_s(values['bind_dn'], values['bind_password'])
-            LOG.debug('LDAP session established with host={}'.format(host))
+            con.set_option(ldap.OPT_NETWORK_TIMEOUT,
+                           self._timeout(values.get(
+                               'network_timeout',
+                               self.DEFAULT_NETWORK_TIMEOUT)))
+            start_tls = values.get('start_tls') and uri.startswith('ldap://')
+            if start_tls or uri.startswith('ldaps://'):
+                self._set_tls_options(con, values)
+            if start_tls:
+                con.start_tls_s()
+            self._bind(host, values, con)
+            LOG.debug('LDAP session established with host=%s', host)
             return con
         except ldap.INVALID_DN_SYNTAX as ex:
             raise InvalidDN(str(ex))
         except ldap.LDAPError as ex:
-            raise LdapException('Error binding to {}: {}'.format(bind_uri, ex))
+            raise LdapException('Error binding to {}: {}'.format(uri, ex))
+
+    @staticmethod
+    def _set_tls_options(con, values):
+        """Set the TLS options of a connection from the host's config."""
+        if values.get('tls_cacert'):
+            con.set_option(ldap.OPT_X_TLS_CACERTFILE, values['tls_cacert'])
+        if not values.get('tls_require_cert', True):
+            con.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+        # Must come last to apply the options above
+        con.set_option(ldap.OPT_X_TLS_NEWCTX, 0)
+
+    def _bind(self, host, values, con):
+        """Bind the given connection within the host's bind_timeout.
+
+           :raises: ldap.LDAPError, LdapTimeout
+        """
+        timeout = self._timeout(values.get('bind_timeout'))
+        try:
+            if values.get('sasl_mech'):
+                # Only synchronous SASL binds are available, bounded by
+                # the timeout of synchronous calls
+                if timeout > 0:
+                    con.set_option(ldap.OPT_TIMEOUT, timeout)
+                try:
+                    con.sasl_interactive_bind_s('', ldap.sasl.external())
+                finally:
+                    if timeout > 0:
+                        # Don't bound the synchronous calls made later
+                        con.set_option(ldap.OPT_TIMEOUT, -1)
+            else:
+                msgid = con.simple_bind(values['bind_dn'],
+                                        values['bind_password'])
+                con.result3(msgid, all=1, timeout=timeout)
+        except ldap.TIMEOUT:
+            values['timeouts'] = values.get('timeouts', 0) + 1
+            try:
+                con.unbind()
+            except ldap.LDAPError:
+                pass
+            raise LdapTimeout('Bind to host={} timed out after {}s'
+                              .format(host, timeout))
+
+    def is_down(self, host):
+        """Is the given host marked down?"""
+        return 'down_since' in self.hosts.get(host, {})
+
+    def _set_down(self, host, values, replica, ex):
+        """Mark a replica down after failing to reach it.
+
+        The host is marked down too if it was its last replica up. Return
+        whether the host is still up."""
+        with self.state_lock:
+            con, replica.con = replica.con, None
+            if replica.down_since is None:
+                replica.down_since = time()
+                replica.down_error = str(ex)
+            host_down = not any(other.is_up()
+                                for other in values['replicas'])
+            if host_down and 'down_since' not in values:
+                self._mark_host_down(values, ex)
+                LOG.warning('LDAP host=%s is down, probing until it '
+                            'recovers: %s', host, ex)
+            elif con and not host_down:
+                LOG.warning('Replica uri=%s of LDAP host=%s is down, '
+                            'failing over: %s', replica.uri, host, ex)
+        if con:
+            try:
+                con.unbind()
+            except ldap.LDAPError:
+                pass
+        return not host_down
+
+    @staticmethod
+    def _mark_host_down(values, ex):
+        """Mark a host down, called with the state lock held."""
+        values['down_since'] = time()
+        values['down_error'] = str(ex)
+        values['downs'] = values.get('downs', 0) + 1
+
+    def _probe(self):
+        """Probe hosts that are down until stopped (prober thread)."""
+        while not self.stopping.wait(self.PROBE_TICK):
+            self.probe()
+
+    def probe(self):
+        """Try to reconnect to each replica that is down and due a probe.
+
+        Return the hosts that were down and have a replica back up."""
+        recovered = []
+        for host, values in self.hosts.items():
+            for replica in values.get('replicas', []):
+                if replica.down_since is None or \
+                   time() < replica.next_probe:
+                    continue
+                replica.next_probe = time() + values.get(
+                    'probe_interval', self.DEFAULT_PROBE_INTERVAL)
+                try:
+                    con = self._connect(host, values, replica.uri)
+                    root_dse = self._read_root_dse(host, values, con)
+                except LdapException as ex:
+                    LOG.debug('Replica uri=%s of LDAP host=%s is still down: '
+                              '%s', replica.uri, host, ex)
+                    continue
+                with self.state_lock:
+                    replica.con = con
+                    replica.root_dse = root_dse
+                    replica.down_since = replica.down_error = None
+                    replica.next_probe = 0
+                    replica.latency = None
+                    values['connects'] = values.get('connects', 0) + 1
+                    host_down = values.pop('down_since', None) is not None
+                    values.pop('down_error', None)
+                if values.get('discover_base_dns'):
+                    self._discover_base_dns(host, values)
+                if host_down:
+                    LOG.warning('LDAP host=%s has recovered', host)
+                    recovered.append(host)
+                else:
+                    LOG.warning('Replica uri=%s of LDAP host=%s has '
+                                'recovered', replica.uri, host)
+        return recovered
+
+    def status_text(self):
+        """Return text describing the state of each host."""
+        lines = []
+        for host, values in sorted(self.hosts.items()):
+            if host in self.connecting:
+                state = 'connecting'
+            elif 'down_since' in values:
+                state = 'down for {:.0f}s: {}'.format(
+                    time() - values['down_since'], values.get('down_error'))
+            else:
+                state = 'up'
+            breaker = self.breakers.get(host)
+            if breaker and breaker.state != breaker.CLOSED:
+                state += ', circuit breaker {}'.format(breaker.state)
+            lines.append('{} {}\n'.format(host, state))
+            replicas = values.get('replicas', [])
+            if len(replicas) > 1:
+                lines.extend('    {}\n'.format(replica.state())
+                             for replica in replicas)
+        return ''.join(lines)
+
+    def begin(self):
+        """Start the deadline of a file system operation in this thread.
+
+        All searches until the next begin() in the thread share the
+        op_timeout of the host searched."""
+        self.operation.start = time()
+
+    @staticmethod
+    def _timeout(timeout_ms):
+        """Return the result timeout in seconds for a config timeout."""
+        return timeout_ms / 1000.0 if timeout_ms else -1
 
     def close(self):
         """Close all open connections"""
-        for host, values in self.hosts.iteritems():
-            con = values.get('con')
-            if con:
-                try:
-                    LOG.debug('Closing connection to {}'.format(host))
-                    con.unbind()
-                except ldap.LDAPError as ex:
-                    LOG.debug('Error closing connection to {}: {}'
-                              .format(host, ex))
-                del values['con']
+        self._join_connectors()
+        if self.prober:
+            self.stopping.set()
+            self.prober.join()
+            self.prober = None
+        if self.entry_cache:
+            self.entry_cache.stop()
+        for values in self.hosts.itervalues():
+            for replica in values.pop('replicas', []):
+                if replica.con:
+                    try:
+                        LOG.debug('Closing connection to %s', replica.uri)
+                        replica.con.unbind()
+                    except ldap.LDAPError as ex:
+                        LOG.debug('Error closing connection to %s: %s',
+                                  replica.uri, ex)
+                    replica.con = None
 
     def exists(self, host, dn):
         """Check if the given DN exists on the given server."""
@@ -102,39 +611,259 @@ class Connection(object):
         except NoSuchObject:
             return False
 
-    def get(self, host, dn, attrsonly=False):
+    def get(self, host, dn, attrsonly=False, attrlist=None):
         """Retrieve a single object at the given DN on the given server.
 
+        Only the attributes named in attrlist are retrieved if given, all
+        user attributes otherwise.
+
         Return a dictionary of attribute names/values"""
-        return self._search(host, dn, False, attrsonly)[0]
+        return self._lookup(host, dn, False, attrsonly, attrlist)[0]
 
-    def get_children(self, host, dn, attrsonly=False):
+    def get_children(self, host, dn, attrsonly=False, attrlist=None):
         """Search for the LDAP objects at the given DN on the given server.
 
         Return a list of tuples, each one containing the DN of the LDAP
         object and a dictionary of its contents. The dictionary contains the
         attribute name/values of the object."""
-        return self._search(host, dn, True, attrsonly)
+        return self._lookup(host, dn, True, attrsonly, attrlist)
+
+    def _lookup(self, host, dn, children, attrsonly, attrlist):
+        """Search through the entry cache, if enabled."""
+        if not self.entry_cache:
+            return self._search(host, dn, children, attrsonly, attrlist)
+        key = (host, str(dn).lower(), children, bool(attrsonly),
+               tuple(attrlist or ()))
+        try:
+            return self.entry_cache.get(
+                key, lambda: self._search(host, dn, children, attrsonly,
+                                          attrlist))
+        except LdapUnavailable:
+            result = self.entry_cache.get_offline(key)
+            if result is None:
+                raise
+            return result
+
+    def is_leaf(self, host, dn):
+        """Is the object at the given DN on the given host known to be a leaf?
 
-    def _search(self, host, dn, children, attrsonly):
+        This only consults flags cached from recent searches that returned
+        the object's subordinate attributes or its (lack of) children. False
+        is returned if the object has children or if it isn't known."""
+        key = (host, str(dn).lower())
+        try:
+            leaf, expiry = self.leaves[key]
+        except KeyError:
+            self.leaf_stats['misses'] += 1
+            return False
+        if expiry < time():
+            self.leaves.pop(key, None)
+            self.leaf_stats['misses'] += 1
+            return False
+        self.leaf_stats['hits'] += 1
+        return leaf
+
+    def _set_leaf(self, host, dn, leaf):
+        """Cache the leaf flag of the object at the given DN."""
+        if not self.leaf_cache_ttl:
+            return
+        if len(self.leaves) >= self.LEAF_CACHE_SIZE:
+            LOG.debug('Leaf cache full - clearing')
+            self.leaf_stats['evictions'] += len(self.leaves)
+            self.leaves.clear()
+        self.leaves[(host, str(dn).lower())] = (leaf,
+                                                time() + self.leaf_cache_ttl)
+
+    def _search(self, host, dn, children, attrsonly, attrlist=None):
         """Internal search method to support public retrieval methods."""
 
         try:
             values = self.hosts[host]
         except KeyError:
             raise NoSuchHost('No configured LDAP host={}'.format(host))
+        connecting = self.connecting.get(host)
+        if connecting:
+            connecting.wait()
+        if 'down_since' in values:
+            raise HostDown('LDAP host={} is down'.format(host))
+        breaker = self.breakers.get(host)
+        if breaker and not breaker.allow():
+            raise HostBusy('Circuit breaker open for LDAP host={}'
+                           .format(host))
+        admission = self.admissions.get(host)
+        if admission and not admission.enter():
+            if breaker:
+                # Let the next search make the trial if this was it
+                breaker.cancel()
+            raise HostBusy('Too many searches waiting on LDAP host={}'
+                           .format(host))
 
+        start = time()
+        failed = True
+        try:
+            entries = self._search_entries(host, values, dn, children,
+                                           attrsonly, attrlist)
+            failed = False
+        except (InvalidDN, NoSuchObject):
+            # The server is answering fine
+            failed = False
+            raise
+        finally:
+            if admission:
+                admission.leave()
+            if breaker:
+                breaker.record(time() - start, failed)
+
+        if self.leaf_cache_ttl:
+            if children:
+                self._set_leaf(host, dn, not entries)
+            for entry in entries:
+                leaf = entry.is_leaf()
+                if leaf is not None:
+                    self._set_leaf(host, entry.dn, leaf)
+        return entries
+
+    def _search_entries(self, host, values, dn, children, attrsonly,
+                        attrlist):
+        """Return the Entries found by a search.
+
+           :raises: LdapException
+        """
         try:
             scope = ldap.SCOPE_ONELEVEL if children else ldap.SCOPE_BASE
-            return [Entry(dn, attrs) for dn, attrs in
-                    values['con'].search_st(str(dn), scope,
-                                            attrsonly=attrsonly)]
+            return [Entry(edn, attrs) for edn, attrs in
+                    self._search_results(host, values, str(dn), scope,
+                                         attrsonly, attrlist)]
         except KeyError:
+            if 'down_since' in values:
+                raise HostDown('LDAP host={} is down'.format(host))
             raise NoSuchHost('No open connection to LDAP host={}'.format(host))
+        except self.DOWN_ERRORS as ex:
+            raise HostDown('LDAP host={} is down: {}'.format(host, ex))
         except ldap.INVALID_DN_SYNTAX:
             raise InvalidDN('Invalid DN={}'.format(dn))
         except ldap.NO_SUCH_OBJECT:
             raise NoSuchObject('No object found at host={} DN={}'
                                .format(host, dn))
+        except ldap.TIMELIMIT_EXCEEDED:
+            raise LdapTimeout('Server time limit exceeded for host={} dn={}'
+                              .format(host, dn))
         except ldap.LDAPError as ex:
             raise LdapException('Error="{}" for dn={}'.format(ex, dn))
+
+    def _search_results(self, host, values, dn, scope, attrsonly, attrlist):
+        """Return the (dn, attrs) results of a search within its deadlines.
+
+        The search goes to the host's best replica, then to the next best
+        while the one tried can't be reached. A search still running at its
+        deadline is abandoned.
+
+           :raises: KeyError, ldap.LDAPError, LdapTimeout
+        """
+        search_timeout = self._timeout(values.get('search_timeout'))
+        op_timeout = values.get('op_timeout')
+        op_start = getattr(self.operation, 'start', None)
+
+        while True:
+            timeout = search_timeout
+            if op_timeout and op_start is not None:
+                # Replicas failed over to only get what's left of the time
+                remaining = op_start + op_timeout / 1000.0 - time()
+                if remaining <= 0:
+                    values['timeouts'] = values.get('timeouts', 0) + 1
+                    raise LdapTimeout('Operation deadline passed before '
+                                      'searching host={} dn={}'
+                                      .format(host, dn))
+                timeout = remaining if timeout < 0 \
+                          else min(timeout, remaining)
+            replica = self._route(values)
+            start = time()
+            try:
+                return self._search_replica(host, values, replica, dn, scope,
+                                            attrsonly, attrlist, timeout)
+            except self.DOWN_ERRORS as ex:
+                if not self._set_down(host, values, replica, ex):
+                    raise
+            finally:
+                replica.observe(time() - start)
+
+    def _route(self, values):
+        """Return the connected replica to send a host's next search to.
+
+           :raises: KeyError if the host has none
+        """
+        replicas = [replica for replica in values['replicas']
+                    if replica.is_up()]
+        if not replicas:
+            raise KeyError('No replica up')
+        if len(replicas) > 1 and random.random() < self.EXPLORE:
+            return random.choice(replicas)
+        # Replicas not searched yet have no latency and come first
+        return min(replicas, key=lambda replica: replica.latency)
+
+    def _search_replica(self, host, values, replica, dn, scope, attrsonly,
+                        attrlist, timeout):
+        """Return the results of a search of one replica.
+
+           :raises: ldap.LDAPError, LdapTimeout
+        """
+        con = replica.con
+        if con is None:
+            # Marked down by another thread since it was chosen
+            raise ldap.SERVER_DOWN({'desc': 'Connection closed'})
+        page_size = values.get('page_size', self.DEFAULT_PAGE_SIZE)
+        if scope == ldap.SCOPE_ONELEVEL and page_size and \
+           replica.root_dse.supports('paged_results'):
+            return self._search_pages(host, values, con, dn, scope,
+                                      attrsonly, attrlist, timeout,
+                                      page_size)
+        msgid = con.search_ext(dn, scope, attrlist=attrlist,
+                               attrsonly=attrsonly)
+        return self._result(host, values, con, msgid, dn, timeout)[1]
+
+    def _search_pages(self, host, values, con, dn, scope, attrsonly,
+                      attrlist, timeout, page_size):
+        """Return the results of a search made in pages of page_size.
+
+        The timeout applies to all the pages together.
+
+           :raises: ldap.LDAPError, LdapTimeout
+        """
+        control = SimplePagedResultsControl(True, size=page_size, cookie='')
+        deadline = time() + timeout if timeout >= 0 else None
+        results = []
+        while True:
+            page_timeout = deadline - time() if deadline else -1
+            if deadline and page_timeout <= 0:
+                # A timeout of 0 would poll for the result, not wait
+                values['timeouts'] = values.get('timeouts', 0) + 1
+                raise LdapTimeout('Search of host={} dn={} timed out after '
+                                  '{:.3f}s with {} results'
+                                  .format(host, dn, timeout, len(results)))
+            msgid = con.search_ext(dn, scope, attrlist=attrlist,
+                                   attrsonly=attrsonly, serverctrls=[control])
+            result = self._result(host, values, con, msgid, dn, page_timeout)
+            results.extend(result[1])
+            cookies = [ctrl.cookie for ctrl in result[3]
+                       if ctrl.controlType == control.controlType]
+            if not cookies or not cookies[0]:
+                return results
+            control.cookie = cookies[0]
+
+    @staticmethod
+    def _result(host, values, con, msgid, dn, timeout):
+        """Return the result of a search, abandoned if it times out.
+
+           :raises: ldap.LDAPError, LdapTimeout
+        """
+        try:
+            return con.result3(msgid, all=1, timeout=timeout)
+        except ldap.TIMEOUT:
+            values['timeouts'] = values.get('timeouts', 0) + 1
+            try:
+                con.abandon_ext(msgid)
+            except ldap.LDAPError as ex:
+                LOG.debug('Error abandoning search of dn=%s on host=%s: %s',
+                          dn, host, ex)
+            raise LdapTimeout('Search of host={} dn={} timed out after '
+                              '{:.3f}s'.format(host, dn, timeout))
@@ -8,6 +8,9 @@ import ldap
 class LdapConfigFile(ConfigFile):
     """Ldapfs oriented wrapper for ConfigFile."""
 
+    URI_SCHEMES = ['ldap', 'ldaps', 'ldapi']
+    SASL_MECHS = ['EXTERNAL']
+
     @staticmethod
     def validate_dns(dns):
         """Validate and format DNs from config."""
@@ -20,3 +23,28 @@ class LdapConfigFile(ConfigFile):
             except ldap.DECODING_ERROR:
                 raise ConfigError('Invalid DN "{}".'.format(dn))
         return dns
+
+    @classmethod
+    def validate_uris(cls, uris):
+        """Validate and split whitespace separated LDAP URIs from config.
+
+        An ldapi:// URI may leave out the socket path to use the default."""
+        uris = uris.split()
+        if not uris:
+            raise ConfigError('Empty URI configuration.')
+        for uri in uris:
+            scheme, _, address = uri.partition('://')
+            if scheme not in cls.URI_SCHEMES or \
+               not (address.strip('/') or scheme == 'ldapi'):
+                raise ConfigError('Invalid URI "{}", expected {}://host:port'
+                                  .format(uri, '|'.join(cls.URI_SCHEMES)))
+        return uris
+
+    @classmethod
+    def validate_sasl_mech(cls, mech):
+        """Validate a SASL mechanism from config."""
+        mech = mech.strip().upper()
+        if mech not in cls.SASL_MECHS:
+            raise ConfigError('Unsupported SASL mechanism "{}", expected one '
+                              'of: {}'.format(mech, ', '.join(cls.SASL_MECHS)))
+        return mech
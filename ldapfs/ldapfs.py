@@ -13,14 +13,27 @@ import errno
 import fuse
 import logging
 import os
+import signal
 import traceback
+from time import time
 
 from .exceptions import LdapfsException, LdapException, InvalidDN, NoSuchObject
+from .exceptions import ConfigError, LdapUnavailable
 from .ldapconf import LdapConfigFile
 from . import ldapcon
 from . import name
 from . import fs
 from . import trace
+from . import instrument
+from . import stats
+from . import metrics
+from . import slowlog
+from . import asynclog
+from . import profiler
+from . import recorder
+from . import fakeldap
+from . import faults
+from . import dit
 
 LOG = logging.getLogger(__name__)
 fuse.fuse_python_api = (0, 2)
@@ -34,12 +47,59 @@ class LdapFS(fuse.Fuse):
 
     DEFAULT_CONFIG = '/etc/ldapfs/ldapfs.cfg'
     REQUIRED_BASE_CONFIG = ['log_file', 'log_format', 'log_levels']
-    PARSE_BASE_CONFIG = [('log_levels', LdapConfigFile.parse_log_levels)]
-    REQUIRED_HOST_CONFIG = ['host', 'port', 'base_dns', 'bind_dn',
-                            'bind_password', 'ldap_trace_level']
+    PARSE_BASE_CONFIG = [('log_levels', LdapConfigFile.parse_log_levels),
+                         ('value_dir_threshold', LdapConfigFile.parse_int),
+                         ('leaf_cache_ttl', LdapConfigFile.parse_int),
+                         ('entry_cache_ttl', LdapConfigFile.parse_int),
+                         ('entry_cache_max_stale', LdapConfigFile.parse_int),
+                         ('lazy_connect', LdapConfigFile.parse_bool),
+                         ('trace_size', LdapConfigFile.parse_int),
+                         ('log_async', LdapConfigFile.parse_bool),
+                         ('stats', LdapConfigFile.parse_bool),
+                         ('metrics_port', LdapConfigFile.parse_int),
+                         ('metrics_interval', LdapConfigFile.parse_int),
+                         ('slow_op_threshold', LdapConfigFile.parse_int)]
+    DEFAULT_METRICS_ADDRESS = '127.0.0.1'
+    DEFAULT_METRICS_INTERVAL = 15   # seconds
+    DEFAULT_LEAF_CACHE_TTL = 60     # seconds
+    VALUE_CACHE_TTL = 5         # seconds a value dir's entry is reused
+    VALUE_CACHE_SIZE = 1000     # max number of cached value dir entries
+    # Methods instrumented for tracing
+    FUSE_OPS = ['getattr', 'readdir', 'open', 'read', 'release']
+    LDAP_CALLS = ['open', 'close', '_search']
+    # Virtual dir at the mount root with files reporting on the file system
+    STATUS_DIR = '.ldapfs'
+    # A host also needs a port unless it lists the uris of its replicas, a
+    # bind_dn and bind_password unless it binds with a sasl_mech, and
+    # base_dns unless it discovers them
+    REQUIRED_HOST_CONFIG = ['host', 'ldap_trace_level']
     PARSE_HOST_CONFIG = [('port', LdapConfigFile.parse_int),
+                         ('uris', LdapConfigFile.validate_uris),
+                         ('sasl_mech', LdapConfigFile.validate_sasl_mech),
+                         ('start_tls', LdapConfigFile.parse_bool),
+                         ('tls_require_cert', LdapConfigFile.parse_bool),
+                         ('discover_base_dns', LdapConfigFile.parse_bool),
+                         ('page_size', LdapConfigFile.parse_int),
                          ('base_dns', LdapConfigFile.validate_dns),
-                         ('ldap_trace_level', LdapConfigFile.parse_int)]
+                         ('ldap_trace_level', LdapConfigFile.parse_int),
+                         ('fake_tree', dit.parse_shape),
+                         ('network_timeout', LdapConfigFile.parse_int),
+                         ('bind_timeout', LdapConfigFile.parse_int),
+                         ('search_timeout', LdapConfigFile.parse_int),
+                         ('op_timeout', LdapConfigFile.parse_int),
+                         ('probe_interval', LdapConfigFile.parse_int),
+                         ('breaker_threshold', LdapConfigFile.parse_int),
+                         ('breaker_window', LdapConfigFile.parse_int),
+                         ('breaker_slow_call', LdapConfigFile.parse_int),
+                         ('breaker_reset', LdapConfigFile.parse_int),
+                         ('max_in_flight', LdapConfigFile.parse_int),
+                         ('max_queued', LdapConfigFile.parse_int),
+                         ('queue_timeout', LdapConfigFile.parse_int),
+                         ('fake_latency', LdapConfigFile.parse_int),
+                         ('faults', faults.parse_faults)]
+    # Connection classes by backend name
+    BACKENDS = {'ldap': ldapcon.Connection,
+                'fake': fakeldap.FakeConnection}
 
     def __init__(self, *args, **kwargs):
         """Construct an LdapFS object absed on the Fuse class.
@@ -52,6 +112,19 @@ class LdapFS(fuse.Fuse):
         self.ldap = None            # all ldap server interaction
         self.hosts = {}             # maps hostname to host config
         self.trace_file = None      # trace program execution (optional)
+        self.tracer = None          # records calls when tracing
+        self.log_handler = None     # background log writer (optional)
+        self.root_handler = None    # handler added to the root logger
+        self.profiler = None        # profiles on SIGUSR2 (optional)
+        self.recorder = None        # records FUSE operations (optional)
+        self.instrument = instrument.Instrument()
+        self.stats = None           # latency statistics (optional)
+        self.status_files = {}      # maps status file names to text funcs
+        self.metrics = None         # metrics counters (optional)
+        self.metrics_config = {}    # metrics export settings
+        self.exporters = []         # threads exporting metrics
+        self.value_dir_threshold = 0    # split large attributes (optional)
+        self.value_entries = {}     # (host, dn, attr) -> (entry, expiry)
 
         # Path to the config file
         self.config = self.DEFAULT_CONFIG
@@ -63,6 +136,9 @@ class LdapFS(fuse.Fuse):
         # This will set self.config if -o config=file was specified on the
         # command line
         args = fuse.Fuse.parse(self, values=self, errex=1)
+        # Have the kernel use the inode numbers of getattr and readdir
+        # rather than numbering the files itself
+        self.fuse_args.add('use_ino')
 
         # Sets instance vars with names from REQUIRED_BASE_CONFIG and
         # self.hosts keyed by hostname
@@ -82,21 +158,49 @@ class LdapFS(fuse.Fuse):
                                     parse_config=self.PARSE_BASE_CONFIG)
 
         self.trace_file = config_items.get('trace_file')
+        self.value_dir_threshold = config_items.get('value_dir_threshold', 0)
         if self.trace_file:
-            trace.start(self.trace_file, os.path.dirname(__file__))
-
-        # Split out the log level config and use a log file or stdout as
-        # appropriate.
+            trace_size = config_items.get('trace_size',
+                                          trace.Tracer.DEFAULT_SIZE)
+            if trace_size < 1:
+                raise ConfigError('trace_size must be at least 1')
+            # Calls are traced into a ring buffer which is written to the
+            # trace file on SIGUSR1 and on exit
+            self.tracer = trace.Tracer(self.trace_file, trace_size)
+            self.instrument.add(self.tracer)
+            signal.signal(signal.SIGUSR1, self.dump_trace)
+
+        if config_items.get('profile_dir'):
+            # Profiling sessions are started and stopped by SIGUSR2
+            self.profiler = profiler.Profiler(config_items['profile_dir'])
+            signal.signal(signal.SIGUSR2, self.profiler.toggle)
+
+        if config_items.get('record_file'):
+            # Every FUSE operation is recorded for replay by ldapfs-replay
+            self.recorder = recorder.Recorder(config_items['record_file'])
+            self.instrument.add(self.recorder)
+
+        if config_items.get('stats', True):
+            self.stats = stats.Stats()
+            self.instrument.add(self.stats)
+            self.status_files['stats'] = self.stats.text
+
+        # Log to a log file or stdout as appropriate.
         if config_items['log_file'] == '-':
-            destination = {'stream': sys.stdout}
+            handler = logging.StreamHandler(sys.stdout)
         else:
-            destination = {'filename': config_items['log_file']}
+            handler = logging.FileHandler(config_items['log_file'])
+        handler.setFormatter(logging.Formatter(config_items['log_format']))
+        if config_items.get('log_async', True):
+            # Records are written by a thread started in fsinit
+            self.log_handler = asynclog.AsyncHandler([handler])
+            handler = self.log_handler
 
         # Configure logging and set levels
-        root_log_level = config_items['log_levels'].pop('root')
-        logging.basicConfig(level=root_log_level,
-                            format=config_items['log_format'],
-                            **destination)
+        root_log = logging.getLogger()
+        root_log.addHandler(handler)
+        self.root_handler = handler
+        root_log.setLevel(config_items['log_levels'].pop('root'))
         for module, level in config_items['log_levels'].iteritems():
             log = logging.getLogger(module)
             log.setLevel(level)
@@ -115,20 +219,95 @@ class LdapFS(fuse.Fuse):
             values = config_parser.get(section,
                                     required_config=self.REQUIRED_HOST_CONFIG,
                                     parse_config=self.PARSE_HOST_CONFIG)
+            if 'port' not in values and 'uris' not in values:
+                raise ConfigError('Section [{}] needs a port or uris'
+                                  .format(section))
+            if 'sasl_mech' not in values and \
+               not ('bind_dn' in values and 'bind_password' in values):
+                raise ConfigError('Section [{}] needs a bind_dn and '
+                                  'bind_password or a sasl_mech'
+                                  .format(section))
+            if 'base_dns' not in values:
+                if not values.get('discover_base_dns'):
+                    raise ConfigError('Section [{}] needs base_dns or '
+                                      'discover_base_dns'.format(section))
+                values['base_dns'] = []
+            self._check_guards(section, values)
             key = values.pop('host')
             self.hosts[key] = values
 
-        self.ldap = ldapcon.Connection(self.hosts)
+        backend = config_items.get('backend', 'ldap')
+        if backend not in self.BACKENDS:
+            raise ConfigError('Invalid backend "{}", expected one of: {}'
+                              .format(backend,
+                                      ', '.join(sorted(self.BACKENDS))))
+        self.ldap = self.BACKENDS[backend](
+            self.hosts,
+            leaf_cache_ttl=config_items.get('leaf_cache_ttl',
+                                            self.DEFAULT_LEAF_CACHE_TTL),
+            entry_cache_ttl=config_items.get('entry_cache_ttl', 0),
+            entry_cache_max_stale=config_items.get('entry_cache_max_stale',
+                                                   0),
+            lazy_connect=config_items.get('lazy_connect', False))
+        for host, values in self.hosts.iteritems():
+            if values.get('faults'):
+                LOG.warning('Injecting faults into calls to host=%s', host)
+                faults.install(self.ldap, values['faults'], hosts=[host])
+
+        self.status_files['hosts'] = self.ldap.status_text
+        self.status_files['capabilities'] = self.ldap.capabilities_text
+
+        self.metrics_config = dict([(key, value) for key, value in
+                                    config_items.iteritems()
+                                    if key.startswith('metrics_')])
+        if 'metrics_port' in self.metrics_config or \
+           'metrics_file' in self.metrics_config:
+            self.metrics = metrics.Metrics(self.ldap, self.stats)
+            self.instrument.add(self.metrics)
+            self.status_files['metrics'] = self.metrics.text
+
+        if config_items.get('slow_op_threshold'):
+            self.instrument.add(slowlog.SlowLog(
+                config_items['slow_op_threshold'] / 1000.0))
+
+        # Does nothing unless something is recording calls
+        self.instrument.wrap(self, self.FUSE_OPS, 'fuse.')
+        self.instrument.wrap(self.ldap, self.LDAP_CALLS, 'ldap.')
+
+    @staticmethod
+    def _check_guards(section, values):
+        """Check the circuit breaker and admission control settings of a host.
+
+           :raises: ConfigError
+        """
+        if not 0 <= values.get('breaker_threshold', 0) <= 100:
+            raise ConfigError('Section [{}] breaker_threshold must be a '
+                              'percentage, or 0 to disable'.format(section))
+        if values.get('breaker_window', 1) < 1:
+            raise ConfigError('Section [{}] breaker_window must be at least 1'
+                              .format(section))
+        for key in ('max_in_flight', 'max_queued'):
+            if values.get(key, 0) < 0:
+                raise ConfigError('Section [{}] {} must not be negative'
+                                  .format(section, key))
 
     @staticmethod
     def log_uncaught_exceptions(ex_cls, ex, tb):
         """Except hook - called for any uncaught exceptions."""
         LOG.critical(''.join(traceback.format_tb(tb)))
-        LOG.critical('{}: {}'.format(ex_cls, ex))
+        LOG.critical('%s: %s', ex_cls, ex)
+
+    def dump_trace(self, *_):
+        """Signal handler to write the traced calls to the trace file."""
+        if self.tracer:
+            self.tracer.dump()
 
     def fsinit(self):
         """Start the connections to the LDAP server(s).
 
+        With lazy_connect they are left connecting in the background and
+        the file system is ready at once.
+
         This is a FUSE API method invoked by FUSE before the file system
         is ready to serve requests. Sadly when an exception is raised
         here Python Fuse doesn't exit. Raising SystemExit or calling
@@ -139,13 +318,55 @@ class LdapFS(fuse.Fuse):
         """
         LOG.debug('File system starting...')
         self.ldap.open()
+        if self.recorder:
+            try:
+                self.recorder.start()
+            except IOError as ex:
+                LOG.error('Error creating record file %s: %s',
+                          self.recorder.record_file, ex)
+        # Threads are started here as Fuse may fork after __init__
+        if self.log_handler:
+            self.log_handler.start()
+        self._start_exporters()
+
+    def _start_exporters(self):
+        """Start exporting metrics as configured."""
+        if not self.metrics:
+            return
+        config = self.metrics_config
+        try:
+            if 'metrics_port' in config:
+                self.exporters.append(metrics.MetricsServer(
+                    self.metrics,
+                    config.get('metrics_address',
+                               self.DEFAULT_METRICS_ADDRESS),
+                    config['metrics_port']))
+        except IOError as ex:
+            LOG.error('Error serving metrics on port %s: %s',
+                      config['metrics_port'], ex)
+        if 'metrics_file' in config:
+            self.exporters.append(metrics.MetricsFile(
+                self.metrics, config['metrics_file'],
+                config.get('metrics_interval', self.DEFAULT_METRICS_INTERVAL)))
+        for exporter in self.exporters:
+            exporter.start()
 
     def fsdestroy(self):
         """Shutdown the connections to the LDAP server(s)."""
         LOG.debug('File system stopping...')
+        for exporter in self.exporters:
+            exporter.stop()
         self.ldap.close()
-        if self.trace_file:
-            trace.stop()
+        if self.recorder:
+            self.recorder.close()
+        if self.log_handler:
+            self.log_handler.stop()
+        if self.root_handler:
+            # Don't leave it to log the records of any LdapFS made later in
+            # this process, e.g. by benchmarks and tests
+            logging.getLogger().removeHandler(self.root_handler)
+            self.root_handler.close()
+            self.root_handler = None
 
     # pylint: disable-msg=R0911,R0912
     # - pylint doesn't like the number of return statements or branches in
@@ -154,39 +375,70 @@ class LdapFS(fuse.Fuse):
     #   returns and branches here.
     def getattr(self, fspath):
         """Return stat structure for the given path."""
+        self.ldap.begin()
+        st = self._stat(fspath)
+        if not isinstance(st, int):
+            st.st_ino = fs.inode(fspath)
+        return st
+
+    def _stat(self, fspath):
+        """Return stat structure (without inode) for the given path."""
+        status_name = self._status_name(fspath)
+        if status_name == '':
+            return fs.Stat(isdir=True, nlink=fs.Stat.dir_nlink(0))
+        elif status_name is not None:
+            text = self._status_text(status_name)
+            if isinstance(text, int):
+                return text
+            return fs.Stat(isdir=False, size=len(text))
+
         path = name.Path(fspath, self.hosts)
         if not path:
             LOG.debug('Empty path')
             return -errno.ENOENT
         elif path.is_root_path():
             LOG.debug('Root path')
-            return fs.Stat(isdir=True)
+            subdirs = len(self.hosts) + (1 if self.status_files else 0)
+            return fs.Stat(isdir=True, nlink=fs.Stat.dir_nlink(subdirs))
 
         if not path.has_host_part():
-            LOG.debug("path doesn't match any configured hosts: {}"
-                      .format(fspath))
+            LOG.debug("path doesn't match any configured hosts: %s", fspath)
             return -errno.ENOENT
 
         if path.len == 1:
             # No more path components to look at - we're done
-            return fs.Stat(isdir=True)
+            base_dns = self.hosts[path.host]['base_dns']
+            return fs.Stat(isdir=True, nlink=fs.Stat.dir_nlink(len(base_dns)))
 
         if not path.has_base_dn_part():
-            LOG.debug("path doesn't match any configured base DNs for host={} "
-                      "path={}".format(path.host, fspath))
+            LOG.debug("path doesn't match any configured base DNs for host=%s "
+                      "path=%s", path.host, fspath)
             return -errno.ENOENT
 
         # Now we need to find an object that matches the remaining path
         # (without the leading host and base-dn)
 
-        dn = name.DN.create(path.dn_parts)            
+        dn = name.DN.create(path.dn_parts)
         try:
-            if dn and self.ldap.exists(path.host, dn):
-                # We found a matching LDAP object. We're done.
-                return fs.Stat(isdir=True)
+            if dn:
+                # Fetch the child count along with the object so the dir's
+                # link count can be reported.
+                entry = self.ldap.get(path.host, dn,
+                                      attrlist=ldapcon.Entry.SUBORDINATE_ATTRS)
+                # We found a matching LDAP object. We're done. Its large
+                # attributes' value dirs are subdirs too, but counting them
+                # takes all its values, so the count is left unknown.
+                subdirs = None if self.value_dir_threshold \
+                          else entry.subordinates()
+                return fs.Stat(isdir=True, nlink=fs.Stat.dir_nlink(subdirs))
+        except ldapcon.NoSuchObject:
+            pass
+        except LdapUnavailable as ex:
+            LOG.warning('%s for fspath=%s', ex, fspath)
+            return -ex.errno
         except ldapcon.LdapException as ex:
-            LOG.debug('Exception from ldap.exists for dn={} for fspath={}. {}'
-                      .format(dn, fspath, ex))
+            LOG.debug('Exception from ldap.get for dn=%s for fspath=%s. %s',
+                      dn, fspath, ex)
             return -errno.ENOENT
 
         if path.len == 2:
@@ -198,111 +450,336 @@ class LdapFS(fuse.Fuse):
         try:
             parent_dn = name.DN.create_parent(path.dn_parts)
             if not parent_dn:
-                LOG.debug('Invalid parent DN for fspath={}'.format(fspath))
+                if self.value_dir_threshold and path.len > 3:
+                    # Could be a value file within a large attribute's dir
+                    text = self._value_text(path)
+                    if isinstance(text, int):
+                        return text
+                    return fs.Stat(isdir=False, size=len(text))
+                LOG.debug('Invalid parent DN for fspath=%s', fspath)
                 return -errno.ENOENT
 
             entry = self.ldap.get(path.host, parent_dn)
         except ldapcon.NoSuchObject:
-            LOG.debug('parent_dn={} not found for fspath={}'.format(parent_dn,
-                                                                    fspath))
+            LOG.debug('parent_dn=%s not found for fspath=%s',
+                      parent_dn, fspath)
             return -errno.ENOENT
+        except LdapUnavailable as ex:
+            LOG.warning('%s for fspath=%s', ex, fspath)
+            return -ex.errno
         except ldapcon.LdapException as ex:
-            LOG.debug('Exception from ldap.get for parent_dn={} for '
-                      'fspath={} {}'.format(parent_dn, fspath, ex))
+            LOG.debug('Exception from ldap.get for parent_dn=%s for fspath=%s '
+                      '%s', parent_dn, fspath, ex)
             return -errno.ENOENT
 
         try:
+            if self._is_value_dir(entry, path.filepart):
+                return fs.Stat(isdir=True, nlink=fs.Stat.dir_nlink(0))
             return fs.Stat(isdir=False, size=entry.size(path.filepart))
         except AttributeError:
             return -errno.ENOENT
 
+    def _status_name(self, fspath):
+        """Return the name of the status file for the given path.
+
+        An empty string is returned for the status dir itself and None for
+        paths outside the status dir."""
+        if not self.status_files:
+            return None
+        parts = fspath.strip(os.path.sep).split(os.path.sep)
+        if parts[0] != self.STATUS_DIR:
+            return None
+        return os.path.sep.join(parts[1:])
+
+    def _status_text(self, status_name):
+        """Return the current text of the named status file.
+
+        A negative errno value is returned if there is no such file."""
+        text_fn = self.status_files.get(status_name)
+        if not text_fn:
+            return -errno.ENOENT
+        return text_fn()
+
+    def _is_value_dir(self, entry, attr_name):
+        """Is the given attribute represented as a directory of values?
+
+        Attributes with more than value_dir_threshold values are represented
+        as a directory containing one file per value, so that single values
+        can be accessed without reading the entire attribute."""
+        return (self.value_dir_threshold > 0 and
+                attr_name != ldapcon.Entry.ALL_ATTRIBUTES and
+                entry.count(attr_name) > self.value_dir_threshold)
+
+    def _value_entry(self, host, dn, attr_name, fspath):
+        """Return the entry owning the value dir of the given attribute.
+
+        Entries are kept for VALUE_CACHE_TTL seconds, so that listing a value
+        dir and reading each of its values takes one search rather than one
+        per value. A negative errno value is returned if there is no such
+        value dir."""
+        key = (host, str(dn).lower(), attr_name)
+        entry, expires = self.value_entries.get(key, (None, 0))
+        if entry and time() < expires:
+            return entry
+
+        try:
+            entry = self.ldap.get(host, dn)
+        except LdapUnavailable as ex:
+            LOG.warning('%s for fspath=%s', ex, fspath)
+            return -ex.errno
+        except LdapException as ex:
+            LOG.debug('Exception from ldap.get for dn=%s for fspath=%s. %s',
+                      dn, fspath, ex)
+            return -errno.ENOENT
+        if not self._is_value_dir(entry, attr_name):
+            return -errno.ENOENT
+
+        if len(self.value_entries) >= self.VALUE_CACHE_SIZE:
+            LOG.debug('Value dir cache full - clearing')
+            self.value_entries.clear()
+        self.value_entries[key] = (entry, time() + self.VALUE_CACHE_TTL)
+        return entry
+
+    def _value_text(self, path):
+        """Return the text of the value file at the given path.
+
+        The path is expected to be of the form .../<object>/<attr>/<index>.
+        A negative errno value is returned if there is no such value file."""
+        attr_name, index = path.parts[-2], path.filepart
+        if not index.isdigit() or str(int(index)) != index:
+            return -errno.ENOENT
+
+        dn = name.DN.create(path.dn_parts[:-2])
+        if not dn:
+            LOG.debug('Invalid DN for value file fspath=%s', path.fspath)
+            return -errno.ENOENT
+
+        entry = self._value_entry(path.host, dn, attr_name, path.fspath)
+        if isinstance(entry, int):
+            return entry
+        try:
+            return entry.value_text(attr_name, int(index))
+        except AttributeError:
+            return -errno.ENOENT
+
     def readdir(self, fspath, _):
-        """Read the given directory path and yield its contents."""
-        dir_entries = ['.', '..']
+        """Read the given directory path and yield its contents.
+
+        Each entry carries its file type, LDAP objects being directories and
+        attributes files, so callers need no getattr call to find out. A
+        negative errno value is returned if the dir can't be read."""
+        dir_entries = self._dir_entries(fspath)
+        if isinstance(dir_entries, int):
+            return dir_entries
+        return self._direntries(fspath, dir_entries)
+
+    @staticmethod
+    def _direntries(fspath, dir_entries):
+        """Yield a fuse.Direntry for each (name, type) in the given dir."""
+        for ent, ent_type in dir_entries:
+            LOG.debug('yield %s', ent)
+            yield fuse.Direntry(ent, type=ent_type,
+                                ino=fs.inode(os.path.join(fspath, ent)))
+
+    def _dir_entries(self, fspath):
+        """Return (name, type) tuples for the contents of the given dir.
+
+        An empty list is returned if there is no such directory, or a
+        negative errno value if its LDAP host can't be reached."""
+        self.ldap.begin()
+        dir_entries = [('.', fs.DT_DIR), ('..', fs.DT_DIR)]
+
+        status_name = self._status_name(fspath)
+        if status_name is not None:
+            if status_name:
+                return []
+            dir_entries.extend([(status_file, fs.DT_REG)
+                                for status_file in self.status_files])
+            return dir_entries
 
         path = name.Path(fspath, self.hosts)
         if not path:
-            return
+            return []
         elif path.is_root_path():
             LOG.debug('Root path')
-            dir_entries.extend(self.hosts.keys())
+            dir_entries.extend([(host, fs.DT_DIR) for host in self.hosts])
+            if self.status_files:
+                dir_entries.append((self.STATUS_DIR, fs.DT_DIR))
         else:
             if not path.has_host_part():
-                LOG.debug("path doesn't match any configured hosts: {}"
-                          .format(fspath))
-                return
+                LOG.debug("path doesn't match any configured hosts: %s",
+                          fspath)
+                return []
 
             if path.len == 1:
                 # root dir has a list of the base dns
-                dir_entries.extend(self.hosts[path.host]['base_dns'])
+                dir_entries.extend([(base_dn, fs.DT_DIR) for base_dn in
+                                    self.hosts[path.host]['base_dns']])
+            elif not path.has_base_dn_part():
+                LOG.debug("path doesn't match any configured base DNs for "
+                          "host=%s path=%s", path.host, fspath)
+                return []
+            elif self.value_dir_threshold and path.len > 2 and \
+                 not name.DN.create(path.dn_parts):
+                # Not an LDAP object, might be a large attribute's dir
+                value_names = self._value_names(path)
+                if isinstance(value_names, int) or not value_names:
+                    return value_names
+                dir_entries.extend([(value_name, fs.DT_REG)
+                                    for value_name in value_names])
             else:
-                if not path.has_base_dn_part():
-                    LOG.debug("path doesn't match any configured base DNs for "
-                              "host={} path={}".format(path.host, fspath))
-                    return
-
                 # Each dir has a .attributes file that contains all attributes
                 # for that LDAP object that the current dir is representing
-                dir_entries.append(ldapcon.Entry.ALL_ATTRIBUTES)
+                dir_entries.append((ldapcon.Entry.ALL_ATTRIBUTES, fs.DT_REG))
+
+                # Attributes are files unless they may have been split into
+                # a dir of values, which can't be known without their values.
+                attr_type = fs.DT_UNKNOWN if self.value_dir_threshold \
+                            else fs.DT_REG
 
                 try:
                     dn = name.DN(path.dn_parts)
                     base = self.ldap.get(path.host, dn, attrsonly=True)
                     # Each attribute of the LDAP object is represented as a
-                    # directory entry. A later getattr() call on these names
-                    # will tell Fuse that these are files.
-                    dir_entries.extend(base.names())
-
-                    entries = self.ldap.get_children(path.host, dn, attrsonly=True)
-                    dir_entries.extend([name.DN.to_filename(entry.dn, str(dn))
-                                       for entry in entries])
+                    # directory entry.
+                    dir_entries.extend([(attr_name, attr_type)
+                                        for attr_name in base.names()])
+
+                    if self.ldap.is_leaf(path.host, dn):
+                        LOG.debug('Leaf dn=%s - skipping search for children',
+                                  dn)
+                        entries = []
+                    else:
+                        # Fetch the subordinate attributes of the children
+                        # so listing any of them later can skip this search.
+                        entries = self.ldap.get_children(
+                            path.host, dn,
+                            attrlist=ldapcon.Entry.SUBORDINATE_ATTRS)
+                    dir_entries.extend([(name.DN.to_filename(entry.dn,
+                                                             str(dn)),
+                                         fs.DT_DIR) for entry in entries])
                 except InvalidDN:
-                    LOG.debug('Invalid DN for fspath={}'.format(fspath))
-                    return
+                    LOG.debug('Invalid DN for fspath=%s', fspath)
+                    return []
+                except LdapUnavailable as ex:
+                    LOG.warning('%s for fspath=%s', ex, fspath)
+                    return -ex.errno
                 except LdapException as ex:
-                    LOG.error('Error reading dn={} for fspath={}. {}'
-                              .format(dn, fspath, ex))
-                    return
+                    LOG.error('Error reading dn=%s for fspath=%s. %s',
+                              dn, fspath, ex)
+                    return []
+
+        return dir_entries
+
+    def _value_names(self, path):
+        """Return the value file names for the attribute dir at the given path.
+
+        An empty list is returned if the path isn't a large attribute's dir,
+        or a negative errno value if its LDAP host can't be reached."""
+        parent_dn = name.DN.create_parent(path.dn_parts)
+        if not parent_dn:
+            LOG.debug('Invalid parent DN for fspath=%s', path.fspath)
+            return []
+
+        entry = self._value_entry(path.host, parent_dn, path.filepart,
+                                  path.fspath)
+        if entry == -errno.ENOENT:
+            return []
+        elif isinstance(entry, int):
+            return entry
+        return [str(index) for index in xrange(entry.count(path.filepart))]
+
+    def open(self, fspath, flags):
+        """Open the file at the given path and return a handle for it.
+
+        The file's text is resolved once here and all reads on the returned
+        handle are served from that snapshot until it is released."""
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return -errno.EACCES
+
+        text = self._file_text(fspath)
+        if isinstance(text, int):
+            return text
+        handle = fs.File(text)
+        if self._status_name(fspath) is not None:
+            # Status files change between getattr and open - don't let the
+            # kernel cut reads short at the size getattr reported.
+            handle.direct_io = True
+        return handle
+
+    # pylint: disable-msg=W0613
+    # - Disable "unused argument"
+    # - the arguments are fixed by the FUSE API not under our control
+    def release(self, fspath, flags, fh=None):
+        """Release the handle returned by open for the given path."""
+        if fh:
+            fh.release()
+        return 0
+
+    def read(self, fspath, size, offset, fh=None):
+        """Read the file entry at the given path, size and offset."""
+        if fh:
+            return fh.read(size, offset)
 
-        for ent in dir_entries:
-            LOG.debug('yield {}'.format(ent))
-            yield fuse.Direntry(ent)
+        text = self._file_text(fspath)
+        if isinstance(text, int):
+            return text
+        return text[offset:offset + size]
+
+    def _file_text(self, fspath):
+        """Return the text of the file at the given path.
+
+        A negative errno value is returned if there is no such file."""
+        self.ldap.begin()
+        status_name = self._status_name(fspath)
+        if status_name:
+            return self._status_text(status_name)
+        elif status_name is not None:
+            return -errno.EISDIR
 
-    def read(self, fspath, size, offset):
-        """Read the file entry at the given path, size and offset."""
         path = name.Path(fspath, self.hosts)
         if path.len < 3:
             # There are no files in the first two directories (host/base-dn)
             return -errno.ENOENT
 
         if not path.has_host_part():
-            LOG.debug("path doesn't match any configured hosts: {}"
-                      .format(fspath))
+            LOG.debug("path doesn't match any configured hosts: %s", fspath)
             return -errno.ENOENT
 
         if not path.has_base_dn_part():
-            LOG.debug("path doesn't match any configured base DNs for host={} "
-                      "path={}".format(path.host, fspath))
+            LOG.debug("path doesn't match any configured base DNs for host=%s "
+                      "path=%s", path.host, fspath)
             return -errno.ENOENT
 
+        if self.value_dir_threshold and path.len > 3 and \
+           not name.DN.create_parent(path.dn_parts):
+            # Not an attribute of an LDAP object, might be a value file
+            return self._value_text(path)
+
         try:
             # Look for an LDAP object matching the directory name
             dn = name.DN.create_parent(path.dn_parts)
             entry = self.ldap.get(path.host, dn)
-            LOG.debug('Entry={}'.format(entry))
+            LOG.debug('Entry=%s', entry)
         except InvalidDN:
-            LOG.debug('Invalid dn from fspath={}'.format(fspath))
+            LOG.debug('Invalid dn from fspath=%s', fspath)
             return -errno.ENOENT
         except NoSuchObject:
-            LOG.debug('dn={} not found for fspath={}'.format(dn, fspath))
+            LOG.debug('dn=%s not found for fspath=%s', dn, fspath)
             return -errno.ENOENT
+        except LdapUnavailable as ex:
+            LOG.warning('%s for fspath=%s', ex, fspath)
+            return -ex.errno
         except LdapException as ex:
-            LOG.debug('Exception from ldap.get for dn={} for fspath={}. {}'
-                      .format(dn, fspath, ex))
+            LOG.debug('Exception from ldap.get for dn=%s for fspath=%s. %s',
+                      dn, fspath, ex)
             return -errno.ENOENT
 
+        if self._is_value_dir(entry, path.filepart):
+            return -errno.EISDIR
+
         try:
-            return entry.text(path.filepart)[offset:size]
+            return entry.text(path.filepart)
         except AttributeError:
             return -errno.ENOENT
 
@@ -310,8 +787,11 @@ class LdapFS(fuse.Fuse):
         try:
             fuse.Fuse.main(self, *args)
         finally:
-            if self.trace_file:
-                trace.stop()
+            self.dump_trace()
+            if self.recorder:
+                self.recorder.close()
+            if self.log_handler:
+                self.log_handler.stop()
 
     @staticmethod
     def run():
@@ -0,0 +1,290 @@
+
+"""Concurrent load on a mounted LdapFS.
+
+Usage: ldapfs-load [-w <workers>] [-d <seconds>] [-m <mix>]
+                   [-c <config-file> | --slapd [--ldapi]] [-t <tree>]
+                   [-l <ms>] [-f <faults>]
+
+LdapFS is mounted on a temporary dir, by default against the fake backend
+or with --slapd against a throwaway local slapd, over TCP or with --ldapi
+its Unix socket, both loaded with a tree of the given shape (see dit).
+Worker processes then run a weighted random mix of operations on the mount
+for the given time:
+
+    stat    stat a random file or dir
+    ls      list a random dir
+    cat     read a random file
+    walk    read every file below a random dir, like dev/bin/catall
+
+and the throughput and latency percentiles of each are reported. Faults
+can be injected into the LDAP calls, see faults, to see how the tail
+latency holds up under slow or failing servers."""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+from time import time, sleep
+
+from .exceptions import LdapfsException
+from .ldapfs import LdapFS
+from .slapd import Slapd
+from . import fakeldap
+from . import faults
+from . import stats
+from . import dit
+
+OPS = ['stat', 'ls', 'cat', 'walk']
+DEFAULT_MIX = 'stat=40, ls=20, cat=35, walk=5'
+DEFAULT_TREE = 'depth=2, fanout=10, group_size=1000'
+HOST = 'load'
+BASE_DN = 'dc=example,dc=com'
+MAX_PATHS = 100000      # files and dirs each known to the workers
+
+
+class Mount(object):
+    """LdapFS mounted on a temporary dir by a foreground ldapfsd process."""
+
+    MOUNT_TIMEOUT = 10      # seconds
+    # Like bin/ldapfsd, which may not be installed
+    DAEMON = 'from ldapfs import LdapFS; LdapFS.run()'
+
+    def __init__(self, config):
+        self.config = config
+        self.mountpoint = None
+        self.process = None
+
+    def start(self):
+        """Mount the file system.
+
+           :raises: LdapfsException
+        """
+        self.mountpoint = tempfile.mkdtemp(prefix='ldapfs-mnt-')
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', self.DAEMON, '-f',
+             '-o', 'config={}'.format(self.config), self.mountpoint])
+        deadline = time() + self.MOUNT_TIMEOUT
+        while not os.path.ismount(self.mountpoint):
+            if self.process.poll() is not None or time() > deadline:
+                self.stop()
+                raise LdapfsException('Failed to mount LdapFS on {}'
+                                      .format(self.mountpoint))
+            sleep(0.1)
+
+    def stop(self):
+        """Unmount the file system."""
+        if self.process:
+            if self.process.poll() is None:
+                subprocess.call(['fusermount', '-u', self.mountpoint])
+                self.process.wait()
+            self.process = None
+        if self.mountpoint:
+            os.rmdir(self.mountpoint)
+            self.mountpoint = None
+
+
+def parse_mix(mix_str):
+    """Return (op, weight) pairs for a string like DEFAULT_MIX.
+
+       :raises: ValueError
+    """
+    mix = []
+    for op_weight in mix_str.split(','):
+        if not op_weight.strip():
+            continue
+        op, weight = [part.strip() for part in op_weight.split('=')]
+        if op not in OPS or int(weight) < 0:
+            raise ValueError('Invalid operation mix "{}"'.format(op_weight))
+        mix.append((op, int(weight)))
+    if not sum([weight for _, weight in mix]):
+        raise ValueError('No operations in mix "{}"'.format(mix_str))
+    return mix
+
+
+def find_paths(top):
+    """Return lists of the dirs and files below top, up to MAX_PATHS each.
+
+    The status dir is left out, its files don't touch the directory."""
+    dirs = []
+    files = []
+    for root, dir_names, names in os.walk(top):
+        if root == top and LdapFS.STATUS_DIR in dir_names:
+            dir_names.remove(LdapFS.STATUS_DIR)
+        if len(dirs) < MAX_PATHS:
+            dirs.append(root)
+        files.extend([os.path.join(root, name)
+                      for name in names[:MAX_PATHS - len(files)]])
+    return dirs, files
+
+
+def run(dirs, files, mix, workers, duration):
+    """Run the load from worker processes.
+
+    Returns a dict of op name to a stats.Histogram of its latencies and
+    the elapsed time."""
+    pool = multiprocessing.Pool(workers)
+    try:
+        start = time()
+        results = pool.map(work, [(dirs, files, mix, duration, seed)
+                                  for seed in range(workers)])
+        elapsed = time() - start
+    finally:
+        pool.close()
+        pool.join()
+    histograms = {}
+    for result in results:
+        for op, histogram in result.items():
+            histograms.setdefault(op, stats.Histogram()).merge(histogram)
+    return histograms, elapsed
+
+
+def work(args):
+    """Run random operations for the given time (worker process)."""
+    dirs, files, mix, duration, seed = args
+    rnd = random.Random(seed)
+    choices = [op for op, weight in mix for _ in range(weight)]
+    histograms = dict([(op, stats.Histogram()) for op, _ in mix])
+    deadline = time() + duration
+    while time() < deadline:
+        op = rnd.choice(choices)
+        start = time()
+        try:
+            OP_FUNCS[op](rnd, dirs, files)
+            error = False
+        except (IOError, OSError):
+            error = True
+        histograms[op].record(time() - start, error)
+    return histograms
+
+
+def _stat(rnd, dirs, files):
+    """Stat a random file or dir."""
+    os.stat(rnd.choice(files if files and rnd.random() < 0.5 else dirs))
+
+
+def _ls(rnd, dirs, _):
+    """List a random dir."""
+    os.listdir(rnd.choice(dirs))
+
+
+def _cat(rnd, _, files):
+    """Read a random file."""
+    with open(rnd.choice(files)) as in_file:
+        in_file.read()
+
+
+def _walk(rnd, dirs, _):
+    """Read every file below a random dir."""
+    for root, _, names in os.walk(rnd.choice(dirs)):
+        for name in names:
+            with open(os.path.join(root, name)) as in_file:
+                in_file.read()
+
+
+OP_FUNCS = {'stat': _stat, 'ls': _ls, 'cat': _cat, 'walk': _walk}
+
+
+def report(histograms, elapsed, workers):
+    """Return the text reporting on a run."""
+    lines = ['{} workers for {:.1f}s\n'.format(workers, elapsed),
+             '{:<8} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}\n'.format(
+                 '# op', 'count', 'errors', 'ops/s', 'p50ms', 'p99ms',
+                 'maxms')]
+    for op in OPS:
+        histogram = histograms.get(op)
+        if histogram:
+            lines.append('{:<8} {:>9} {:>7} {:>9.1f} {:>9.3f} {:>9.3f} '
+                         '{:>9.3f}\n'.format(
+                             op, histogram.count, histogram.errors,
+                             histogram.count / elapsed,
+                             histogram.percentile(50) * 1000,
+                             histogram.percentile(99) * 1000,
+                             histogram.max * 1000))
+    return ''.join(lines)
+
+
+def parse_args():
+    """Return the parsed command line args with the mix and tree shape.
+
+    The command line is checked fully before anything is started."""
+    parser = argparse.ArgumentParser(
+        description='Run concurrent load on a mounted LdapFS.')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Worker processes [default: %(default)s]')
+    parser.add_argument('-d', '--duration', type=float, default=10,
+                        help='Seconds to run for [default: %(default)s]')
+    parser.add_argument('-m', '--mix', default=DEFAULT_MIX,
+                        help='Weights of the operations run '
+                             '[default: %(default)s]')
+    parser.add_argument('-c', '--config',
+                        help='Mount with this LdapFS config file rather than '
+                             'against a generated directory')
+    parser.add_argument('--slapd', action='store_true',
+                        help='Serve the generated directory from a local '
+                             'slapd rather than the fake backend')
+    parser.add_argument('--ldapi', action='store_true',
+                        help="With --slapd, connect over slapd's ldapi "
+                             'socket with SASL EXTERNAL rather than TCP')
+    parser.add_argument('-t', '--tree', default=DEFAULT_TREE,
+                        help='Shape of the generated directory '
+                             '[default: %(default)s]')
+    parser.add_argument('-l', '--latency', type=int, default=0,
+                        help='Milliseconds added to each fake backend call '
+                             '[default: %(default)s]')
+    parser.add_argument('-f', '--faults',
+                        help='Faults injected into the LDAP calls of the '
+                             'generated directory, e.g. '
+                             '"search: stall=0.01:1000, error=0.01:BUSY"')
+    args = parser.parse_args()
+    if args.ldapi and not args.slapd:
+        parser.error('--ldapi needs --slapd')
+    try:
+        mix = parse_mix(args.mix)
+        shape = dit.parse_shape(args.tree)
+        if args.faults:
+            faults.parse_faults(args.faults)
+    except (ValueError, LdapfsException) as ex:
+        parser.error(str(ex))
+    return args, mix, shape
+
+
+def main():
+    """Run the load tool."""
+    args, mix, shape = parse_args()
+    config_dir = tempfile.mkdtemp(prefix='ldapfs-load-')
+    server = mount = None
+    try:
+        config = args.config
+        if not config:
+            config = os.path.join(config_dir, 'ldapfs.cfg')
+            host_config = {'faults': args.faults} if args.faults else {}
+            if args.slapd:
+                server = Slapd([BASE_DN], shape)
+                server.start()
+                if args.ldapi:
+                    host_config.update({'uris': server.ldapi_uri,
+                                        'sasl_mech': 'EXTERNAL'})
+                server.write_config(config, None, host_config)
+            else:
+                host_config.update({'fake_tree': args.tree,
+                                    'fake_latency': args.latency})
+                fakeldap.write_config(config, HOST, [BASE_DN], None,
+                                      host_config)
+        mount = Mount(config)
+        mount.start()
+        dirs, files = find_paths(mount.mountpoint)
+        histograms, elapsed = run(dirs, files, mix, args.workers,
+                                  args.duration)
+        print report(histograms, elapsed, args.workers)
+    except LdapfsException as ex:
+        sys.exit(str(ex))
+    finally:
+        if mount:
+            mount.stop()
+        if server:
+            server.stop()
+        shutil.rmtree(config_dir)
@@ -0,0 +1,256 @@
+
+"""Metrics in the Prometheus text exposition format.
+
+Metrics can be served over HTTP, for scraping, or written periodically to
+a file for the node_exporter textfile collector."""
+
+import os
+import threading
+import logging
+import BaseHTTPServer
+from collections import defaultdict
+
+LOG = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    """Counters for FUSE operations and LDAP searches.
+
+    This is an instrument.Instrument recorder. The LDAP connection's own
+    counters and, if given, the latency statistics are included when the
+    metrics are rendered."""
+
+    def __init__(self, ldap, stats=None):
+        self.ldap = ldap
+        self.stats = stats
+        self.fuse_ops = defaultdict(int)        # (op, outcome) -> count
+        self.ldap_searches = defaultdict(int)   # (host, scope, outcome)
+        self.ldap_entries = defaultdict(int)    # host -> entries received
+
+    def __call__(self, name, args, result, error, start, elapsed):
+        """Count a call (instrument.Instrument recorder)."""
+        if name.startswith('fuse.'):
+            failed = error is not None or \
+                     (isinstance(result, int) and result < 0)
+            self.fuse_ops[(name[5:], 'error' if failed else 'ok')] += 1
+        elif name == 'ldap.search':
+            host, _, children = args[:3]
+            scope = 'onelevel' if children else 'base'
+            self.ldap_searches[(host, scope,
+                                'error' if error else 'ok')] += 1
+            if result:
+                # Recorders must be cheap - the size of the entries would
+                # take a walk over all their values
+                self.ldap_entries[host] += len(result)
+
+    def text(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        self._add(lines, 'ldapfs_fuse_operations_total', 'counter',
+                  'FUSE operations by operation and outcome.',
+                  [({'op': op, 'outcome': outcome}, count)
+                   for (op, outcome), count in self.fuse_ops.items()])
+        self._add(lines, 'ldapfs_ldap_searches_total', 'counter',
+                  'LDAP searches by host, scope and outcome.',
+                  [({'host': host, 'scope': scope, 'outcome': outcome}, count)
+                   for (host, scope, outcome), count
+                   in self.ldap_searches.items()])
+        self._add(lines, 'ldapfs_ldap_received_entries_total', 'counter',
+                  'LDAP entries received in search results by host.',
+                  [({'host': host}, count)
+                   for host, count in self.ldap_entries.items()])
+        self._add_connection(lines)
+        self._add_latency(lines)
+        return ''.join(lines)
+
+    def _add_connection(self, lines):
+        """Add metrics kept by the LDAP connection."""
+        for event, count in sorted(self.ldap.leaf_stats.items()):
+            self._add(lines, 'ldapfs_leaf_cache_{}_total'.format(event),
+                      'counter', 'Leaf flag cache {}.'.format(event),
+                      [({}, count)])
+        self._add(lines, 'ldapfs_leaf_cache_entries', 'gauge',
+                  'Leaf flags currently cached.',
+                  [({}, len(self.ldap.leaves))])
+        if self.ldap.entry_cache:
+            cache = self.ldap.entry_cache
+            for event, count in sorted(cache.stats.items()):
+                self._add(lines, 'ldapfs_entry_cache_{}_total'.format(event),
+                          'counter', 'Entry cache {}.'.format(
+                              event.replace('_', ' ')),
+                          [({}, count)])
+            self._add(lines, 'ldapfs_entry_cache_entries', 'gauge',
+                      'Search results currently cached.',
+                      [({}, len(cache.results))])
+        hosts = sorted(self.ldap.hosts.items())
+        replicas = [(host, replica) for host, values in hosts
+                    for replica in values.get('replicas', [])]
+        self._add(lines, 'ldapfs_ldap_connections', 'gauge',
+                  'Open LDAP connections by host.',
+                  [({'host': host}, sum(1 for replica
+                                        in values.get('replicas', [])
+                                        if replica.con))
+                   for host, values in hosts])
+        self._add(lines, 'ldapfs_ldap_reconnects_total', 'counter',
+                  'LDAP connections made by host after the first to each '
+                  'replica.',
+                  [({'host': host},
+                    max(0, values.get('connects', 0) -
+                        (len(values.get('replicas', [])) or 1)))
+                   for host, values in hosts])
+        self._add(lines, 'ldapfs_ldap_replica_up', 'gauge',
+                  'Whether each LDAP replica is connected.',
+                  [({'host': host, 'uri': replica.uri},
+                    1 if replica.is_up() else 0)
+                   for host, replica in replicas])
+        self._add(lines, 'ldapfs_ldap_replica_latency_seconds', 'gauge',
+                  'Moving average search time of each LDAP replica.',
+                  [({'host': host, 'uri': replica.uri}, replica.latency)
+                   for host, replica in replicas
+                   if replica.latency is not None])
+        self._add(lines, 'ldapfs_ldap_host_down', 'gauge',
+                  'Whether each LDAP host is down and being probed.',
+                  [({'host': host}, 1 if 'down_since' in values else 0)
+                   for host, values in hosts])
+        self._add(lines, 'ldapfs_ldap_breaker_open', 'gauge',
+                  'Whether the circuit breaker of each LDAP host is open.',
+                  [({'host': host}, 0 if breaker.state == breaker.CLOSED
+                    else 1)
+                   for host, breaker in sorted(self.ldap.breakers.items())])
+        self._add(lines, 'ldapfs_ldap_breaker_trips_total', 'counter',
+                  'Times the circuit breaker of each LDAP host opened.',
+                  [({'host': host}, breaker.trips)
+                   for host, breaker in sorted(self.ldap.breakers.items())])
+        admissions = sorted(self.ldap.admissions.items())
+        self._add(lines, 'ldapfs_ldap_in_flight', 'gauge',
+                  'LDAP searches in flight by host.',
+                  [({'host': host}, admission.in_flight)
+                   for host, admission in admissions])
+        self._add(lines, 'ldapfs_ldap_queued', 'gauge',
+                  'LDAP searches waiting to be admitted by host.',
+                  [({'host': host}, admission.queued)
+                   for host, admission in admissions])
+        self._add(lines, 'ldapfs_ldap_rejected_total', 'counter',
+                  'LDAP searches turned away by admission control.',
+                  [({'host': host}, admission.rejected)
+                   for host, admission in admissions])
+        self._add(lines, 'ldapfs_ldap_timeouts_total', 'counter',
+                  'LDAP binds and searches abandoned at their deadline.',
+                  [({'host': host}, values.get('timeouts', 0))
+                   for host, values in hosts])
+
+    def _add_latency(self, lines):
+        """Add latency quantiles from the latency statistics."""
+        if not self.stats:
+            return
+        name = 'ldapfs_call_latency_seconds'
+        histograms = sorted(self.stats.histograms.items())
+        samples = []
+        for call, histogram in histograms:
+            for quantile in (50, 90, 99):
+                samples.append(({'call': call,
+                                 'quantile': str(quantile / 100.0)},
+                                histogram.percentile(quantile)))
+        self._add(lines, name, 'summary',
+                  'Latency quantiles of FUSE operations and LDAP calls.',
+                  samples)
+        for call, histogram in histograms:
+            lines.append(self._sample(name + '_sum', {'call': call},
+                                      histogram.total))
+            lines.append(self._sample(name + '_count', {'call': call},
+                                      histogram.count))
+
+    @staticmethod
+    def _add(lines, name, metric_type, help_text, samples):
+        """Add the lines for one metric and its samples."""
+        lines.append('# HELP {} {}\n'.format(name, help_text))
+        lines.append('# TYPE {} {}\n'.format(name, metric_type))
+        for labels, value in sorted(samples):
+            lines.append(Metrics._sample(name, labels, value))
+
+    @staticmethod
+    def _sample(name, labels, value):
+        """Return the line for one sample."""
+        if not labels:
+            return '{} {}\n'.format(name, value)
+        label_text = ','.join(['{}="{}"'.format(key, Metrics._escape(val))
+                               for key, val in sorted(labels.items())])
+        return '{}{{{}}} {}\n'.format(name, label_text, value)
+
+    @staticmethod
+    def _escape(value):
+        """Escape a label value."""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                         .replace('\n', '\\n')
+
+
+class MetricsServer(threading.Thread):
+    """Serve metrics over HTTP from a background thread."""
+
+    def __init__(self, metrics, address, port):
+        threading.Thread.__init__(self, name='metrics-server')
+        self.daemon = True
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            """Reply to any GET with the current metrics."""
+            # pylint: disable-msg=C0103
+            def do_GET(self):
+                """Send the metrics."""
+                body = metrics.text()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                """Log requests at debug level rather than to stderr."""
+                # pylint: disable-msg=W0622
+                # - the name of the overridden method's argument
+                LOG.debug(format, *args)
+
+        self.server = BaseHTTPServer.HTTPServer((address, port), Handler)
+
+    def run(self):
+        LOG.debug('Serving metrics on %s', self.server.server_address)
+        self.server.serve_forever()
+
+    def stop(self):
+        """Stop serving metrics."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsFile(threading.Thread):
+    """Write metrics to a file periodically from a background thread.
+
+    The file is replaced atomically so readers never see a partial file."""
+
+    def __init__(self, metrics, path, interval):
+        threading.Thread.__init__(self, name='metrics-file')
+        self.daemon = True
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.write()
+            self.stopped.wait(self.interval)
+
+    def write(self):
+        """Write the current metrics to the file."""
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as metrics_file:
+                metrics_file.write(self.metrics.text())
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as ex:
+            LOG.error('Error writing metrics file %s: %s', self.path, ex)
+
+    def stop(self):
+        """Stop writing metrics, writing them one last time."""
+        self.stopped.set()
+        self.write()
@@ -0,0 +1,107 @@
+
+"""CPU and memory profiling of a running file system, toggled by a signal."""
+
+import os
+import gc
+import cProfile
+import pstats
+import logging
+from collections import Counter
+from time import strftime
+
+try:
+    import tracemalloc     # pylint: disable-msg=F0401
+except ImportError:
+    tracemalloc = None
+
+LOG = logging.getLogger(__name__)
+
+
+class Profiler(object):
+    """Start and stop a profiling session each time toggle() is called.
+
+    While a session runs, calls are profiled with cProfile and memory
+    allocations are traced with tracemalloc if it is available (Python 3.4+
+    or pytracemalloc), otherwise live objects are counted by type at the
+    start and end of the session. When the session stops these files are
+    written to the profile dir, named by pid and start time:
+
+        <prefix>.pstats     cProfile stats, for pstats or a viewer
+        <prefix>.txt        the top functions by cumulative time
+        <prefix>.mem        the top allocation sites or object type growth
+
+    cProfile only profiles the thread which starts the session, which is
+    the thread running the signal handler - the main thread serving FUSE.
+
+       Setup with: signal.signal(signal.SIGUSR2, Profiler(profile_dir).toggle)
+    """
+
+    TOP = 50                # lines written to the text reports
+
+    def __init__(self, profile_dir):
+        self.profile_dir = profile_dir
+        self.profile = None
+        self.prefix = None
+        self.object_counts = None
+
+    def toggle(self, *_):
+        """Start a session or stop the current one (signal handler)."""
+        if self.profile:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        """Start a profiling session."""
+        self.prefix = os.path.join(self.profile_dir, 'ldapfs-{}-{}'.format(
+            os.getpid(), strftime('%Y%m%d-%H%M%S')))
+        if tracemalloc:
+            tracemalloc.start()
+        else:
+            self.object_counts = self._count_objects()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        LOG.warning('Profiling started, writing to %s.*', self.prefix)
+
+    def stop(self):
+        """Stop the profiling session and write the reports."""
+        profile, self.profile = self.profile, None
+        profile.disable()
+        try:
+            profile.dump_stats(self.prefix + '.pstats')
+            with open(self.prefix + '.txt', 'w') as text_file:
+                stats = pstats.Stats(profile, stream=text_file)
+                stats.sort_stats('cumulative').print_stats(self.TOP)
+            with open(self.prefix + '.mem', 'w') as mem_file:
+                mem_file.writelines(self._memory_report())
+        except (IOError, OSError) as ex:
+            LOG.error('Error writing profile %s: %s', self.prefix, ex)
+        else:
+            LOG.warning('Profiling stopped, wrote %s.*', self.prefix)
+        finally:
+            if tracemalloc:
+                tracemalloc.stop()
+            self.object_counts = None
+
+    def _memory_report(self):
+        """Return lines reporting memory use during the session."""
+        if tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            lines = ['# Top allocation sites by size\n']
+            for stat in snapshot.statistics('lineno')[:self.TOP]:
+                lines.append('{}\n'.format(stat))
+            return lines
+
+        counts = self._count_objects()
+        counts.subtract(self.object_counts)
+        lines = ['# Growth in live objects by type (no tracemalloc)\n']
+        for type_name, growth in counts.most_common(self.TOP):
+            if growth <= 0:
+                break
+            lines.append('{:>10} {}\n'.format('+{}'.format(growth), type_name))
+        return lines
+
+    @staticmethod
+    def _count_objects():
+        """Return a Counter of objects tracked by gc keyed by type name."""
+        return Counter(type(obj).__name__ for obj in gc.get_objects())
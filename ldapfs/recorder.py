@@ -0,0 +1,109 @@
+
+"""Recording of FUSE operations to a compact binary file for later replay.
+
+A record file starts with MAGIC followed by one record per operation:
+
+    HEADER      start time, duration (float seconds), op code, result,
+                size, offset and path length, little-endian
+    path        the path, HEADER's last field bytes long
+
+The result is the negative errno the operation returned, or 0 for
+success. The size is the read size or the open/release flags, the offset
+the read or readdir offset."""
+
+import struct
+import threading
+import logging
+from collections import namedtuple
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = 'LDAPFSR1'
+HEADER = struct.Struct('<ddBiIqH')
+OPS = ['getattr', 'readdir', 'open', 'read', 'release']
+
+Record = namedtuple('Record', ['start', 'elapsed', 'op', 'result', 'size',
+                               'offset', 'path'])
+
+
+class Recorder(object):
+    """Append every FUSE operation to a record file.
+
+    This is an instrument.Instrument recorder. Each operation is packed into
+    a single write to a buffered file, nothing else is done per call.
+
+       Setup with: instrument.add(Recorder(record_file)) and start()
+    """
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, record_file):
+        self.record_file = record_file
+        self.lock = threading.Lock()
+        self.file = None
+
+    def start(self):
+        """Create the record file, operations are recorded from now on.
+
+           :raises: IOError
+        """
+        record_file = open(self.record_file, 'wb', self.BUFFER_SIZE)
+        record_file.write(MAGIC)
+        self.file = record_file
+
+    def __call__(self, name, args, result, error, start, elapsed):
+        """Record a FUSE operation (instrument.Instrument recorder)."""
+        if not name.startswith('fuse.'):
+            return
+        op = name[5:]
+        if op == 'read':
+            size, offset = args[1:3]
+        elif op == 'readdir':
+            size, offset = 0, args[1]
+        elif op in ('open', 'release'):
+            size, offset = args[1], 0
+        else:
+            size, offset = 0, 0
+        if error is not None:
+            result = -1
+        elif not isinstance(result, int) or result > 0:
+            result = 0
+        path = args[0]
+        record = HEADER.pack(start, elapsed, OPS.index(op), result, size,
+                             offset, len(path)) + path
+        with self.lock:
+            if self.file:
+                self.file.write(record)
+
+    def close(self):
+        """Flush and close the record file."""
+        with self.lock:
+            if self.file:
+                try:
+                    self.file.close()
+                except IOError as ex:
+                    LOG.error('Error writing record file %s: %s',
+                              self.record_file, ex)
+                self.file = None
+
+
+def read_records(record_file):
+    """Yield the Records in the given record file.
+
+       :raises: ValueError if the file isn't a record file
+    """
+    with open(record_file, 'rb') as in_file:
+        if in_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not an ldapfs record file: {}'
+                             .format(record_file))
+        while True:
+            header = in_file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                # The end of the file, or of a partly written record
+                return
+            start, elapsed, op, result, size, offset, length = \
+                HEADER.unpack(header)
+            path = in_file.read(length)
+            if len(path) < length:
+                return
+            yield Record(start, elapsed, OPS[op], result, size, offset, path)
@@ -0,0 +1,131 @@
+
+"""Replay recorded FUSE operations against LdapFS without a mount.
+
+Usage: ldapfs-replay -c <config-file> [-s <speed>] <record-file>
+
+Operations recorded with the record_file option are replayed, in order
+from a single thread, directly against an LdapFS built from the given
+config. Throughput and latency percentiles are reported for the replayed
+and the originally recorded operations."""
+
+import sys
+import argparse
+from time import time, sleep
+
+from .exceptions import LdapfsException
+from .ldapfs import LdapFS
+from . import recorder
+from . import stats
+
+
+def create_fs(config):
+    """Return an LdapFS for the given config file, ready to serve."""
+    # LdapFS parses its options from the command line, like a mount would
+    argv = sys.argv[1:]
+    sys.argv[1:] = ['-o', 'config={}'.format(config)]
+    try:
+        ldapfs = LdapFS()
+    finally:
+        sys.argv[1:] = argv
+        # Report uncaught exceptions on the console, not in the log
+        sys.excepthook = sys.__excepthook__
+    if ldapfs.recorder:
+        # Don't record the replay
+        ldapfs.instrument.recorders.remove(ldapfs.recorder)
+        ldapfs.recorder = None
+    ldapfs.fsinit()
+    return ldapfs
+
+
+def replay(ldapfs, records, speed=0):
+    """Replay records, returning the replayed and recorded Stats.
+
+    A speed of 1 keeps the recorded time between operations, 2 halves it
+    and so on. A speed of 0 replays as fast as possible."""
+    replayed = stats.Stats()
+    recorded = stats.Stats()
+    handles = {}    # path -> handles returned by open, most recent last
+    first = began = None
+    for record in records:
+        if first is None:
+            first, began = record.start, time()
+        elif speed:
+            delay = (record.start - first) / speed - (time() - began)
+            if delay > 0:
+                sleep(delay)
+        name = 'fuse.' + record.op
+        args = (record.path,)
+        recorded(name, args, record.result, None, record.start,
+                 record.elapsed)
+        start = time()
+        try:
+            result = _call(ldapfs, record, handles)
+        except Exception as ex:     # pylint: disable-msg=W0703
+            replayed(name, args, None, ex, start, time() - start)
+        else:
+            replayed(name, args, result, None, start, time() - start)
+    return replayed, recorded
+
+
+def _call(ldapfs, record, handles):
+    """Make the FUSE call for a record and return its result."""
+    path = record.path
+    if record.op == 'getattr':
+        return ldapfs.getattr(path)
+    elif record.op == 'readdir':
+        result = ldapfs.readdir(path, record.offset)
+        return result if isinstance(result, int) else list(result)
+    elif record.op == 'open':
+        result = ldapfs.open(path, record.size)
+        if not isinstance(result, int):
+            handles.setdefault(path, []).append(result)
+        return result
+    elif record.op == 'read':
+        fh = handles[path][-1] if handles.get(path) else None
+        return ldapfs.read(path, record.size, record.offset, fh)
+    else:
+        fh = handles[path].pop() if handles.get(path) else None
+        return ldapfs.release(path, record.size, fh)
+
+
+def report(replayed, recorded, elapsed):
+    """Return the text reporting on a replay."""
+    count = sum([histogram.count
+                 for histogram in replayed.histograms.values()])
+    rate = count / elapsed if elapsed else 0.0
+    return ('Replayed {} operations in {:.3f}s ({:.1f} ops/s)\n\n'
+            'Replayed latencies:\n{}\nRecorded latencies:\n{}'
+            .format(count, elapsed, rate, replayed.text(), recorded.text()))
+
+
+def main():
+    """Run the replay tool."""
+    parser = argparse.ArgumentParser(
+        description='Replay FUSE operations recorded by LdapFS.')
+    parser.add_argument('-c', '--config', default=LdapFS.DEFAULT_CONFIG,
+                        help='LdapFS configuration filename '
+                             '[default: %(default)s]')
+    parser.add_argument('-s', '--speed', type=float, default=0,
+                        help='1 replays at the recorded pace, 2 at twice '
+                             'the pace and so on. 0 replays as fast as '
+                             'possible [default: %(default)s]')
+    parser.add_argument('record_file', help='File recorded by LdapFS')
+    args = parser.parse_args()
+
+    try:
+        # Read the records before connecting so a bad file fails fast
+        records = list(recorder.read_records(args.record_file))
+    except (IOError, ValueError) as ex:
+        parser.error(str(ex))
+
+    try:
+        ldapfs = create_fs(args.config)
+    except LdapfsException as ex:
+        sys.exit(str(ex))
+    try:
+        start = time()
+        replayed, recorded = replay(ldapfs, records, args.speed)
+        elapsed = time() - start
+    finally:
+        ldapfs.fsdestroy()
+    print report(replayed, recorded, elapsed)
@@ -0,0 +1,55 @@
+
+"""What an LDAP server supports, read from its Root DSE.
+
+The Root DSE is the entry with the empty DN. Servers list in it the
+controls, extended operations and features they support by OID, and the
+naming contexts (suffixes) they hold. RootDSE maps the OIDs of interest
+to names so that features can be enabled where the server has them:
+
+    root_dse = RootDSE(attrs)
+    if root_dse.supports('paged_results'): ...
+"""
+
+
+class RootDSE(object):
+    """The capabilities advertised in a server's Root DSE."""
+
+    ATTRS = ['supportedControl', 'supportedExtension', 'supportedFeatures',
+             'namingContexts']
+    # Names of well known OIDs, by the attribute listing them
+    CONTROLS = {'paged_results': '1.2.840.113556.1.4.319',
+                'server_side_sort': '1.2.840.113556.1.4.473',
+                'vlv': '2.16.840.1.113730.3.4.9',
+                'syncrepl': '1.3.6.1.4.1.4203.1.9.1.1',
+                'tree_delete': '1.2.840.113556.1.4.805',
+                'manage_dsa_it': '2.16.840.1.113730.3.4.2'}
+    EXTENSIONS = {'start_tls': '1.3.6.1.4.1.1466.20037',
+                  'who_am_i': '1.3.6.1.4.1.4203.1.11.3',
+                  'cancel': '1.3.6.1.1.8'}
+    FEATURES = {'all_operational_attrs': '1.3.6.1.4.1.4203.1.5.1',
+                'absolute_filters': '1.3.6.1.4.1.4203.1.5.3'}
+
+    def __init__(self, attrs=None):
+        attrs = dict((name.lower(), vals)
+                     for name, vals in (attrs or {}).iteritems())
+        self.controls = set(attrs.get('supportedcontrol') or [])
+        self.extensions = set(attrs.get('supportedextension') or [])
+        self.features = set(attrs.get('supportedfeatures') or [])
+        self.naming_contexts = [dn for dn in attrs.get('namingcontexts') or []
+                                if dn]
+        # Maps each known capability name to whether it's supported
+        self.capabilities = {}
+        for names, oids in ((self.CONTROLS, self.controls),
+                            (self.EXTENSIONS, self.extensions),
+                            (self.FEATURES, self.features)):
+            for name, oid in names.iteritems():
+                self.capabilities[name] = oid in oids
+
+    def supports(self, name):
+        """Is the named control, extension or feature supported?"""
+        return self.capabilities.get(name, False)
+
+    def __str__(self):
+        names = sorted(name for name, supported
+                       in self.capabilities.iteritems() if supported)
+        return ', '.join(names) or 'none'
@@ -0,0 +1,217 @@
+
+"""A throwaway local OpenLDAP slapd serving generated directories.
+
+Used by the integration tests and benchmarks to measure LdapFS against a
+real server without any external service:
+
+    server = Slapd(['dc=example,dc=com'], dit.parse_shape('depth=2'))
+    server.start()
+    server.write_config('/tmp/ldapfs.cfg')
+    ...
+    server.stop()
+"""
+
+import os
+import socket
+import shutil
+import tempfile
+import subprocess
+import logging
+import ldif
+from time import time, sleep
+
+from .exceptions import LdapfsException
+from . import dit
+
+LOG = logging.getLogger(__name__)
+
+
+class Slapd(object):
+    """Run slapd in a temporary dir with generated directories loaded.
+
+    Each base DN is a suffix of a single mdb database, filled with a tree
+    of the given shape by slapadd before slapd starts. slapd listens on a
+    free port on the loopback interface and on an ldapi socket."""
+
+    SLAPD_PATHS = ['/usr/sbin/slapd', '/usr/local/sbin/slapd',
+                   '/usr/libexec/slapd', '/usr/local/libexec/slapd']
+    SCHEMA_DIRS = ['/etc/ldap/schema', '/etc/openldap/schema',
+                   '/usr/local/etc/openldap/schema']
+    MODULE_DIRS = ['/usr/lib/ldap', '/usr/lib64/openldap',
+                   '/usr/lib/openldap', '/usr/local/libexec/openldap']
+    SCHEMAS = ['core', 'cosine', 'inetorgperson']
+    BIND_PASSWORD = 'secret'
+    START_TIMEOUT = 10      # seconds
+
+    def __init__(self, base_dns, shape=None):
+        self.base_dns = base_dns
+        self.shape = shape or dit.DEFAULT_SHAPE
+        self.bind_dn = 'cn=admin,{}'.format(base_dns[0])
+        self.dir = None
+        self.port = None
+        self.process = None
+
+    @classmethod
+    def find(cls):
+        """Return the path of the slapd binary or None if not installed."""
+        for path in cls.SLAPD_PATHS:
+            if os.access(path, os.X_OK):
+                return path
+        return None
+
+    @property
+    def uri(self):
+        """The ldap:// URI slapd listens on."""
+        return 'ldap://127.0.0.1:{}'.format(self.port)
+
+    @property
+    def ldapi_uri(self):
+        """The ldapi:// URI of slapd's socket."""
+        return 'ldapi://{}'.format(
+            os.path.join(self.dir, 'ldapi').replace('/', '%2F'))
+
+    def start(self):
+        """Load the directories and start slapd.
+
+           :raises: LdapfsException
+        """
+        slapd = self.find()
+        if not slapd:
+            raise LdapfsException('slapd not found')
+        self.dir = tempfile.mkdtemp(prefix='ldapfs-slapd-')
+        try:
+            self._start(slapd)
+        except Exception:
+            self.stop()
+            raise
+        LOG.debug('slapd started on %s with %d entries', self.uri,
+                  dit.count(self.shape) * len(self.base_dns))
+
+    def _start(self, slapd):
+        """Load the directories and start slapd in the temporary dir."""
+        os.mkdir(os.path.join(self.dir, 'db'))
+        config = os.path.join(self.dir, 'slapd.conf')
+        with open(config, 'w') as config_file:
+            config_file.write(self._slapd_conf())
+        ldif_path = os.path.join(self.dir, 'data.ldif')
+        with open(ldif_path, 'w') as ldif_file:
+            self._write_ldif(ldif_file)
+
+        # slapadd is the slapd binary run under another name
+        self._run([os.path.join(os.path.dirname(slapd), 'slapadd'),
+                   '-q', '-f', config, '-l', ldif_path])
+        self.port = self._free_port()
+        with open(os.devnull, 'w') as devnull:
+            # -d keeps slapd in the foreground so it can be stopped
+            self.process = subprocess.Popen(
+                [slapd, '-f', config, '-h',
+                 '{} {}'.format(self.uri, self.ldapi_uri), '-d', '0'],
+                stdout=devnull, stderr=subprocess.STDOUT)
+        self._wait()
+
+    def stop(self):
+        """Stop slapd and remove its files."""
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+    def write_config(self, path, base_config=None, host_config=None):
+        """Write an LdapFS config file for this server.
+
+        The given dicts add to or replace the [ldapfs] and host settings."""
+        base = {'log_file': os.path.join(self.dir, 'ldapfs.log'),
+                'log_format': '%%(funcName)s() - %%(message)s',
+                'log_levels': 'root:error'}
+        base.update(base_config or {})
+        host = {'host': '127.0.0.1', 'port': self.port,
+                'bind_dn': self.bind_dn, 'bind_password': self.BIND_PASSWORD,
+                'base_dns': ' '.join(['"{}"'.format(base_dn)
+                                      for base_dn in self.base_dns]),
+                'ldap_trace_level': 0}
+        host.update(host_config or {})
+        with open(path, 'w') as config_file:
+            for section, values in (('ldapfs', base), ('slapd', host)):
+                config_file.write('[{}]\n'.format(section))
+                for key, value in sorted(values.items()):
+                    config_file.write('{} = {}\n'.format(key, value))
+                config_file.write('\n')
+
+    def _slapd_conf(self):
+        """Return the text of slapd.conf."""
+        schema_dir = self._find_dir(self.SCHEMA_DIRS)
+        if not schema_dir:
+            raise LdapfsException('OpenLDAP schema dir not found')
+        lines = ['include {}'.format(os.path.join(schema_dir,
+                                                  '{}.schema'.format(name)))
+                 for name in self.SCHEMAS]
+        lines.append('pidfile {}'.format(os.path.join(self.dir, 'slapd.pid')))
+        module_dir = self._find_dir(self.MODULE_DIRS, 'back_mdb.la')
+        if module_dir:
+            # slapd was built with the mdb backend as a loadable module
+            lines.extend(['modulepath {}'.format(module_dir),
+                          'moduleload back_mdb'])
+        lines.extend(['database mdb',
+                      'maxsize 1073741824',
+                      'directory {}'.format(os.path.join(self.dir, 'db')),
+                      'rootdn "{}"'.format(self.bind_dn),
+                      'rootpw {}'.format(self.BIND_PASSWORD)])
+        lines.extend(['suffix "{}"'.format(base_dn)
+                      for base_dn in self.base_dns])
+        return '\n'.join(lines) + '\n'
+
+    def _write_ldif(self, ldif_file):
+        """Write the generated directories as LDIF."""
+        writer = ldif.LDIFWriter(ldif_file)
+        for base_dn in self.base_dns:
+            for dn, attrs in dit.generate(base_dn, self.shape):
+                writer.unparse(dn, attrs)
+
+    def _wait(self):
+        """Wait for slapd to accept connections.
+
+           :raises: LdapfsException
+        """
+        deadline = time() + self.START_TIMEOUT
+        while time() < deadline:
+            if self.process.poll() is not None:
+                raise LdapfsException('slapd exited with status {}'
+                                      .format(self.process.returncode))
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                return
+            except socket.error:
+                sleep(0.1)
+        raise LdapfsException('slapd did not start within {}s'
+                              .format(self.START_TIMEOUT))
+
+    @staticmethod
+    def _run(args):
+        """Run a command, raising LdapfsException if it fails."""
+        process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise LdapfsException('{} failed: {}'.format(args[0], output))
+
+    @staticmethod
+    def _free_port():
+        """Return a currently unused port on the loopback interface."""
+        sock = socket.socket()
+        try:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+        finally:
+            sock.close()
+
+    @staticmethod
+    def _find_dir(dirs, filename=None):
+        """Return the first existing dir, containing filename if given."""
+        for path in dirs:
+            if os.path.isdir(path) and \
+               (not filename or os.path.exists(os.path.join(path, filename))):
+                return path
+        return None
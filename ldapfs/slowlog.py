@@ -0,0 +1,56 @@
+
+"""Logging of slow FUSE operations with the LDAP searches they made."""
+
+import threading
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+class SlowLog(object):
+    """Log FUSE operations taking longer than a threshold.
+
+    This is an instrument.Instrument recorder. The LDAP searches made while
+    a FUSE operation runs are collected in a per-thread context, holding
+    only references to the call's args and outcome. Nothing is formatted
+    unless the operation turns out to be slow, in which case it is logged
+    once with a breakdown of its searches."""
+
+    MAX_SEARCHES = 100      # searches kept per operation
+
+    def __init__(self, threshold):
+        self.threshold = threshold      # seconds
+        self.context = threading.local()
+
+    def __call__(self, name, args, result, error, start, elapsed):
+        """Collect or log a call (instrument.Instrument recorder)."""
+        if name == 'ldap.search':
+            searches = getattr(self.context, 'searches', None)
+            if searches is None:
+                searches = self.context.searches = []
+            if len(searches) < self.MAX_SEARCHES:
+                searches.append((args, result, error, elapsed))
+        elif name.startswith('fuse.'):
+            searches = getattr(self.context, 'searches', None) or []
+            self.context.searches = None
+            if elapsed >= self.threshold:
+                self._log(name, args, elapsed, searches)
+
+    @staticmethod
+    def _log(name, args, elapsed, searches):
+        """Log a slow operation and its searches."""
+        lines = []
+        for search_args, result, error, search_elapsed in searches:
+            host, dn, children, attrsonly = search_args[:4]
+            if error is None:
+                outcome = '{} entries'.format(len(result))
+            else:
+                outcome = 'error {}'.format(error.__class__.__name__)
+            lines.append('\n    {:.1f}ms host={} dn={} scope={} '
+                         'attrsonly={} -> {}'
+                         .format(search_elapsed * 1000, host, dn,
+                                 'onelevel' if children else 'base',
+                                 bool(attrsonly), outcome))
+        LOG.warning('Slow %s(%s) took %.1fms with %d LDAP searches%s',
+                    name[5:], ', '.join([repr(arg) for arg in args]),
+                    elapsed * 1000, len(searches), ''.join(lines))
@@ -0,0 +1,101 @@
+
+"""Latency statistics for FUSE operations and LDAP calls."""
+
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """A latency histogram with power of two microsecond buckets.
+
+    Bucket 0 counts latencies under 1us and bucket n (n > 0) latencies from
+    2^(n-1)us up to 2^n us. Recording is a few integer updates with no
+    locking. Concurrent updates may very occasionally lose a count, which
+    is acceptable for statistics."""
+
+    NBUCKETS = 40       # The last bucket covers anything over ~3 days
+
+    def __init__(self):
+        self.buckets = [0] * self.NBUCKETS
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed, error=False):
+        """Record a latency, in seconds."""
+        bucket = min(int(elapsed * 1000000).bit_length(), self.NBUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += elapsed
+        if error:
+            self.errors += 1
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def percentile(self, percent):
+        """Return the latency, in seconds, below which percent of calls fall.
+
+        The value returned is the upper bound of the bucket containing the
+        percentile, capped at the maximum recorded latency."""
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and bucket < self.NBUCKETS - 1:
+                return min((1 << bucket) / 1000000.0, self.max)
+        # The last bucket has no upper bound
+        return self.max
+
+    def merge(self, other):
+        """Add the latencies recorded by another histogram to this one."""
+        for bucket, count in enumerate(other.buckets):
+            self.buckets[bucket] += count
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        """Return the mean latency in seconds."""
+        return self.total / self.count if self.count else 0.0
+
+
+class Stats(object):
+    """Latency histograms keyed by FUSE operation and LDAP call per host.
+
+    This is an instrument.Instrument recorder. FUSE operations returning a
+    negative errno and calls raising an exception are counted as errors."""
+
+    HEADER = '{:<40} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}\n'
+    ROW = '{:<40} {:>9} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}\n'
+
+    def __init__(self):
+        self.histograms = {}
+
+    def __call__(self, name, args, result, error, start, elapsed):
+        """Record a call (instrument.Instrument recorder)."""
+        if name.startswith('ldap.') and args:
+            # LDAP calls take the host as their first argument
+            name = '{}[{}]'.format(name, args[0])
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        histogram.record(elapsed, error is not None or
+                         (isinstance(result, int) and result < 0))
+
+    def text(self):
+        """Return a table of the statistics with latencies in milliseconds."""
+        lines = [self.HEADER.format('# call', 'count', 'errors', 'p50ms',
+                                    'p90ms', 'p99ms', 'maxms')]
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(self.ROW.format(name, histogram.count,
+                                         histogram.errors,
+                                         histogram.percentile(50) * 1000,
+                                         histogram.percentile(90) * 1000,
+                                         histogram.percentile(99) * 1000,
+                                         histogram.max * 1000))
+        return ''.join(lines)
@@ -0,0 +1,37 @@
+
+"""Concurrent load on LdapFS mounted against the fake backend.
+
+Skipped unless FUSE is available. Run with py.test -s to see the report."""
+
+import os
+import pytest
+from ldapfs import fakeldap
+from ldapfs import load
+from ldapfs.load import Mount
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists('/dev/fuse') or
+    not any([os.access(os.path.join(path, 'fusermount'), os.X_OK)
+             for path in os.environ.get('PATH', '').split(os.pathsep)]),
+    reason='FUSE not available')
+
+
+@pytest.fixture
+def mount(tmpdir):
+    config = str(tmpdir.join('ldapfs.cfg'))
+    fakeldap.write_config(config, load.HOST, [load.BASE_DN], None,
+                          {'fake_tree': 'depth=1, fanout=10'})
+    mount = Mount(config)
+    mount.start()
+    yield mount
+    mount.stop()
+
+
+def test_load(mount):
+    dirs, files = load.find_paths(mount.mountpoint)
+    assert os.path.join(mount.mountpoint, load.HOST, load.BASE_DN) in dirs
+    histograms, elapsed = load.run(dirs, files,
+                                   load.parse_mix(load.DEFAULT_MIX), 4, 2)
+    print '\n' + load.report(histograms, elapsed, 4)
+    for histogram in histograms.values():
+        assert not histogram.errors
@@ -0,0 +1,82 @@
+
+"""LdapFS against a throwaway local slapd.
+
+Skipped unless OpenLDAP's slapd is installed. The tree loaded can be set
+with LDAPFS_TEST_TREE, a dit shape string such as "depth=2, fanout=20".
+Run with py.test -s to see the throughput measured."""
+
+import os
+import stat
+from time import time
+
+import pytest
+from ldapfs import dit
+from ldapfs import replay
+from ldapfs.slapd import Slapd
+
+BASE_DN = 'dc=example,dc=com'
+SHAPE = dit.parse_shape(os.environ.get('LDAPFS_TEST_TREE',
+                                       'depth=1, fanout=10, group_size=100'))
+
+
+pytestmark = pytest.mark.skipif(not Slapd.find(), reason='slapd not found')
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = Slapd([BASE_DN], SHAPE)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(params=['ldap', 'ldapi'])
+def ldapfs(server, request):
+    host_config = {}
+    if request.param == 'ldapi':
+        # The Unix socket, binding as the user running the tests
+        host_config = {'uris': server.ldapi_uri, 'sasl_mech': 'EXTERNAL'}
+    config = os.path.join(server.dir, 'ldapfs.cfg')
+    server.write_config(config, None, host_config)
+    ldapfs = replay.create_fs(config)
+    yield ldapfs
+    ldapfs.fsdestroy()
+
+
+def walk(ldapfs, path):
+    """Stat every dir and read every file below path, returning the count."""
+    count = 0
+    for entry in ldapfs.readdir(path, 0):
+        if entry.name in ('.', '..'):
+            continue
+        child = os.path.join(path, entry.name)
+        st = ldapfs.getattr(child)
+        if stat.S_ISDIR(st.st_mode):
+            count += walk(ldapfs, child)
+        else:
+            assert ldapfs.read(child, st.st_size, 0)
+        count += 1
+    return count
+
+
+def test_readdir_base(ldapfs):
+    names = [entry.name for entry in
+             ldapfs.readdir('/127.0.0.1/{}'.format(BASE_DN), 0)]
+    assert 'ou=u0' in names
+    assert 'objectClass' in names
+
+
+@pytest.mark.skipif(not SHAPE['group_size'], reason='no group')
+def test_read_group(ldapfs):
+    text = ldapfs.read('/127.0.0.1/{}/cn=group/member'.format(BASE_DN),
+                       10000000, 0)
+    assert text.count('cn=e') + text.count('uid=m') == SHAPE['group_size']
+
+
+def test_walk_throughput(ldapfs):
+    start = time()
+    files = walk(ldapfs, '/127.0.0.1/{}'.format(BASE_DN))
+    elapsed = time() - start
+    print '\nWalked {} files and dirs in {:.3f}s ({:.1f}/s)'.format(
+        files, elapsed, files / elapsed)
+    print ldapfs.stats.text()
@@ -0,0 +1,67 @@
+
+import sys
+import logging
+from ldapfs.asynclog import AsyncHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def record(msg, args=(), exc_info=None):
+    return logging.LogRecord('test', logging.ERROR, __file__, 1, msg, args,
+                             exc_info)
+
+
+def test_sync_until_started():
+    target = ListHandler()
+    handler = AsyncHandler([target])
+    handler.emit(record('a=%s', ('x',)))
+    assert target.lines == ['a=x']
+
+
+def test_async():
+    target = ListHandler()
+    handler = AsyncHandler([target])
+    handler.start()
+    for i in range(5):
+        handler.emit(record('i=%d', (i,)))
+    handler.stop()
+    assert target.lines == ['i={}'.format(i) for i in range(5)]
+    assert not handler.writer
+
+
+def test_target_level():
+    target = ListHandler()
+    target.setLevel(logging.CRITICAL)
+    handler = AsyncHandler([target])
+    handler.emit(record('dropped'))
+    assert not target.lines
+
+
+def test_full_queue_drops():
+    target = ListHandler()
+    handler = AsyncHandler([target], queue_size=2)
+    handler.writer = True       # pretend started, nothing consumes
+    for i in range(5):
+        handler.emit(record('i=%d', (i,)))
+    assert handler.dropped == 3
+    assert handler.queue.qsize() == 2
+
+
+def test_exc_info_formatted():
+    target = ListHandler()
+    handler = AsyncHandler([target])
+    handler.start()
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        handler.emit(record('failed', exc_info=sys.exc_info()))
+    handler.stop()
+    assert target.lines[0].startswith('failed\nTraceback')
+    assert 'ValueError: boom' in target.lines[0]
@@ -0,0 +1,29 @@
+
+from ldapfs import benchmark
+
+
+def test_every_benchmark_runs():
+    for _, setup in benchmark.BENCHMARKS:
+        setup()()
+
+
+def test_run_pattern():
+    results = benchmark.run('stat_create', min_time=0.001, repeat=1)
+    assert results.keys() == ['stat_create']
+    assert results['stat_create'] > 0
+
+
+def test_compare():
+    lines, regressed = benchmark.compare({'a': 0.000002, 'b': 0.000001},
+                                         {'a': 0.000001, 'c': 1.0}, 20)
+    assert regressed
+    assert lines[1].split() == ['a', '2.000', '1.000', '+100.0%',
+                                'REGRESSION']
+    assert lines[2].split() == ['b', '1.000', '-', '-']
+
+
+def test_compare_within_threshold():
+    lines, regressed = benchmark.compare({'a': 0.0000011}, {'a': 0.000001},
+                                         20)
+    assert not regressed
+    assert lines[1].split() == ['a', '1.100', '1.000', '+10.0%']
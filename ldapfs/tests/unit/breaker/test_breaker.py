@@ -0,0 +1,108 @@
+
+import threading
+from time import sleep
+import ldapfs.breaker
+from ldapfs.breaker import CircuitBreaker, Admission
+
+
+def at(monkeypatch, now):
+    monkeypatch.setattr(ldapfs.breaker, 'time', lambda: now)
+
+
+def test_breaker_closed():
+    breaker = CircuitBreaker(50, window=4)
+    for failed in (True, False, False, False, True, False):
+        assert breaker.allow()
+        breaker.record(0.1, failed)
+    assert breaker.state == breaker.CLOSED
+
+
+def test_breaker_opens_on_errors(monkeypatch):
+    at(monkeypatch, 100)
+    breaker = CircuitBreaker(50, window=4)
+    for failed in (False, True, False, True):
+        breaker.record(0.1, failed)
+    assert breaker.state == breaker.OPEN
+    assert breaker.trips == 1
+    assert not breaker.allow()
+
+
+def test_breaker_opens_on_slow_calls():
+    breaker = CircuitBreaker(100, window=2, slow_call=0.5)
+    breaker.record(0.4, False)
+    breaker.record(0.5, False)
+    assert breaker.state == breaker.CLOSED
+    breaker.record(0.6, False)
+    assert breaker.state == breaker.OPEN
+
+
+def test_breaker_trial(monkeypatch):
+    at(monkeypatch, 100)
+    breaker = CircuitBreaker(100, window=1, reset=30)
+    breaker.record(0.1, True)
+    at(monkeypatch, 129)
+    assert not breaker.allow()
+    at(monkeypatch, 130)
+    # Only one trial call at a time
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(0.1, True)
+    assert breaker.state == breaker.OPEN
+    assert breaker.trips == 2
+
+    at(monkeypatch, 160)
+    assert breaker.allow()
+    breaker.record(0.1, False)
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_cancel_trial(monkeypatch):
+    at(monkeypatch, 100)
+    breaker = CircuitBreaker(100, window=1, reset=30)
+    breaker.record(0.1, True)
+    at(monkeypatch, 130)
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow()
+    breaker.record(0.1, False)
+    assert breaker.state == breaker.CLOSED
+
+
+def test_admission_limit():
+    admission = Admission(2)
+    assert admission.enter()
+    assert admission.enter()
+    assert not admission.enter()
+    assert admission.rejected == 1
+    admission.leave()
+    assert admission.enter()
+    assert admission.in_flight == 2
+
+
+def test_admission_queue_timeout():
+    admission = Admission(1, queue_size=1, timeout=0.01)
+    assert admission.enter()
+    assert not admission.enter()
+    assert admission.queued == 0
+    assert admission.rejected == 1
+
+
+def test_admission_queued():
+    admission = Admission(1, queue_size=1)
+    assert admission.enter()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(
+        admission.enter()))
+    waiter.start()
+    while not admission.queued:
+        sleep(0.001)
+    # The queue is full
+    assert not admission.enter()
+    admission.leave()
+    waiter.join()
+    assert admitted == [True]
+    assert admission.in_flight == 1
+    assert admission.queued == 0
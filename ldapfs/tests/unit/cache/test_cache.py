@@ -0,0 +1,159 @@
+
+import mock
+import pytest
+import ldapfs.cache
+from ldapfs import dit
+from ldapfs.cache import EntryCache
+from ldapfs.exceptions import LdapException, NoSuchObject
+from ldapfs.fakeldap import FakeConnection
+
+
+class Fetch(object):
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def at(monkeypatch, now):
+    monkeypatch.setattr(ldapfs.cache, 'time', lambda: now)
+
+
+def wait_refreshed(cache):
+    cache.queue.put(None)
+    cache.refresher.join()
+    cache.refresher = None
+
+
+def test_get_fresh(monkeypatch):
+    cache = EntryCache(10)
+    fetch = Fetch('a', 'b')
+    at(monkeypatch, 100)
+    assert cache.get('key', fetch) == 'a'
+    at(monkeypatch, 109)
+    assert cache.get('key', fetch) == 'a'
+    assert fetch.calls == 1
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 1
+
+
+def test_get_expired(monkeypatch):
+    cache = EntryCache(10)
+    fetch = Fetch('a', 'b')
+    at(monkeypatch, 100)
+    cache.get('key', fetch)
+    at(monkeypatch, 110)
+    assert cache.get('key', fetch) == 'b'
+    assert fetch.calls == 2
+
+
+def test_get_stale_refreshed(monkeypatch):
+    cache = EntryCache(10, 60)
+    cache.start()
+    fetch = Fetch('a', 'b')
+    at(monkeypatch, 100)
+    cache.get('key', fetch)
+    at(monkeypatch, 150)
+    assert cache.get('key', fetch) == 'a'
+    wait_refreshed(cache)
+    assert fetch.calls == 2
+    assert cache.stats['stale_hits'] == 1
+    assert cache.stats['refreshes'] == 1
+    assert cache.get('key', fetch) == 'b'
+    assert cache.stats['hits'] == 1
+
+
+def test_get_too_stale(monkeypatch):
+    cache = EntryCache(10, 60)
+    cache.start()
+    fetch = Fetch('a', 'b')
+    at(monkeypatch, 100)
+    cache.get('key', fetch)
+    at(monkeypatch, 170)
+    assert cache.get('key', fetch) == 'b'
+    assert cache.stats['misses'] == 2
+    cache.stop()
+
+
+def test_get_stale_not_started(monkeypatch):
+    cache = EntryCache(10, 60)
+    fetch = Fetch('a', 'b')
+    at(monkeypatch, 100)
+    cache.get('key', fetch)
+    at(monkeypatch, 150)
+    assert cache.get('key', fetch) == 'a'
+    assert fetch.calls == 1
+    assert not cache.pending
+
+
+def test_refresh_errors(monkeypatch):
+    cache = EntryCache(10, 60)
+    cache.start()
+    at(monkeypatch, 100)
+    cache.get('key1', Fetch('a'))
+    cache.get('key2', Fetch('b'))
+    at(monkeypatch, 150)
+    cache.get('key1', Fetch(LdapException('down')))
+    cache.get('key2', Fetch(NoSuchObject('gone')))
+    wait_refreshed(cache)
+    assert cache.get('key1', Fetch()) == 'a'
+    assert 'key2' not in cache.results
+
+
+def test_get_error_not_cached():
+    cache = EntryCache(10)
+    with pytest.raises(NoSuchObject):
+        cache.get('key', Fetch(NoSuchObject('gone')))
+    assert not cache.results
+
+
+def test_put_full():
+    cache = EntryCache(10, size=2)
+    cache.put('key1', 'a')
+    cache.put('key2', 'b')
+    cache.put('key2', 'c')
+    assert len(cache.results) == 2
+    cache.put('key3', 'd')
+    assert cache.results.keys() == ['key3']
+    assert cache.stats['evictions'] == 2
+
+
+def test_stop_drops_queued(monkeypatch):
+    cache = EntryCache(10, 60)
+    at(monkeypatch, 100)
+    cache.get('key', Fetch('a'))
+    at(monkeypatch, 150)
+    cache.refresher = mock.Mock()   # queue without a running refresher
+    cache.get('key', Fetch('b'))
+    assert cache.pending == set(['key'])
+    cache.stop()
+    assert cache.queue.get_nowait() is None
+    assert cache.queue.empty()
+    assert not cache.pending
+
+
+def test_connection(monkeypatch):
+    values = {'port': 389, 'base_dns': ['dc=ie'], 'bind_dn': '',
+              'bind_password': '', 'ldap_trace_level': 0,
+              'fake_tree': dit.parse_shape('depth=0, fanout=3')}
+    con = FakeConnection({'host1': values}, entry_cache_ttl=10,
+                         entry_cache_max_stale=60)
+    con.open()
+    try:
+        at(monkeypatch, 100)
+        entry = con.get('host1', 'cn=e1,dc=ie', attrlist=['cn'])
+        assert con.get('host1', 'CN=e1,dc=ie', attrlist=['cn']) is entry
+        assert con.get('host1', 'cn=e1,dc=ie') is not entry
+        children = con.get_children('host1', 'dc=ie')
+        assert len(children) == 3
+        assert con.get_children('host1', 'dc=ie') is children
+        assert con.entry_cache.stats['hits'] == 2
+    finally:
+        con.close()
+    assert not con.entry_cache.refresher
@@ -0,0 +1,62 @@
+
+import pytest
+from ldapfs import dit
+from ldapfs.conf import ConfigError
+
+
+def pytest_generate_tests(metafunc):
+    for argname in metafunc.funcargnames:
+        argvalues = globals()['funcarg_{}'.format(argname)]()
+        metafunc.parametrize(argname, argvalues)
+
+
+def funcarg_bad_shape():
+    return ['depth', 'depth=x', 'size=1', 'fanout=-1', 'values=0',
+            'attrs={}'.format(len(dit.EXTRA_ATTRS) + 1)]
+
+
+def test_parse_shape():
+    shape = dit.parse_shape(' depth=1,fanout=3, group_size=5 ,')
+    assert shape['depth'] == 1
+    assert shape['fanout'] == 3
+    assert shape['group_size'] == 5
+    assert shape['attrs'] == dit.DEFAULT_SHAPE['attrs']
+    assert dit.parse_shape('') == dit.DEFAULT_SHAPE
+
+
+def test_parse_bad_shape(bad_shape):
+    with pytest.raises(ConfigError):
+        dit.parse_shape(bad_shape)
+
+
+def test_generate():
+    shape = dit.parse_shape('depth=1, fanout=2, attrs=3, value_size=20, '
+                            'values=2, group_size=6')
+    entries = list(dit.generate('dc=example,dc=com', shape))
+    dns = [dn for dn, _ in entries]
+    assert len(entries) == dit.count(shape) == 8
+    assert dns[:3] == ['dc=example,dc=com', 'ou=u0,dc=example,dc=com',
+                       'cn=e0.0,ou=u0,dc=example,dc=com']
+
+    base_attrs = entries[0][1]
+    assert base_attrs['dc'] == ['example']
+    assert 'dcObject' in base_attrs['objectClass']
+
+    leaf_attrs = entries[2][1]
+    assert len(leaf_attrs) == 3 + 3
+    for attr in dit.EXTRA_ATTRS[:3]:
+        assert len(leaf_attrs[attr]) == 2
+        assert len(set(leaf_attrs[attr])) == 2
+        assert len(leaf_attrs[attr][0]) == 20
+
+    group_dn, group_attrs = entries[-1]
+    assert group_dn == 'cn=group,dc=example,dc=com'
+    assert len(group_attrs['member']) == 6
+    assert group_attrs['member'][0] == dns[2]
+
+
+def test_generate_every_entry_follows_its_parent():
+    seen = set()
+    for dn, _ in dit.generate('ou=people', dit.parse_shape('depth=2')):
+        assert not seen or dn.split(',', 1)[1] in seen
+        seen.add(dn)
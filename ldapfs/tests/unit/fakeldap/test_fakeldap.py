@@ -0,0 +1,178 @@
+
+import ldap
+import pytest
+from ldap.controls import SimplePagedResultsControl
+from ldapfs import dit
+from ldapfs.exceptions import LdapException, NoSuchObject
+from ldapfs.fakeldap import Directory, FakeLDAPObject, FakeConnection
+
+LDIF = """dn: dc=ie
+objectClass: dcObject
+dc: ie
+
+dn: cn=a,dc=ie
+objectClass: person
+cn: a
+sn: x
+
+dn: cn=b,cn=a,dc=ie
+objectClass: person
+cn: b
+sn: y
+"""
+
+
+def directory():
+    directory = Directory()
+    directory.add('dc=ie', {'dc': ['ie']})
+    directory.add('cn=a,dc=ie', {'cn': ['a'], 'sn': ['x']})
+    directory.add('cn=b,cn=a,dc=ie', {'cn': ['b'], 'sn': ['y']})
+    return directory
+
+
+def test_search_base():
+    assert directory().search('CN=A,DC=ie', ldap.SCOPE_BASE) == \
+        [('cn=a,dc=ie', {'cn': ['a'], 'sn': ['x']})]
+
+
+def test_search_onelevel():
+    assert directory().search('dc=ie', ldap.SCOPE_ONELEVEL, ['cn']) == \
+        [('cn=a,dc=ie', {'cn': ['a']})]
+
+
+def test_search_subtree():
+    dns = [dn for dn, _ in directory().search('dc=ie', ldap.SCOPE_SUBTREE)]
+    assert dns == ['dc=ie', 'cn=a,dc=ie', 'cn=b,cn=a,dc=ie']
+
+
+def test_search_attrsonly():
+    assert directory().search('dc=ie', ldap.SCOPE_BASE, attrsonly=1) == \
+        [('dc=ie', {'dc': []})]
+
+
+def test_search_subordinates():
+    results = directory().search('cn=a,dc=ie', ldap.SCOPE_ONELEVEL,
+                                 ['numsubordinates', 'hasSubordinates'])
+    assert results == [('cn=b,cn=a,dc=ie', {'numSubordinates': ['0'],
+                                            'hasSubordinates': ['FALSE']})]
+    results = directory().search('dc=ie', ldap.SCOPE_BASE, ['cn'])
+    assert results == [('dc=ie', {})]
+
+
+def test_search_no_such_object():
+    with pytest.raises(ldap.NO_SUCH_OBJECT):
+        directory().search('cn=x,dc=ie', ldap.SCOPE_BASE)
+
+
+def test_search_invalid_dn():
+    with pytest.raises(ldap.INVALID_DN_SYNTAX):
+        directory().search('dc', ldap.SCOPE_BASE)
+
+
+def test_load_ldif(tmpdir):
+    tmpdir.join('test.ldif').write(LDIF)
+    loaded = Directory()
+    loaded.load_ldif(str(tmpdir.join('test.ldif')))
+    assert sorted(loaded.entries) == sorted(directory().entries)
+    assert loaded.search('cn=b,cn=a,dc=ie', ldap.SCOPE_BASE, ['sn']) == \
+        [('cn=b,cn=a,dc=ie', {'sn': ['y']})]
+
+
+def test_ldap_object_filter():
+    con = FakeLDAPObject(directory())
+    msgid = con.search_ext('dc=ie', ldap.SCOPE_BASE, '(objectclass=*)')
+    assert con.result3(msgid)[1]
+    with pytest.raises(ldap.UNWILLING_TO_PERFORM):
+        con.search_ext('dc=ie', ldap.SCOPE_BASE, '(cn=a)')
+
+
+def test_ldap_object_result():
+    con = FakeLDAPObject(directory())
+    msgid = con.search_ext('cn=x,dc=ie', ldap.SCOPE_BASE)
+    other_msgid = con.search_ext('dc=ie', ldap.SCOPE_BASE, attrlist=['dc'])
+    assert con.result3(other_msgid) == \
+        (ldap.RES_SEARCH_RESULT, [('dc=ie', {'dc': ['ie']})], other_msgid, [])
+    with pytest.raises(ldap.NO_SUCH_OBJECT):
+        con.result3(msgid)
+    assert not con.results
+
+
+def test_ldap_object_timeout():
+    con = FakeLDAPObject(directory(), latency=0.05)
+    msgid = con.search_ext('dc=ie', ldap.SCOPE_BASE)
+    with pytest.raises(ldap.TIMEOUT):
+        con.result3(msgid, timeout=0.01)
+    con.abandon_ext(msgid)
+    assert not con.results
+
+
+def test_naming_contexts():
+    tree = directory()
+    tree.add('ou=x,dc=com', {'ou': ['x']})
+    assert tree.naming_contexts() == ['dc=ie', 'ou=x,dc=com']
+
+
+def test_root_dse():
+    con = FakeLDAPObject(directory())
+    msgid = con.search_ext('', ldap.SCOPE_BASE)
+    [(dn, attrs)] = con.result3(msgid)[1]
+    assert dn == ''
+    assert attrs['namingContexts'] == ['dc=ie']
+    assert attrs['supportedControl'] == FakeLDAPObject.SUPPORTED_CONTROLS
+
+
+def test_paged_results():
+    tree = directory()
+    for i in range(4):
+        tree.add('cn=p{},dc=ie'.format(i), {'cn': ['p{}'.format(i)]})
+    con = FakeLDAPObject(tree)
+    control = SimplePagedResultsControl(True, size=2, cookie='')
+    pages = []
+    while True:
+        msgid = con.search_ext('dc=ie', ldap.SCOPE_ONELEVEL,
+                               serverctrls=[control])
+        _, results, _, controls = con.result3(msgid)
+        pages.append([dn for dn, _ in results])
+        control.cookie = controls[0].cookie
+        if not control.cookie:
+            break
+    assert pages == [['cn=a,dc=ie', 'cn=p0,dc=ie'],
+                     ['cn=p1,dc=ie', 'cn=p2,dc=ie'], ['cn=p3,dc=ie']]
+
+
+def hosts(**values):
+    values.update({'port': 389, 'base_dns': ['dc=ie'], 'bind_dn': '',
+                   'bind_password': '', 'ldap_trace_level': 0})
+    return {'host1': values}
+
+
+def test_connection_generated():
+    con = FakeConnection(hosts(fake_tree=dit.parse_shape('depth=0, '
+                                                          'fanout=3')))
+    con.open()
+    children = con.get_children('host1', 'dc=ie', attrlist=['cn'])
+    assert [entry.dn for entry in children] == \
+        ['cn=e0,dc=ie', 'cn=e1,dc=ie', 'cn=e2,dc=ie']
+    with pytest.raises(NoSuchObject):
+        con.get('host1', 'cn=x,dc=ie')
+
+    directory = con.directories['host1']
+    con.close()
+    con.open()
+    assert con.directories['host1'] is directory
+
+
+def test_connection_ldif(tmpdir):
+    tmpdir.join('test.ldif').write(LDIF)
+    con = FakeConnection(hosts(fake_ldif=str(tmpdir.join('test.ldif'))),
+                         leaf_cache_ttl=60)
+    con.open()
+    entry = con.get('host1', 'cn=b,cn=a,dc=ie', attrlist=['hasSubordinates'])
+    assert entry.is_leaf()
+    assert con.is_leaf('host1', 'cn=b,cn=a,dc=ie')
+
+
+def test_connection_ldif_missing(tmpdir):
+    con = FakeConnection(hosts(fake_ldif=str(tmpdir.join('missing.ldif'))))
+    with pytest.raises(LdapException):
+        con.open()
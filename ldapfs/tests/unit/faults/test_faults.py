@@ -0,0 +1,192 @@
+
+import ldap
+import errno
+import random
+import pytest
+from time import time
+from ldapfs import dit
+from ldapfs import faults
+from ldapfs import fakeldap
+from ldapfs import replay
+from ldapfs import stats
+from ldapfs.exceptions import ConfigError, LdapException, LdapTimeout
+from ldapfs.faults import Faults, FaultyLDAPObject
+from ldapfs.fakeldap import Directory, FakeConnection, FakeLDAPObject
+
+
+class RecordingLDAPObject(object):
+    def __init__(self):
+        self.calls = []
+
+    def search_st(self, base, *args, **kwargs):
+        self.calls.append(('search_st', base))
+        return [(base, {})]
+
+    def simple_bind_s(self, who='', cred=''):
+        self.calls.append(('simple_bind_s', who))
+
+    def set_option(self, option, value):
+        self.calls.append(('set_option', option))
+
+
+def test_parse_faults():
+    parsed = faults.parse_faults('search: delay=exp:20, stall=0.01:3000, '
+                                 'error=0.02:BUSY, drop=0.001; '
+                                 'bind: delay=uniform:1:5;')
+    assert sorted(parsed) == ['bind', 'search']
+    search = parsed['search']
+    assert search.delay == ('exp', [20.0])
+    assert search.stall == (0.01, 3000.0)
+    assert search.error == (0.02, ldap.BUSY)
+    assert search.drop == 0.001
+    assert parsed['bind'].delay == ('uniform', [1.0, 5.0])
+    assert parsed['bind'].error == (0, None)
+
+
+@pytest.mark.parametrize('faults_str', [
+    'read: delay=fixed:1',
+    'search delay=fixed:1',
+    'search: delay=normal:1',
+    'search: delay=fixed:1:2',
+    'search: delay=uniform:1',
+    'search: error=0.1:NOT_AN_ERROR',
+    'search: error=0.1:SCOPE_BASE',
+    'search: error=0.1',
+    'search: drop=x',
+    'search: jitter=1',
+])
+def test_parse_faults_invalid(faults_str):
+    with pytest.raises(ConfigError):
+        faults.parse_faults(faults_str)
+
+
+def test_delay_time():
+    rnd = random.Random(1)
+    assert Faults(delay=('fixed', [20])).delay_time(rnd) == 0.02
+    assert Faults().delay_time(rnd) == 0
+    assert Faults(stall=(1, 3000)).delay_time(rnd) == 3
+    delays = [Faults(delay=('uniform', [1, 5])).delay_time(rnd)
+              for _ in range(100)]
+    assert 0.001 <= min(delays) and max(delays) <= 0.005
+    delays = [Faults(delay=('lognormal', [10, 1])).delay_time(rnd)
+              for _ in range(1000)]
+    assert 0.005 < sorted(delays)[500] < 0.02
+
+
+def test_faulty_passthrough():
+    con = RecordingLDAPObject()
+    faulty = FaultyLDAPObject(con, {'bind': Faults(error=(1, ldap.BUSY))})
+    assert faulty.search_st('dc=ie', ldap.SCOPE_BASE) == [('dc=ie', {})]
+    faulty.set_option(ldap.OPT_NETWORK_TIMEOUT, 2.0)
+    with pytest.raises(ldap.BUSY):
+        faulty.simple_bind_s('cn=a')
+    assert con.calls == [('search_st', 'dc=ie'),
+                         ('set_option', ldap.OPT_NETWORK_TIMEOUT)]
+
+
+def test_faulty_error_rate():
+    faulty = FaultyLDAPObject(RecordingLDAPObject(),
+                              {'search': Faults(error=(0.25,
+                                                       ldap.UNAVAILABLE))},
+                              random.Random(1))
+    errors = 0
+    for _ in range(1000):
+        try:
+            faulty.search_st('dc=ie', ldap.SCOPE_BASE)
+        except ldap.UNAVAILABLE:
+            errors += 1
+    assert 200 < errors < 300
+
+
+def test_faulty_drop():
+    con = RecordingLDAPObject()
+    faulty = FaultyLDAPObject(con, {'search': Faults(drop=1)})
+    with pytest.raises(ldap.SERVER_DOWN):
+        faulty.search_st('dc=ie', ldap.SCOPE_BASE)
+    # Once dropped every call fails
+    with pytest.raises(ldap.SERVER_DOWN):
+        faulty.search_st('dc=ie', ldap.SCOPE_BASE)
+    assert faulty.dropped
+    assert con.calls == []
+
+
+def test_faulty_async():
+    con = FakeLDAPObject(Directory())
+    faulty = FaultyLDAPObject(con, {'search': Faults(delay=('fixed', [50]))})
+    msgid = faulty.simple_bind('cn=a', 'x')
+    assert faulty.result3(msgid, all=1, timeout=0.01)[0] == ldap.RES_BIND
+    msgid = faulty.search_ext('dc=ie', ldap.SCOPE_BASE)
+    assert faulty.pending == {msgid: 'search'}
+    with pytest.raises(ldap.TIMEOUT):
+        faulty.result3(msgid, all=1, timeout=0.01)
+    assert faulty.pending == {}
+
+
+def hosts():
+    values = {'port': 389, 'base_dns': ['dc=ie'], 'bind_dn': '',
+              'bind_password': '', 'ldap_trace_level': 0,
+              'fake_tree': dit.parse_shape('depth=0, fanout=3')}
+    return {'host1': values, 'host2': dict(values)}
+
+
+def test_install():
+    con = FakeConnection(hosts())
+    con.open()
+    faults.install(con, {'search': Faults(drop=1)}, hosts=['host1'], seed=1)
+    assert isinstance(con.hosts['host1']['replicas'][0].con,
+                      FaultyLDAPObject)
+    assert not isinstance(con.hosts['host2']['replicas'][0].con,
+                          FaultyLDAPObject)
+    with pytest.raises(LdapException):
+        con.get('host1', 'dc=ie')
+    assert con.get('host2', 'dc=ie')
+
+    # New connections have the faults injected too, failing the read of
+    # the Root DSE when connecting
+    con.close()
+    with pytest.raises(LdapException):
+        con.open()
+    assert con.is_down('host1')
+    assert con.get('host2', 'dc=ie')
+
+
+def test_install_tail_latency():
+    con = FakeConnection(hosts())
+    faults.install(con, {'search': Faults(stall=(0.1, 20))}, seed=1)
+    con.open()
+    histogram = stats.Histogram()
+    for _ in range(100):
+        start = time()
+        con.get('host1', 'cn=e1,dc=ie')
+        histogram.record(time() - start)
+    assert histogram.percentile(50) < 0.01
+    assert histogram.percentile(99) >= 0.02
+
+
+def test_install_search_timeout():
+    con = FakeConnection(hosts())
+    for values in con.hosts.values():
+        values['search_timeout'] = 10
+    faults.install(con, {'search': Faults(stall=(1, 1000))}, seed=1)
+    con.open()
+    start = time()
+    with pytest.raises(LdapTimeout):
+        con.get('host1', 'dc=ie')
+    assert time() - start < 0.5
+    assert con.hosts['host1']['timeouts'] == 1
+
+
+def test_ldapfs_timeout(tmpdir):
+    config = str(tmpdir.join('ldapfs.cfg'))
+    fakeldap.write_config(config, 'host1', ['dc=ie'],
+                          {'log_async': 'false', 'stats': 'false'},
+                          {'fake_tree': 'depth=0, fanout=3',
+                           'faults': 'search: stall=1:1000',
+                           'search_timeout': 10})
+    ldapfs = replay.create_fs(config)
+    try:
+        assert ldapfs.getattr('/host1/dc=ie/cn=e1') == -errno.ETIMEDOUT
+        assert ldapfs.read('/host1/dc=ie/cn=e1/cn', 10, 0) == \
+            -errno.ETIMEDOUT
+    finally:
+        ldapfs.fsdestroy()
@@ -0,0 +1,42 @@
+
+from ldapfs.fs import File
+
+
+def pytest_generate_tests(metafunc):
+    # pytest has various ways to parametrize tests. Here I've used one global
+    # function per argument. The function is expected to return a list of
+    # values. The test function will be run once for each value.
+    for argname in metafunc.funcargnames:
+        argvalues = globals()['funcarg_{}'.format(argname)]()
+        metafunc.parametrize(argname, argvalues)
+
+
+def funcarg_read_args():
+    return [('', 10, 0, ''),
+            ('abc\n', 10, 0, 'abc\n'),
+            ('abc\n', 2, 0, 'ab'),
+            ('abc\n', 2, 1, 'bc'),
+            ('abc\n', 10, 3, '\n'),
+            ('abc\n', 10, 4, ''),
+            ('abc\n', 10, 40, '')]
+
+
+def test_read(read_args):
+    text, size, offset, expected = read_args
+    handle = File(text)
+    assert handle.read(size, offset) == expected
+
+
+def test_read_repeat(read_args):
+    text, size, offset, expected = read_args
+    handle = File(text)
+    handle.read(size, offset)
+    assert handle.read(size, offset) == expected
+
+
+def test_release(read_args):
+    text, size, offset, _ = read_args
+    handle = File(text)
+    handle.release()
+    assert handle.text is None
+    assert str(handle) == 'File(size=0)'
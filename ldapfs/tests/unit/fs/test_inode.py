@@ -0,0 +1,39 @@
+
+from ldapfs.fs import inode
+
+
+def pytest_generate_tests(metafunc):
+    # pytest has various ways to parametrize tests. Here I've used one global
+    # function per argument. The function is expected to return a list of
+    # values. The test function will be run once for each value.
+    for argname in metafunc.funcargnames:
+        argvalues = globals()['funcarg_{}'.format(argname)]()
+        metafunc.parametrize(argname, argvalues)
+
+
+def funcarg_same_paths():
+    return [('/', '/.'),
+            ('/host', '/host/base/..'),
+            ('/host/base/cn=x', '/host/base/cn=x/.'),
+            ('/host/base/cn=x/attr', '/host/base/cn=x/attr')]
+
+
+def funcarg_different_paths():
+    return [('/', '/host'),
+            ('/host/base', '/host/base/cn=x'),
+            ('/host/base/cn=x/attr1', '/host/base/cn=x/attr2')]
+
+
+def test_same(same_paths):
+    path1, path2 = same_paths
+    assert inode(path1) == inode(path2)
+
+
+def test_different(different_paths):
+    path1, path2 = different_paths
+    assert inode(path1) != inode(path2)
+
+
+def test_range(same_paths):
+    for path in same_paths:
+        assert 2 <= inode(path) < 2 ** 63
@@ -0,0 +1,33 @@
+
+from ldapfs.fs import Stat
+
+
+def pytest_generate_tests(metafunc):
+    # pytest has various ways to parametrize tests. Here I've used one global
+    # function per argument. The function is expected to return a list of
+    # values. The test function will be run once for each value.
+    for argname in metafunc.funcargnames:
+        argvalues = globals()['funcarg_{}'.format(argname)]()
+        metafunc.parametrize(argname, argvalues)
+
+
+def funcarg_nlink_args():
+    return [(None, 1),
+            (0, 2),
+            (1, 3),
+            (1000, 1002)]
+
+
+def test_dir_nlink(nlink_args):
+    subdirs, expected = nlink_args
+    assert Stat.dir_nlink(subdirs) == expected
+
+
+def test_init_nlink(nlink_args):
+    subdirs, expected = nlink_args
+    assert Stat(isdir=True, nlink=Stat.dir_nlink(subdirs)).st_nlink == expected
+
+
+def test_init_default_nlink():
+    assert Stat(isdir=True).st_nlink == 1
+    assert Stat(isdir=False, size=10).st_nlink == 1
@@ -0,0 +1,81 @@
+
+import pytest
+import mock
+from ldapfs.instrument import Instrument
+
+
+class Target(object):
+    def method(self, arg):
+        return arg * 2
+
+    def _private(self):
+        return 'private'
+
+    def failing(self):
+        raise ValueError('failed')
+
+    def generator(self):
+        for i in range(3):
+            yield i
+
+
+def test_no_recorders():
+    target = Target()
+    Instrument().wrap(target, ['method'], 'x.')
+    assert 'method' not in target.__dict__
+    assert target.method(2) == 4
+
+
+def test_record():
+    target = Target()
+    recorder = mock.Mock()
+    inst = Instrument()
+    inst.add(recorder)
+    inst.wrap(target, ['method', '_private'], 'x.')
+
+    assert target.method(2) == 4
+    assert target._private() == 'private'
+    assert recorder.call_count == 2
+    name, args, result, error, start, elapsed = recorder.call_args_list[0][0]
+    assert (name, args, result, error) == ('x.method', (2,), 4, None)
+    assert start > 0 and elapsed >= 0
+    assert recorder.call_args_list[1][0][0] == 'x.private'
+
+
+def test_record_error():
+    target = Target()
+    recorder = mock.Mock()
+    inst = Instrument()
+    inst.add(recorder)
+    inst.wrap(target, ['failing'], 'x.')
+
+    with pytest.raises(ValueError):
+        target.failing()
+    name, _, result, error, _, _ = recorder.call_args[0]
+    assert name == 'x.failing'
+    assert result is None
+    assert isinstance(error, ValueError)
+
+
+def test_record_generator():
+    target = Target()
+    recorder = mock.Mock()
+    inst = Instrument()
+    inst.add(recorder)
+    inst.wrap(target, ['generator'], 'x.')
+
+    assert list(target.generator()) == [0, 1, 2]
+    assert recorder.call_args[0][2] == [0, 1, 2]
+
+
+def test_multiple_recorders():
+    target = Target()
+    recorders = [mock.Mock(), mock.Mock()]
+    inst = Instrument()
+    for recorder in recorders:
+        inst.add(recorder)
+    inst.wrap(target, ['method'], 'x.')
+
+    target.method(1)
+    for recorder in recorders:
+        assert recorder.call_count == 1
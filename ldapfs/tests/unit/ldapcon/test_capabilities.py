@@ -0,0 +1,130 @@
+
+import ldap
+import pytest
+import ldapfs.ldapcon
+from ldapfs import dit
+from ldapfs import faults
+from ldapfs.faults import Faults
+from ldapfs.exceptions import LdapTimeout
+from ldapfs.fakeldap import FakeConnection
+
+LDIF = """dn: dc=ie
+dc: ie
+
+dn: dc=com
+dc: com
+
+dn: cn=a,dc=com
+cn: a
+"""
+
+
+def connection(**values):
+    values.update({'port': 389, 'base_dns': ['dc=ie'], 'bind_dn': '',
+                   'bind_password': '', 'ldap_trace_level': 0})
+    values.setdefault('fake_tree', dit.parse_shape('depth=0, fanout=25'))
+    return FakeConnection({'host1': values})
+
+
+def count_searches(con):
+    """Record the server controls of each search of host1."""
+    replica = con.hosts['host1']['replicas'][0]
+    search_ext = replica.con.search_ext
+    controls = []
+
+    def counted_search_ext(*args, **kwargs):
+        controls.append(kwargs.get('serverctrls'))
+        return search_ext(*args, **kwargs)
+    replica.con.search_ext = counted_search_ext
+    return controls
+
+
+def test_capabilities():
+    con = connection()
+    assert con.capabilities('host1') == {}
+    con.open()
+    try:
+        assert con.capabilities('host1')['paged_results']
+        assert not con.capabilities('host1')['vlv']
+        assert con.capabilities('host2') == {}
+        assert con.capabilities_text() == \
+            'host1 ldap://host1:389: paged_results\n'
+    finally:
+        con.close()
+
+
+def test_paged_search():
+    con = connection(page_size=10)
+    con.open()
+    try:
+        controls = count_searches(con)
+        assert len(con.get_children('host1', 'dc=ie')) == 25
+        assert len(controls) == 3
+        assert con.get('host1', 'cn=e1,dc=ie')
+        # Base searches are not paged
+        assert controls[3] is None
+    finally:
+        con.close()
+
+
+def test_paged_search_timeout(monkeypatch):
+    con = connection(page_size=10, search_timeout=100)
+    con.open()
+    try:
+        controls = count_searches(con)
+        clock = [1000.0]
+        monkeypatch.setattr(ldapfs.ldapcon, 'time', lambda: clock[0])
+        search_ext = con.hosts['host1']['replicas'][0].con.search_ext
+
+        def slow_search_ext(*args, **kwargs):
+            clock[0] += 0.06
+            return search_ext(*args, **kwargs)
+        con.hosts['host1']['replicas'][0].con.search_ext = slow_search_ext
+        with pytest.raises(LdapTimeout):
+            con.get_children('host1', 'dc=ie')
+        # The deadline passed before the third page was asked for
+        assert len(controls) == 2
+        assert con.hosts['host1']['timeouts'] == 1
+    finally:
+        con.close()
+
+
+def test_paged_search_disabled():
+    con = connection(page_size=0)
+    con.open()
+    try:
+        controls = count_searches(con)
+        assert len(con.get_children('host1', 'dc=ie')) == 25
+        assert controls == [None]
+    finally:
+        con.close()
+
+
+def test_root_dse_error():
+    con = connection(page_size=10)
+    injected = {'search': Faults(error=(1, ldap.UNWILLING_TO_PERFORM))}
+    faults.install(con, injected)
+    con.open()
+    try:
+        assert not any(con.capabilities('host1').values())
+        injected.clear()
+        controls = count_searches(con)
+        assert len(con.get_children('host1', 'dc=ie')) == 25
+        assert controls == [None]
+    finally:
+        con.close()
+
+
+def test_discover_base_dns(tmpdir):
+    tmpdir.join('test.ldif').write(LDIF)
+    con = connection(fake_ldif=str(tmpdir.join('test.ldif')),
+                     discover_base_dns=True)
+    con.open()
+    try:
+        assert con.hosts['host1']['base_dns'] == ['dc=ie', 'dc=com']
+    finally:
+        con.close()
+    # Not added again on reconnecting
+    con.open()
+    assert con.hosts['host1']['base_dns'] == ['dc=ie', 'dc=com']
+    con.close()
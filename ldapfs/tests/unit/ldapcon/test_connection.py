@@ -1,4 +1,5 @@
 
+import threading
 import pytest
 import mock
 import ldapfs.ldapcon
@@ -20,6 +21,8 @@ def funcarg_mocks():
     class INVALID_DN_SYNTAX(Exception): pass
     class NO_SUCH_OBJECT(Exception): pass
     class LDAPError(Exception): pass
+    class TIMEOUT(LDAPError): pass
+    class TIMELIMIT_EXCEEDED(LDAPError): pass
 
     mocks = mock.Mock()
     mocks.entry = mock.Mock()
@@ -30,10 +33,15 @@ def funcarg_mocks():
     mocks.ldap.INVALID_DN_SYNTAX = INVALID_DN_SYNTAX
     mocks.ldap.NO_SUCH_OBJECT = NO_SUCH_OBJECT
     mocks.ldap.LDAPError = LDAPError
+    mocks.ldap.TIMEOUT = TIMEOUT
+    mocks.ldap.TIMELIMIT_EXCEEDED = TIMELIMIT_EXCEEDED
 
     def patch(monkeypatch, ldap=mocks.ldap, entry=mocks.entry):
         monkeypatch.setattr(ldapfs.ldapcon, 'ldap', ldap)
         monkeypatch.setattr(ldapfs.ldapcon, 'Entry', entry)
+        # Searches of the Root DSE are tested with the fake backend
+        monkeypatch.setattr(ldapfs.ldapcon.Connection, '_read_root_dse',
+                            lambda *args: ldapfs.ldapcon.RootDSE())
 
     mocks.patch = patch
     return [mocks]
@@ -123,19 +131,19 @@ def test_open(monkeypatch, open_args, mocks):
     con = ldapfs.ldapcon.Connection(hosts)
 
     mocks.ldap.initialize.reset_mock()
-    mocks.con.simple_bind_s.reset_mock()
+    mocks.con.simple_bind.reset_mock()
     mocks.patch(monkeypatch)
     con.open()
 
     expected_call_count = len(init_args_list)
 
     assert mocks.ldap.initialize.call_count == expected_call_count
-    assert mocks.con.simple_bind_s.call_count == expected_call_count
+    assert mocks.con.simple_bind.call_count == expected_call_count
 
     for init_args, init_kwargs, bind_args in \
         zip(init_args_list, init_kwargs_list, bind_args_list):
         mocks.ldap.initialize.assert_any_call(*init_args, **init_kwargs)
-        mocks.con.simple_bind_s.assert_any_call(*bind_args)
+        mocks.con.simple_bind.assert_any_call(*bind_args)
 
 
 def test_open_invalid_dn(monkeypatch, open_args, mocks):
@@ -188,7 +196,7 @@ def test__search(monkeypatch, search_args, mocks):
     scope = 0
     attrsonly = False
 
-    mocks.con.search_st.return_value = search_return_value
+    mocks.con.result3.return_value = (101, search_return_value, 1, [])
     mocks.patch(monkeypatch)
 
     con = ldapfs.ldapcon.Connection(hosts)
@@ -231,7 +239,7 @@ def test__search_invalid_dn(monkeypatch, search_args, mocks):
     scope = 0
     attrsonly = False
 
-    mocks.con.search_st.side_effect = mocks.ldap.INVALID_DN_SYNTAX('...')
+    mocks.con.search_ext.side_effect = mocks.ldap.INVALID_DN_SYNTAX('...')
     mocks.patch(monkeypatch)
     con = ldapfs.ldapcon.Connection(hosts)
     con.open()
@@ -245,7 +253,7 @@ def test__search_no_such_object(monkeypatch, search_args, mocks):
     scope = 0
     attrsonly = False
 
-    mocks.con.search_st.side_effect = mocks.ldap.NO_SUCH_OBJECT('...')
+    mocks.con.search_ext.side_effect = mocks.ldap.NO_SUCH_OBJECT('...')
     mocks.patch(monkeypatch)
     con = ldapfs.ldapcon.Connection(hosts)
     con.open()
@@ -259,10 +267,259 @@ def test__search_ldap_error(monkeypatch, search_args, mocks):
     scope = 0
     attrsonly = False
 
-    mocks.con.search_st.side_effect = mocks.ldap.LDAPError('...')
+    mocks.con.search_ext.side_effect = mocks.ldap.LDAPError('...')
     mocks.patch(monkeypatch)
     con = ldapfs.ldapcon.Connection(hosts)
     con.open()
 
     with pytest.raises(ldapfs.exceptions.LdapException):
         con._search(hosts.keys()[0], dn1, scope, attrsonly)
+
+
+def test_is_leaf_no_children(monkeypatch, search_args, mocks):
+    hosts, dn1, _, _ = search_args
+    host = hosts.keys()[0]
+
+    mocks.con.result3.return_value = (101, [], 1, [])
+    mocks.patch(monkeypatch, entry=ldapfs.ldapcon.Entry)
+    con = ldapfs.ldapcon.Connection(hosts, leaf_cache_ttl=60)
+    con.open()
+
+    assert not con.is_leaf(host, dn1)
+    assert con.get_children(host, dn1) == []
+    assert con.is_leaf(host, dn1)
+
+
+def test_is_leaf_children(monkeypatch, search_args, mocks):
+    hosts, dn1, _, _ = search_args
+    host = hosts.keys()[0]
+
+    mocks.con.result3.return_value = (101, [
+        ('cn=leaf,cn1,dc=ie', {'hasSubordinates': ['FALSE']}),
+        ('cn=parent,cn1,dc=ie', {'hasSubordinates': ['TRUE']}),
+        ('cn=unknown,cn1,dc=ie', {})], 1, [])
+    mocks.patch(monkeypatch, entry=ldapfs.ldapcon.Entry)
+    con = ldapfs.ldapcon.Connection(hosts, leaf_cache_ttl=60)
+    con.open()
+
+    assert len(con.get_children(host, dn1)) == 3
+    assert not con.is_leaf(host, dn1)
+    assert con.is_leaf(host, 'cn=leaf,cn1,dc=ie')
+    assert con.is_leaf(host, 'CN=Leaf,cn1,dc=ie')
+    assert not con.is_leaf(host, 'cn=parent,cn1,dc=ie')
+    assert not con.is_leaf(host, 'cn=unknown,cn1,dc=ie')
+    assert not con.is_leaf('xx', 'cn=leaf,cn1,dc=ie')
+
+
+def test_is_leaf_expired(monkeypatch, search_args, mocks):
+    hosts, dn1, _, _ = search_args
+    host = hosts.keys()[0]
+
+    mocks.con.result3.return_value = (101, [], 1, [])
+    mocks.patch(monkeypatch, entry=ldapfs.ldapcon.Entry)
+    con = ldapfs.ldapcon.Connection(hosts, leaf_cache_ttl=60)
+    con.open()
+    con.get_children(host, dn1)
+
+    monkeypatch.setattr(ldapfs.ldapcon, 'time', lambda: 2 ** 40)
+    assert not con.is_leaf(host, dn1)
+
+
+def test_is_leaf_disabled(monkeypatch, search_args, mocks):
+    hosts, dn1, _, _ = search_args
+    host = hosts.keys()[0]
+
+    mocks.con.result3.return_value = (101, [], 1, [])
+    mocks.patch(monkeypatch, entry=ldapfs.ldapcon.Entry)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    con.get_children(host, dn1)
+    assert not con.is_leaf(host, dn1)
+
+
+def test__search_async(monkeypatch, search_args, mocks):
+    hosts, dn1, _, search_return_value = search_args
+    host = hosts.keys()[0]
+    hosts[host]['search_timeout'] = 1500
+
+    mocks.con.search_ext.return_value = 7
+    mocks.con.result3.return_value = (101, search_return_value, 7, [])
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    con._search(host, dn1, True, False, ['cn'])
+    mocks.con.search_ext.assert_called_with(
+        'cn1,dc=ie', mocks.ldap.SCOPE_ONELEVEL, attrlist=['cn'],
+        attrsonly=False)
+    mocks.con.result3.assert_called_with(7, all=1, timeout=1.5)
+
+
+def test__search_timeout(monkeypatch, search_args, mocks):
+    hosts, dn1, _, _ = search_args
+    host = hosts.keys()[0]
+
+    mocks.con.search_ext.return_value = 7
+    mocks.con.result3.side_effect = [None] * len(hosts) + \
+        [mocks.ldap.TIMEOUT('...')]
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    with pytest.raises(ldapfs.exceptions.LdapTimeout):
+        con._search(host, dn1, False, False)
+    mocks.con.abandon_ext.assert_called_with(7)
+    assert con.hosts[host]['timeouts'] == 1
+
+
+def test__search_time_limit(monkeypatch, search_args, mocks):
+    hosts, dn1, _, _ = search_args
+
+    mocks.con.search_ext.side_effect = mocks.ldap.TIMELIMIT_EXCEEDED('...')
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    with pytest.raises(ldapfs.exceptions.LdapTimeout):
+        con._search(hosts.keys()[0], dn1, False, False)
+
+
+def test__search_op_timeout(monkeypatch, search_args, mocks):
+    hosts, dn1, _, _ = search_args
+    host = hosts.keys()[0]
+    hosts[host].update({'search_timeout': 1500, 'op_timeout': 1000})
+
+    mocks.con.result3.return_value = (101, [], 1, [])
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    # No deadline outside a file system operation
+    con._search(host, dn1, False, False)
+    assert mocks.con.result3.call_args[1]['timeout'] == 1.5
+
+    monkeypatch.setattr(ldapfs.ldapcon, 'time', lambda: 100.0)
+    con.begin()
+    monkeypatch.setattr(ldapfs.ldapcon, 'time', lambda: 100.25)
+    con._search(host, dn1, False, False)
+    assert mocks.con.result3.call_args[1]['timeout'] == 0.75
+
+    # Past the deadline the server isn't asked
+    mocks.con.search_ext.reset_mock()
+    monkeypatch.setattr(ldapfs.ldapcon, 'time', lambda: 101.0)
+    with pytest.raises(ldapfs.exceptions.LdapTimeout):
+        con._search(host, dn1, False, False)
+    assert not mocks.con.search_ext.called
+
+
+def test_open_bind_timeout(monkeypatch, open_args, mocks):
+    hosts, _, _, _ = open_args
+    for values in hosts.values():
+        values.update({'network_timeout': 500, 'bind_timeout': 250})
+
+    mocks.con.result3.side_effect = mocks.ldap.TIMEOUT('...')
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+
+    with pytest.raises(ldapfs.exceptions.LdapTimeout):
+        con.open()
+    mocks.con.set_option.assert_called_with(mocks.ldap.OPT_NETWORK_TIMEOUT,
+                                            0.5)
+    assert mocks.con.result3.call_args[1]['timeout'] == 0.25
+    assert mocks.con.unbind.called
+
+
+def connections(mocks):
+    """Have each connection made by ldap.initialize use its own mock.
+
+    Hosts are connected in parallel, so only the calls on one connection
+    are counted reliably. Only those made by the connect threads of open()
+    are added, not reconnects by the probers of earlier tests' connections.
+    Return the list the connections are added to."""
+    cons = []
+
+    def initialize(uri, **_):
+        ldap_con = mock.Mock(uri=uri)
+        if threading.current_thread().name.startswith('connect-'):
+            cons.append(ldap_con)
+        return ldap_con
+    mocks.ldap.initialize.side_effect = initialize
+    return cons
+
+
+def test_open_no_network_timeout(monkeypatch, open_args, mocks):
+    hosts, _, _, _ = open_args
+    for values in hosts.values():
+        values['network_timeout'] = 0
+
+    cons = connections(mocks)
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    # 0 is no limit, as for the other timeouts
+    for ldap_con in cons:
+        ldap_con.set_option.assert_any_call(mocks.ldap.OPT_NETWORK_TIMEOUT,
+                                            -1)
+
+
+def test_open_sasl_external(monkeypatch, open_args, mocks):
+    hosts, _, _, _ = open_args
+    for values in hosts.values():
+        values.update({'uris': ['ldapi://'], 'sasl_mech': 'EXTERNAL',
+                       'bind_timeout': 250})
+        values.pop('bind_dn', None)
+
+    cons = connections(mocks)
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    assert [ldap_con.uri for ldap_con in cons] == ['ldapi://'] * len(hosts)
+    for ldap_con in cons:
+        ldap_con.sasl_interactive_bind_s.assert_called_once_with(
+            '', mocks.ldap.sasl.external.return_value)
+        assert not ldap_con.simple_bind.called
+        assert not ldap_con.start_tls_s.called
+        timeouts = [args[0][1] for args in ldap_con.set_option.call_args_list
+                    if args[0][0] == mocks.ldap.OPT_TIMEOUT]
+        # Set for the bind only
+        assert timeouts == [0.25, -1]
+
+
+def test_open_tls(monkeypatch, open_args, mocks):
+    hosts, _, _, _ = open_args
+    for values in hosts.values():
+        values.update({'uris': ['ldap://r1:389', 'ldaps://r2:636'],
+                       'start_tls': True, 'tls_cacert': '/etc/ca.pem',
+                       'tls_require_cert': False})
+
+    cons = connections(mocks)
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    con.open()
+
+    assert len(cons) == 2 * len(hosts)
+    for ldap_con in cons:
+        # StartTLS on ldap:// only, the options set for both
+        assert ldap_con.start_tls_s.called == \
+            ldap_con.uri.startswith('ldap://')
+        options = [args[0] for args in ldap_con.set_option.call_args_list]
+        assert options[-3:] == [
+            (mocks.ldap.OPT_X_TLS_CACERTFILE, '/etc/ca.pem'),
+            (mocks.ldap.OPT_X_TLS_REQUIRE_CERT, mocks.ldap.OPT_X_TLS_NEVER),
+            (mocks.ldap.OPT_X_TLS_NEWCTX, 0)]
+
+
+def test_open_start_tls_error(monkeypatch, open_args, mocks):
+    hosts, _, _, _ = open_args
+    for values in hosts.values():
+        values['start_tls'] = True
+
+    mocks.con.start_tls_s.side_effect = mocks.ldap.LDAPError('...')
+    mocks.patch(monkeypatch)
+    con = ldapfs.ldapcon.Connection(hosts)
+    with pytest.raises(ldapfs.exceptions.LdapException):
+        con.open()
+    assert not mocks.con.simple_bind.called
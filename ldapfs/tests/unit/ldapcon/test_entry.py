@@ -61,6 +61,44 @@ def funcarg_size_args():
             (entry3, Entry.ALL_ATTRIBUTES, 0)]
 
 
+def funcarg_count_args():
+    entry1 = Entry('dn1', {'a': ['1'], 'b': ['3'], 'ckey': ['4', '5', '6']})
+    entry2 = Entry('dn2', {})
+    return [(entry1, 'a', 1),
+            (entry1, 'ckey', 3),
+            (entry1, 'xxx', 0),
+            (entry2, 'a', 0)]
+
+
+def funcarg_value_text_args():
+    entry1 = Entry('dn1', {'a': ['1'], 'ckey': ['4', '5', '6']})
+    return [(entry1, 'a', 0, '1\n'),
+            (entry1, 'ckey', 0, '4\n'),
+            (entry1, 'ckey', 2, '6\n')]
+
+
+def funcarg_subordinates_args():
+    return [(Entry('dn1', {}), None),
+            (Entry('dn2', {'cn': ['x']}), None),
+            (Entry('dn3', {'hasSubordinates': ['TRUE']}), None),
+            (Entry('dn4', {'hasSubordinates': ['FALSE']}), 0),
+            (Entry('dn5', {'hassubordinates': ['false']}), 0),
+            (Entry('dn6', {'numSubordinates': ['12']}), 12),
+            (Entry('dn7', {'numSubordinates': ['0'],
+                           'hasSubordinates': ['FALSE']}), 0),
+            (Entry('dn8', {'numSubordinates': ['3'],
+                           'hasSubordinates': ['TRUE']}), 3),
+            (Entry('dn9', {'numSubordinates': ['x']}), None)]
+
+
+def funcarg_is_leaf_args():
+    return [(Entry('dn1', {}), None),
+            (Entry('dn2', {'hasSubordinates': ['TRUE']}), False),
+            (Entry('dn3', {'hasSubordinates': ['FALSE']}), True),
+            (Entry('dn4', {'numSubordinates': ['0']}), True),
+            (Entry('dn5', {'numSubordinates': ['2']}), False)]
+
+
 def funcarg_neq_entry():
     entries1 = [Entry('dn1', ['attr1', 'attr2']),
                 Entry('dn2', ['a']),
@@ -126,3 +164,33 @@ def test_names(names_args):
 def test_size(size_args):
     entry, attr_name, expected = size_args
     assert entry.size(attr_name) == expected
+
+
+def test_subordinates(subordinates_args):
+    entry, expected = subordinates_args
+    assert entry.subordinates() == expected
+
+
+def test_is_leaf(is_leaf_args):
+    entry, expected = is_leaf_args
+    assert entry.is_leaf() == expected
+
+
+def test_count(count_args):
+    entry, attr_name, expected = count_args
+    assert entry.count(attr_name) == expected
+
+
+def test_value_text(value_text_args):
+    entry, attr_name, index, expected = value_text_args
+    assert entry.value_text(attr_name, index) == expected
+
+
+def test_value_text_error(value_text_args):
+    entry, attr_name, index, __ = value_text_args
+    with pytest.raises(AttributeError):
+        entry.value_text(attr_name, index + 3)
+    with pytest.raises(AttributeError):
+        entry.value_text(attr_name, -1)
+    with pytest.raises(AttributeError):
+        entry.value_text(attr_name + '-xxx', index)
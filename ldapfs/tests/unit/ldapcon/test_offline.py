@@ -0,0 +1,195 @@
+
+import ldap
+import pytest
+from time import time, sleep
+import ldapfs.cache
+from ldapfs import dit
+from ldapfs import faults
+from ldapfs.faults import Faults
+from ldapfs.breaker import CircuitBreaker, Admission
+from ldapfs.exceptions import LdapException, NoSuchObject, LdapTimeout
+from ldapfs.exceptions import HostDown, HostBusy
+from ldapfs.fakeldap import FakeConnection
+
+
+def connection(**kwargs):
+    values = {'port': 389, 'base_dns': ['dc=ie'], 'bind_dn': '',
+              'bind_password': '', 'ldap_trace_level': 0,
+              'fake_tree': dit.parse_shape('depth=0, fanout=3')}
+    con = FakeConnection({'host1': values, 'host2': dict(values)}, **kwargs)
+    injected = {}
+    faults.install(con, injected, hosts=['host1'])
+    con.open()
+    return con, injected
+
+
+def set_down(con, injected):
+    injected['search'] = Faults(drop=1)
+    with pytest.raises(HostDown):
+        con.get('host1', 'dc=ie')
+
+
+def test_host_down():
+    con, injected = connection()
+    try:
+        set_down(con, injected)
+        assert con.is_down('host1')
+        assert not con.hosts['host1']['replicas'][0].con
+        assert con.hosts['host1']['downs'] == 1
+        # Fails fast without trying the server
+        with pytest.raises(HostDown):
+            con.get('host1', 'cn=e1,dc=ie')
+        assert con.get('host2', 'dc=ie')
+        assert not con.is_down('host2')
+        lines = con.status_text().splitlines()
+        assert lines[0].startswith('host1 down for 0s: ')
+        assert lines[1] == 'host2 up'
+    finally:
+        con.close()
+
+
+def test_probe():
+    con, injected = connection()
+    try:
+        set_down(con, injected)
+        injected.clear()
+        assert con.probe() == ['host1']
+        assert not con.is_down('host1')
+        assert con.get('host1', 'dc=ie')
+        assert con.hosts['host1']['connects'] == 2
+        assert con.status_text().startswith('host1 up\n')
+    finally:
+        con.close()
+
+
+def test_probe_interval():
+    con, injected = connection()
+    try:
+        set_down(con, injected)
+        injected['bind'] = Faults(error=(1, ldap.SERVER_DOWN))
+        assert con.probe() == []
+        injected.clear()
+        # Not due another probe for probe_interval seconds
+        assert con.probe() == []
+        con.hosts['host1']['replicas'][0].next_probe = 0
+        assert con.probe() == ['host1']
+    finally:
+        con.close()
+
+
+def test_prober():
+    con, injected = connection()
+    con.PROBE_TICK = 0.01
+    con.close()
+    con.open()
+    try:
+        set_down(con, injected)
+        injected.clear()
+        deadline = time() + 5
+        while con.is_down('host1') and time() < deadline:
+            sleep(0.01)
+        assert not con.is_down('host1')
+    finally:
+        con.close()
+    assert not con.prober
+
+
+def test_offline_cache(monkeypatch):
+    con, injected = connection(entry_cache_ttl=10)
+    try:
+        monkeypatch.setattr(ldapfs.cache, 'time', lambda: 100.0)
+        entry = con.get('host1', 'cn=e1,dc=ie')
+        children = con.get_children('host1', 'dc=ie')
+        set_down(con, injected)
+
+        # Served from the cache whatever the age of the results
+        monkeypatch.setattr(ldapfs.cache, 'time', lambda: 100000.0)
+        assert con.get('host1', 'cn=e1,dc=ie') is entry
+        assert con.get_children('host1', 'dc=ie') is children
+        assert con.entry_cache.stats['offline_hits'] == 2
+        with pytest.raises(HostDown):
+            con.get('host1', 'cn=e2,dc=ie')
+    finally:
+        con.close()
+
+
+def test_breaker():
+    con, injected = connection()
+    con.close()
+    con.hosts['host1'].update({'breaker_threshold': 50, 'breaker_window': 4})
+    con.open()
+    try:
+        injected['search'] = Faults(error=(1, ldap.BUSY))
+        for _ in range(4):
+            with pytest.raises(LdapException) as ex_info:
+                con.get('host1', 'dc=ie')
+            assert not isinstance(ex_info.value, HostBusy)
+        injected.clear()
+        with pytest.raises(HostBusy):
+            con.get('host1', 'dc=ie')
+        # Objects not found are not failures
+        con.breakers['host1'].opened = 0
+        with pytest.raises(NoSuchObject):
+            con.get('host1', 'cn=x,dc=ie')
+        assert con.breakers['host1'].state == CircuitBreaker.CLOSED
+        assert 'host2' not in con.breakers
+    finally:
+        con.close()
+
+
+def test_breaker_status():
+    con, _ = connection()
+    con.breakers['host1'] = CircuitBreaker(100, window=1)
+    con.breakers['host1'].record(0, True)
+    assert con.status_text().startswith('host1 up, circuit breaker open\n')
+    con.close()
+
+
+def test_admission():
+    con, _ = connection()
+    con.admissions['host1'] = Admission(1)
+    con.admissions['host1'].enter()
+    try:
+        with pytest.raises(HostBusy):
+            con.get('host1', 'dc=ie')
+        assert con.get('host2', 'dc=ie')
+        con.admissions['host1'].leave()
+        assert con.get('host1', 'dc=ie')
+        assert con.admissions['host1'].in_flight == 0
+    finally:
+        con.close()
+
+
+def test_breaker_trial_not_admitted():
+    con, _ = connection()
+    con.breakers['host1'] = CircuitBreaker(100, window=1, reset=0)
+    con.breakers['host1'].record(0, True)
+    con.admissions['host1'] = Admission(1)
+    con.admissions['host1'].enter()
+    try:
+        with pytest.raises(HostBusy):
+            con.get('host1', 'dc=ie')
+        assert con.breakers['host1'].state == CircuitBreaker.HALF_OPEN
+        con.admissions['host1'].leave()
+        # The rejected search didn't use up the trial
+        assert con.get('host1', 'dc=ie')
+        assert con.breakers['host1'].state == CircuitBreaker.CLOSED
+    finally:
+        con.close()
+
+
+def test_unavailable_cache(monkeypatch):
+    con, injected = connection(entry_cache_ttl=10)
+    con.close()
+    con.hosts['host1']['search_timeout'] = 10
+    con.open()
+    try:
+        monkeypatch.setattr(ldapfs.cache, 'time', lambda: 100.0)
+        entry = con.get('host1', 'cn=e1,dc=ie')
+        monkeypatch.setattr(ldapfs.cache, 'time', lambda: 200.0)
+        injected['search'] = Faults(stall=(1, 1000))
+        assert con.get('host1', 'cn=e1,dc=ie') is entry
+        with pytest.raises(LdapTimeout):
+            con.get('host1', 'cn=e2,dc=ie')
+    finally:
+        con.close()
@@ -0,0 +1,157 @@
+
+import random
+import ldap
+import pytest
+import ldapfs.ldapcon
+from ldapfs import dit
+from ldapfs.exceptions import LdapException, LdapTimeout, HostDown
+from ldapfs.faults import Faults, FaultyLDAPObject
+from ldapfs.fakeldap import FakeConnection
+from ldapfs.ldapcon import Replica
+
+URIS = ['ldap://r1:389', 'ldap://r2:389']
+
+
+def connection():
+    values = {'uris': URIS, 'base_dns': ['dc=ie'], 'bind_dn': '',
+              'bind_password': '', 'ldap_trace_level': 0,
+              'fake_tree': dit.parse_shape('depth=0, fanout=3')}
+    con = FakeConnection({'host1': values})
+    con.EXPLORE = 0
+    con.open()
+    return con, con.hosts['host1']['replicas']
+
+
+def inject(replica, faults):
+    replica.con = FaultyLDAPObject(replica.con, faults, random.Random(1))
+
+
+def test_replica_latency():
+    replica = Replica(URIS[0])
+    replica.observe(1.0)
+    assert replica.latency == 1.0
+    replica.observe(2.0)
+    assert replica.latency == pytest.approx(1.2)
+    assert replica.state() == 'ldap://r1:389 up 1200.0ms'
+    assert not replica.is_up()
+
+
+def test_lowest_latency():
+    con, replicas = connection()
+    try:
+        inject(replicas[0], {'search': Faults(delay=('fixed', [20]))})
+        for _ in range(10):
+            assert con.get('host1', 'dc=ie')
+        # Each is tried once, then the faster one is used
+        assert [replica.searches for replica in replicas] == [1, 9]
+    finally:
+        con.close()
+
+
+def test_explore():
+    con, replicas = connection()
+    con.EXPLORE = 1
+    try:
+        for _ in range(20):
+            con.get('host1', 'dc=ie')
+        assert all(replica.searches for replica in replicas)
+    finally:
+        con.close()
+
+
+def test_failover():
+    con, replicas = connection()
+    try:
+        inject(replicas[0], {'search': Faults(drop=1)})
+        assert con.get('host1', 'dc=ie')
+        assert not replicas[0].is_up()
+        assert not con.is_down('host1')
+        assert replicas[1].searches == 1
+        lines = con.status_text().splitlines()
+        assert lines[0] == 'host1 up'
+        assert lines[1].startswith('    ldap://r1:389 down for 0s: ')
+        assert lines[2].startswith('    ldap://r2:389 up ')
+
+        assert con.probe() == []
+        assert replicas[0].is_up()
+        assert con.hosts['host1']['connects'] == 3
+    finally:
+        con.close()
+
+
+def test_failover_deadline(monkeypatch):
+    con, replicas = connection()
+    con.hosts['host1'].update({'op_timeout': 100, 'search_timeout': 80})
+    clock = [1000.0]
+    monkeypatch.setattr(ldapfs.ldapcon, 'time', lambda: clock[0])
+    search_replica = con._search_replica
+    timeouts = []
+
+    def timed_search_replica(*args):
+        timeouts.append(args[-1])
+        return search_replica(*args)
+    con._search_replica = timed_search_replica
+
+    def slow_down(*args, **kwargs):
+        clock[0] += 0.07
+        raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+    try:
+        replicas[0].con.search_ext = slow_down
+        con.begin()
+        assert con.get('host1', 'dc=ie')
+        # The next replica only gets what's left of the op's time
+        assert timeouts == [pytest.approx(0.08), pytest.approx(0.03)]
+
+        assert con.probe() == []
+        del timeouts[:]
+        replicas[0].latency = 0
+        replicas[0].con.search_ext = slow_down
+        con.hosts['host1']['op_timeout'] = 50
+        con.begin()
+        with pytest.raises(LdapTimeout):
+            con.get('host1', 'dc=ie')
+        assert timeouts == [pytest.approx(0.05)]
+        assert con.hosts['host1']['timeouts'] == 1
+    finally:
+        con.close()
+
+
+def test_all_down():
+    con, replicas = connection()
+    try:
+        for replica in replicas:
+            inject(replica, {'search': Faults(drop=1)})
+        with pytest.raises(HostDown):
+            con.get('host1', 'dc=ie')
+        assert con.is_down('host1')
+        assert con.hosts['host1']['downs'] == 1
+        assert con.probe() == ['host1']
+        assert con.get('host1', 'dc=ie')
+    finally:
+        con.close()
+
+
+def test_open_replica_down(monkeypatch):
+    con, _ = connection()
+    con.close()
+    connect = con._connect
+
+    def failing_connect(host, values, uri):
+        if uri == URIS[0]:
+            raise LdapException('Unreachable')
+        return connect(host, values, uri)
+    monkeypatch.setattr(con, '_connect', failing_connect)
+    con.open()
+    try:
+        replicas = con.hosts['host1']['replicas']
+        assert not replicas[0].is_up()
+        assert replicas[1].is_up()
+        assert con.get('host1', 'dc=ie')
+    finally:
+        con.close()
+
+    monkeypatch.setattr(con, '_connect',
+                        lambda *args: failing_connect('host1', None, URIS[0]))
+    with pytest.raises(LdapException):
+        con.open()
+    con.close()
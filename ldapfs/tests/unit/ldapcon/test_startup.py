@@ -0,0 +1,77 @@
+
+import ldap
+import pytest
+from time import time
+from ldapfs import dit
+from ldapfs import faults
+from ldapfs.faults import Faults
+from ldapfs.exceptions import LdapException, HostDown
+from ldapfs.fakeldap import FakeConnection
+
+HOSTS = ['host1', 'host2', 'host3', 'host4']
+
+
+def connection(latency=0, **kwargs):
+    values = {'port': 389, 'base_dns': ['dc=ie'], 'bind_dn': '',
+              'bind_password': '', 'ldap_trace_level': 0,
+              'fake_tree': dit.parse_shape('depth=0, fanout=3'),
+              'fake_latency': latency}
+    con = FakeConnection(dict((host, dict(values)) for host in HOSTS),
+                         **kwargs)
+    injected = {}
+    faults.install(con, injected, hosts=['host1'])
+    return con, injected
+
+
+def test_open_parallel():
+    # Binding to each host and reading its Root DSE take 200ms each
+    con, _ = connection(200)
+    start = time()
+    con.open()
+    try:
+        assert time() - start < 2 * 0.2 * len(HOSTS) / 2
+        assert not con.connecting
+        assert con.status_text().splitlines() == \
+            ['{} up'.format(host) for host in HOSTS]
+    finally:
+        con.close()
+
+
+def test_open_error():
+    con, injected = connection()
+    injected['bind'] = Faults(error=(1, ldap.SERVER_DOWN))
+    with pytest.raises(LdapException):
+        con.open()
+    con.close()
+
+
+def test_lazy_connect():
+    con, _ = connection(200, lazy_connect=True)
+    start = time()
+    con.open()
+    try:
+        assert time() - start < 0.1
+        assert con.status_text().startswith('host1 connecting\n')
+        # Waits for the host to be connected
+        assert con.get('host2', 'dc=ie')
+        assert time() - start >= 0.2
+        assert con.status_text().startswith('host1 up\n')
+    finally:
+        con.close()
+    assert not con.connectors
+
+
+def test_lazy_connect_down():
+    con, injected = connection(lazy_connect=True)
+    injected['bind'] = Faults(error=(1, ldap.SERVER_DOWN))
+    con.open()
+    try:
+        with pytest.raises(HostDown):
+            con.get('host1', 'dc=ie')
+        assert con.is_down('host1')
+        assert con.get('host2', 'dc=ie')
+        injected.clear()
+        assert con.probe() == ['host1']
+        assert con.get('host1', 'dc=ie')
+    finally:
+        con.close()
@@ -0,0 +1,26 @@
+
+import pytest
+from ldapfs.conf import ConfigError
+from ldapfs.ldapconf import LdapConfigFile
+
+
+def test_validate_dns():
+    assert LdapConfigFile.validate_dns('"dc=ie" "cn=x,dc=ie"') == \
+        ['dc=ie', 'cn=x,dc=ie']
+    with pytest.raises(ConfigError):
+        LdapConfigFile.validate_dns('  ')
+
+
+def test_validate_uris():
+    uris = ['ldap://r1:389', 'ldaps://r2:636', 'ldapi://%2Ftmp%2Fldapi',
+            'ldapi://']
+    assert LdapConfigFile.validate_uris(' '.join(uris)) == uris
+    for uris in ('', 'r1:389', 'http://r1', 'ldap://', 'ldaps:///'):
+        with pytest.raises(ConfigError):
+            LdapConfigFile.validate_uris(uris)
+
+
+def test_validate_sasl_mech():
+    assert LdapConfigFile.validate_sasl_mech(' external') == 'EXTERNAL'
+    with pytest.raises(ConfigError):
+        LdapConfigFile.validate_sasl_mech('GSSAPI')
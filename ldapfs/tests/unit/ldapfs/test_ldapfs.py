@@ -0,0 +1,270 @@
+
+import errno
+import logging
+import os
+import stat
+import pytest
+from ldapfs import fakeldap
+from ldapfs import faults
+from ldapfs import fs
+from ldapfs import replay
+from ldapfs.exceptions import ConfigError
+from ldapfs.faults import Faults
+
+TREE = 'depth=0, fanout=2, attrs=1, values=3, group_size=2'
+
+
+def create_fs(tmpdir, base_config=None, host_config=None):
+    config = str(tmpdir.join('ldapfs.cfg'))
+    base = {'log_async': 'false'}
+    base.update(base_config or {})
+    values = {'fake_tree': TREE}
+    values.update(host_config or {})
+    fakeldap.write_config(config, 'host1', ['dc=ie'], base, values)
+    return replay.create_fs(config)
+
+
+def test_trace_size(tmpdir):
+    trace_file = str(tmpdir.join('trace'))
+    ldapfs = create_fs(tmpdir, {'trace_file': trace_file, 'trace_size': 1})
+    ldapfs.fsdestroy()
+    assert ldapfs.tracer.size == 1
+    with pytest.raises(ConfigError):
+        create_fs(tmpdir, {'trace_file': trace_file, 'trace_size': 0})
+
+
+def test_guards_config(tmpdir):
+    for host_config in ({'breaker_threshold': 101},
+                        {'breaker_threshold': -1},
+                        {'breaker_threshold': 50, 'breaker_window': 0},
+                        {'max_in_flight': -1},
+                        {'max_in_flight': 8, 'max_queued': -1}):
+        with pytest.raises(ConfigError):
+            create_fs(tmpdir, host_config=host_config)
+    ldapfs = create_fs(tmpdir, host_config={'breaker_threshold': 100,
+                                            'breaker_window': 1})
+    ldapfs.fsdestroy()
+
+
+def test_log_handler(tmpdir):
+    handlers = list(logging.getLogger().handlers)
+    for log_async in ('true', 'false'):
+        ldapfs = create_fs(tmpdir, {'log_async': log_async})
+        assert len(logging.getLogger().handlers) == len(handlers) + 1
+        ldapfs.fsdestroy()
+        assert logging.getLogger().handlers == handlers
+
+
+def test_nlink(tmpdir):
+    ldapfs = create_fs(tmpdir)
+    try:
+        assert ldapfs.getattr('/host1/dc=ie/cn=group').st_nlink == 2
+        assert ldapfs.getattr('/host1/dc=ie').st_nlink == 5
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_nlink_value_dirs(tmpdir):
+    ldapfs = create_fs(tmpdir, {'value_dir_threshold': 1})
+    try:
+        # member/ is a subdir, not counted by numSubordinates
+        assert ldapfs.getattr('/host1/dc=ie/cn=group').st_nlink == 1
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_inode(tmpdir):
+    ldapfs = create_fs(tmpdir)
+    try:
+        assert 'use_ino' in ldapfs.fuse_args.optlist
+        for fspath in ('/', '/host1', '/host1/dc=ie', '/host1/dc=ie/cn=e0'):
+            for direntry in ldapfs.readdir(fspath, 0):
+                if direntry.name in ('.', '..'):
+                    continue
+                child = os.path.join(fspath, direntry.name)
+                assert ldapfs.getattr(child).st_ino == direntry.ino, child
+    finally:
+        ldapfs.fsdestroy()
+
+
+def names(direntries):
+    return [direntry.name for direntry in direntries]
+
+
+def test_value_dir(tmpdir):
+    ldapfs = create_fs(tmpdir, {'value_dir_threshold': 2})
+    try:
+        st = ldapfs.getattr('/host1/dc=ie/cn=e0/description')
+        assert stat.S_ISDIR(st.st_mode)
+        assert names(ldapfs.readdir('/host1/dc=ie/cn=e0/description', 0)) \
+            == ['.', '..', '0', '1', '2']
+        st = ldapfs.getattr('/host1/dc=ie/cn=e0/description/1')
+        assert stat.S_ISREG(st.st_mode)
+        assert st.st_size == len('0-1-' + 'x' * 28 + '\n')
+        assert ldapfs.read('/host1/dc=ie/cn=e0/description/1', 4, 0) == \
+            '0-1-'
+        assert ldapfs.read('/host1/dc=ie/cn=e0/description', 4, 0) == \
+            -errno.EISDIR
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_value_dir_searches(tmpdir):
+    ldapfs = create_fs(tmpdir, {'value_dir_threshold': 2})
+    try:
+        replica = ldapfs.ldap.hosts['host1']['replicas'][0]
+        search_ext = replica.con.search_ext
+        searches = []
+
+        def counted_search_ext(*args, **kwargs):
+            searches.append(args[0])
+            return search_ext(*args, **kwargs)
+        replica.con.search_ext = counted_search_ext
+
+        fspath = '/host1/dc=ie/cn=e0/description'
+        for direntry in ldapfs.readdir(fspath, 0):
+            if direntry.name not in ('.', '..'):
+                value_path = fspath + '/' + direntry.name
+                assert ldapfs.getattr(value_path).st_size
+                assert ldapfs.read(value_path, 100, 0)
+        # The entry is fetched once for the whole dir
+        assert searches == ['cn=e0,dc=ie']
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_value_dir_bad_index(tmpdir):
+    ldapfs = create_fs(tmpdir, {'value_dir_threshold': 2})
+    try:
+        for index in ('3', '-1', '01', 'x'):
+            fspath = '/host1/dc=ie/cn=e0/description/' + index
+            assert ldapfs.getattr(fspath) == -errno.ENOENT, fspath
+            assert ldapfs.read(fspath, 10, 0) == -errno.ENOENT, fspath
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_value_dir_threshold(tmpdir):
+    ldapfs = create_fs(tmpdir, {'value_dir_threshold': 2})
+    try:
+        # Two members aren't more than the threshold
+        st = ldapfs.getattr('/host1/dc=ie/cn=group/member')
+        assert stat.S_ISREG(st.st_mode)
+        assert ldapfs.read('/host1/dc=ie/cn=group/member', 100, 0) == \
+            'cn=e0,dc=ie,cn=e1,dc=ie\n'
+        assert ldapfs.getattr('/host1/dc=ie/cn=group/member/0') == \
+            -errno.ENOENT
+        assert ldapfs.readdir('/host1/dc=ie/cn=group/member', 0) == []
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_value_dir_disabled(tmpdir):
+    ldapfs = create_fs(tmpdir, {'value_dir_threshold': 0})
+    try:
+        st = ldapfs.getattr('/host1/dc=ie/cn=e0/description')
+        assert stat.S_ISREG(st.st_mode)
+        assert ldapfs.read('/host1/dc=ie/cn=e0/description', 4, 0) == '0-0-'
+        assert ldapfs.getattr('/host1/dc=ie/cn=e0/description/0') == \
+            -errno.ENOENT
+        entries = list(ldapfs.readdir('/host1/dc=ie/cn=e0', 0))
+        assert [direntry.type for direntry in entries
+                if direntry.name == 'description'] == [fs.DT_REG]
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_open_read_release(tmpdir):
+    ldapfs = create_fs(tmpdir)
+    try:
+        fspath = '/host1/dc=ie/cn=e0/sn'
+        fh = ldapfs.open(fspath, os.O_RDONLY)
+        ldapfs.ldap.directories['host1'].add(
+            'cn=e0,dc=ie', {'cn': ['e0'], 'sn': ['changed']})
+        # Reads through the handle see the text as it was when opened
+        assert ldapfs.read(fspath, 100, 0, fh) == 'e0\n'
+        assert ldapfs.read(fspath, 2, 1, fh) == '0\n'
+        assert ldapfs.read(fspath, 100, 0) == 'changed\n'
+        assert ldapfs.release(fspath, os.O_RDONLY, fh) == 0
+        assert fh.text is None
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_open_errors(tmpdir):
+    ldapfs = create_fs(tmpdir)
+    try:
+        fspath = '/host1/dc=ie/cn=e0/sn'
+        assert ldapfs.open(fspath, os.O_WRONLY) == -errno.EACCES
+        assert ldapfs.open(fspath, os.O_RDWR) == -errno.EACCES
+        assert ldapfs.open('/host1/dc=ie/cn=e0/x', os.O_RDONLY) == \
+            -errno.ENOENT
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_status_dir(tmpdir):
+    ldapfs = create_fs(tmpdir)
+    try:
+        st = ldapfs.getattr('/.ldapfs')
+        assert stat.S_ISDIR(st.st_mode)
+        assert sorted(names(ldapfs.readdir('/.ldapfs', 0))) == \
+            ['.', '..', 'capabilities', 'hosts', 'stats']
+        assert '.ldapfs' in names(ldapfs.readdir('/', 0))
+        st = ldapfs.getattr('/.ldapfs/hosts')
+        assert stat.S_ISREG(st.st_mode)
+        assert st.st_size == len('host1 up\n')
+        assert ldapfs.read('/.ldapfs/hosts', 100, 0) == 'host1 up\n'
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_status_stats(tmpdir):
+    ldapfs = create_fs(tmpdir)
+    try:
+        ldapfs.getattr('/host1/dc=ie')
+        fh = ldapfs.open('/.ldapfs/stats', os.O_RDONLY)
+        assert fh.direct_io
+        lines = ldapfs.read('/.ldapfs/stats', 10000, 0, fh).splitlines()
+        assert lines[0].startswith('# call')
+        assert [line for line in lines if line.startswith('fuse.getattr ')]
+        ldapfs.release('/.ldapfs/stats', os.O_RDONLY, fh)
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_status_errors(tmpdir):
+    ldapfs = create_fs(tmpdir)
+    try:
+        assert ldapfs.getattr('/.ldapfs/x') == -errno.ENOENT
+        assert ldapfs.read('/.ldapfs/x', 10, 0) == -errno.ENOENT
+        assert ldapfs.open('/.ldapfs/x', os.O_RDONLY) == -errno.ENOENT
+        assert ldapfs.readdir('/.ldapfs/hosts', 0) == []
+        assert ldapfs.read('/.ldapfs', 10, 0) == -errno.EISDIR
+    finally:
+        ldapfs.fsdestroy()
+
+    ldapfs = create_fs(tmpdir, {'stats': 'false'})
+    try:
+        assert ldapfs.getattr('/.ldapfs/stats') == -errno.ENOENT
+    finally:
+        ldapfs.fsdestroy()
+
+
+def test_host_down(tmpdir):
+    ldapfs = create_fs(tmpdir, {'value_dir_threshold': 1})
+    try:
+        faults.install(ldapfs.ldap, {'search': Faults(drop=1)})
+        assert ldapfs.readdir('/host1/dc=ie', 0) == -errno.EHOSTDOWN
+        assert ldapfs.ldap.is_down('host1')
+        # Not "no such file" while the host is down
+        assert ldapfs.readdir('/host1/dc=ie/cn=group/member', 0) == \
+            -errno.EHOSTDOWN
+        assert ldapfs.getattr('/host1/dc=ie/cn=group/member') == \
+            -errno.EHOSTDOWN
+        assert ldapfs.getattr('/host1/dc=ie/cn=group/member/0') == \
+            -errno.EHOSTDOWN
+        assert ldapfs.read('/host1/dc=ie/cn=group/member/0', 10, 0) == \
+            -errno.EHOSTDOWN
+    finally:
+        ldapfs.fsdestroy()
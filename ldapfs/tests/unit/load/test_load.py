@@ -0,0 +1,85 @@
+
+import pytest
+from ldapfs import load
+from ldapfs.stats import Histogram
+
+
+def pytest_generate_tests(metafunc):
+    for argname in metafunc.funcargnames:
+        fn = globals().get('funcarg_{}'.format(argname))
+        if fn:
+            metafunc.parametrize(argname, fn())
+
+
+def funcarg_bad_mix():
+    return ['stat', 'stat=x', 'rm=1', 'stat=-1', 'stat=0', '']
+
+
+def tree(tmpdir):
+    tmpdir.join('.ldapfs', 'stats').write('status', ensure=True)
+    tmpdir.join('dc=ie', 'cn').write('ie', ensure=True)
+    tmpdir.join('dc=ie', 'cn=a', 'sn').write('x', ensure=True)
+    return str(tmpdir)
+
+
+def test_parse_mix():
+    assert load.parse_mix(load.DEFAULT_MIX) == [('stat', 40), ('ls', 20),
+                                                ('cat', 35), ('walk', 5)]
+    assert load.parse_mix('cat=1,') == [('cat', 1)]
+
+
+def test_parse_bad_mix(bad_mix):
+    with pytest.raises(ValueError):
+        load.parse_mix(bad_mix)
+
+
+def test_parse_args(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['ldapfs-load', '-m', 'cat=1',
+                                     '-t', 'depth=0, fanout=5'])
+    args, mix, shape = load.parse_args()
+    assert args.workers == 4
+    assert mix == [('cat', 1)]
+    assert shape['fanout'] == 5
+    for argv in (['--ldapi'], ['-m', 'rm=1'], ['-t', 'depth=x']):
+        monkeypatch.setattr('sys.argv', ['ldapfs-load'] + argv)
+        with pytest.raises(SystemExit):
+            load.parse_args()
+
+
+def test_find_paths(tmpdir):
+    top = tree(tmpdir)
+    dirs, files = load.find_paths(top)
+    assert sorted(dirs) == [top, str(tmpdir.join('dc=ie')),
+                            str(tmpdir.join('dc=ie', 'cn=a'))]
+    assert sorted(files) == [str(tmpdir.join('dc=ie', 'cn')),
+                             str(tmpdir.join('dc=ie', 'cn=a', 'sn'))]
+
+
+def test_work(tmpdir):
+    dirs, files = load.find_paths(tree(tmpdir))
+    files.append(str(tmpdir.join('missing')))
+    histograms = load.work((dirs, files, load.parse_mix(load.DEFAULT_MIX),
+                            0.05, 1))
+    assert sorted(histograms) == sorted(load.OPS)
+    assert all([histogram.count for histogram in histograms.values()])
+    assert histograms['cat'].errors
+    assert not histograms['ls'].errors
+
+
+def test_run(tmpdir):
+    dirs, files = load.find_paths(tree(tmpdir))
+    histograms, elapsed = load.run(dirs, files, [('ls', 1)], 2, 0.05)
+    assert histograms.keys() == ['ls']
+    assert histograms['ls'].count > 1
+    assert elapsed >= 0.05
+
+
+def test_report():
+    histogram = Histogram()
+    histogram.record(0.001)
+    histogram.record(0.002, error=True)
+    text = load.report({'cat': histogram}, 2.0, 3)
+    lines = text.splitlines()
+    assert lines[0] == '3 workers for 2.0s'
+    assert lines[2].split() == ['cat', '2', '1', '1.0', '1.024', '2.000',
+                                '2.000']
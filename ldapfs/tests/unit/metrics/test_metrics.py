@@ -0,0 +1,146 @@
+
+import mock
+from ldapfs.ldapcon import Entry, Replica
+from ldapfs.cache import EntryCache
+from ldapfs.breaker import CircuitBreaker, Admission
+from ldapfs.metrics import Metrics, MetricsFile
+from ldapfs.stats import Stats, Histogram
+
+
+def make_metrics():
+    ldap = mock.Mock()
+    ldap.leaf_stats = {'hits': 3, 'misses': 2, 'evictions': 0}
+    ldap.leaves = {}
+    ldap.entry_cache = None
+    ldap.breakers = {}
+    ldap.admissions = {}
+    up, down = Replica('ldap://r1:389'), Replica('ldap://r2:389')
+    up.con = object()
+    up.observe(0.25)
+    down.down_since = 100.0
+    ldap.hosts = {'host1': {'replicas': [up], 'connects': 2, 'timeouts': 4},
+                  'host2': {'replicas': [down], 'down_since': 100.0},
+                  'host3': {'replicas': [up, down], 'connects': 1}}
+    return Metrics(ldap)
+
+
+def samples(text):
+    return dict([line.rsplit(' ', 1) for line in text.splitlines()
+                 if not line.startswith('#')])
+
+
+def test_fuse_ops():
+    metrics = make_metrics()
+    metrics('fuse.getattr', ('/path',), object(), None, 0, 0.1)
+    metrics('fuse.getattr', ('/path',), -2, None, 0, 0.1)
+    metrics('fuse.read', ('/path', 10, 0), 'text', None, 0, 0.1)
+    metrics('fuse.read', ('/path', 10, 0), 'text', None, 0, 0.1)
+
+    values = samples(metrics.text())
+    name = 'ldapfs_fuse_operations_total'
+    assert values[name + '{op="getattr",outcome="ok"}'] == '1'
+    assert values[name + '{op="getattr",outcome="error"}'] == '1'
+    assert values[name + '{op="read",outcome="ok"}'] == '2'
+
+
+def test_ldap_searches():
+    metrics = make_metrics()
+    entries = [Entry('cn=x', {'cn': ['x'], 'mail': ['ab', 'cd']})]
+    metrics('ldap.search', ('host1', 'cn=x', False, False), entries, None,
+            0, 0.1)
+    metrics('ldap.search', ('host1', 'cn=x', True, False), [], None, 0, 0.1)
+    metrics('ldap.search', ('host2', 'cn=x', False, False), None,
+            ValueError(), 0, 0.1)
+
+    values = samples(metrics.text())
+    name = 'ldapfs_ldap_searches_total'
+    assert values[name + '{host="host1",outcome="ok",scope="base"}'] == '1'
+    assert values[name + '{host="host1",outcome="ok",scope="onelevel"}'] \
+        == '1'
+    assert values[name + '{host="host2",outcome="error",scope="base"}'] \
+        == '1'
+    assert values['ldapfs_ldap_received_entries_total{host="host1"}'] == '1'
+
+
+def test_latency():
+    metrics = make_metrics()
+    metrics.stats = Stats()
+    metrics.stats.histograms['fuse.read'] = Histogram()
+    metrics.stats.histograms['fuse.read'].record(0.5)
+    metrics.stats.histograms['fuse.read'].record(1.5)
+
+    text = metrics.text()
+    assert '# TYPE ldapfs_call_latency_seconds summary\n' in text
+    values = samples(text)
+    name = 'ldapfs_call_latency_seconds'
+    assert values[name + '{call="fuse.read",quantile="0.99"}'] == '1.5'
+    assert values[name + '_sum{call="fuse.read"}'] == '2.0'
+    assert values[name + '_count{call="fuse.read"}'] == '2'
+
+
+def test_connection():
+    values = samples(make_metrics().text())
+    assert values['ldapfs_leaf_cache_hits_total'] == '3'
+    assert values['ldapfs_leaf_cache_misses_total'] == '2'
+    assert values['ldapfs_ldap_connections{host="host1"}'] == '1'
+    assert values['ldapfs_ldap_connections{host="host2"}'] == '0'
+    assert values['ldapfs_ldap_reconnects_total{host="host1"}'] == '1'
+    assert values['ldapfs_ldap_reconnects_total{host="host2"}'] == '0'
+    assert values['ldapfs_ldap_timeouts_total{host="host1"}'] == '4'
+    assert values['ldapfs_ldap_host_down{host="host1"}'] == '0'
+    assert values['ldapfs_ldap_host_down{host="host2"}'] == '1'
+    assert values['ldapfs_ldap_timeouts_total{host="host2"}'] == '0'
+
+
+def test_replicas():
+    values = samples(make_metrics().text())
+    assert values['ldapfs_ldap_connections{host="host3"}'] == '1'
+    assert values['ldapfs_ldap_reconnects_total{host="host3"}'] == '0'
+    name = 'ldapfs_ldap_replica_up'
+    assert values[name + '{host="host3",uri="ldap://r1:389"}'] == '1'
+    assert values[name + '{host="host3",uri="ldap://r2:389"}'] == '0'
+    name = 'ldapfs_ldap_replica_latency_seconds'
+    assert values[name + '{host="host1",uri="ldap://r1:389"}'] == '0.25'
+    assert name + '{host="host2",uri="ldap://r2:389"}' not in values
+
+
+def test_entry_cache():
+    metrics = make_metrics()
+    metrics.ldap.entry_cache = EntryCache(60)
+    metrics.ldap.entry_cache.put('key', [])
+    metrics.ldap.entry_cache.stats['stale_hits'] = 5
+    values = samples(metrics.text())
+    assert values['ldapfs_entry_cache_stale_hits_total'] == '5'
+    assert values['ldapfs_entry_cache_entries'] == '1'
+    assert 'ldapfs_entry_cache_entries' not in samples(make_metrics().text())
+
+
+def test_guards():
+    metrics = make_metrics()
+    breaker = CircuitBreaker(50, window=2)
+    breaker.record(0, True)
+    breaker.record(0, True)
+    metrics.ldap.breakers = {'host1': breaker}
+    admission = Admission(1)
+    admission.enter()
+    admission.enter()
+    metrics.ldap.admissions = {'host1': admission}
+    values = samples(metrics.text())
+    assert values['ldapfs_ldap_breaker_open{host="host1"}'] == '1'
+    assert values['ldapfs_ldap_breaker_trips_total{host="host1"}'] == '1'
+    assert values['ldapfs_ldap_in_flight{host="host1"}'] == '1'
+    assert values['ldapfs_ldap_queued{host="host1"}'] == '0'
+    assert values['ldapfs_ldap_rejected_total{host="host1"}'] == '1'
+
+
+def test_escape():
+    metrics = make_metrics()
+    metrics('ldap.search', ('a"b\\c', 'cn=x', False, False), [], None, 0, 0)
+    assert 'host="a\\"b\\\\c"' in metrics.text()
+
+
+def test_metrics_file(tmpdir):
+    path = str(tmpdir.join('ldapfs.prom'))
+    MetricsFile(make_metrics(), path, 60).write()
+    assert 'ldapfs_leaf_cache_hits_total 3' in open(path).read()
+    assert tmpdir.listdir() == [tmpdir.join('ldapfs.prom')]
@@ -0,0 +1,34 @@
+
+import os
+from ldapfs import profiler
+from ldapfs.profiler import Profiler
+
+
+def test_toggle(tmpdir):
+    prof = Profiler(str(tmpdir))
+    prof.toggle()
+    assert prof.profile
+    held = [[i] for i in range(1000)]
+    prof.toggle()
+    assert not prof.profile
+
+    names = sorted(os.listdir(str(tmpdir)))
+    assert len(names) == 3
+    assert [os.path.splitext(n)[1] for n in names] == ['.mem', '.pstats',
+                                                       '.txt']
+    prefix = os.path.join(str(tmpdir), os.path.splitext(names[0])[0])
+    assert 'cumulative' in open(prefix + '.txt').read()
+    mem = open(prefix + '.mem').read()
+    if profiler.tracemalloc:
+        assert mem.startswith('# Top allocation sites')
+    else:
+        assert ' list\n' in mem
+    assert held
+
+
+def test_write_error(tmpdir):
+    prof = Profiler(os.path.join(str(tmpdir), 'missing'))
+    prof.toggle()
+    prof.toggle()
+    assert not prof.profile
+    assert not os.listdir(str(tmpdir))
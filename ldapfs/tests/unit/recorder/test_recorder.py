@@ -0,0 +1,51 @@
+
+import errno
+import pytest
+from ldapfs.recorder import Recorder, Record, read_records
+
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join('ops.rec'))
+    recorder = Recorder(path)
+    recorder.start()
+    recorder('fuse.getattr', ('/h1/dc=ie',), object(), None, 10.0, 0.5)
+    recorder('fuse.readdir', ('/h1', 0), [], None, 11.0, 0.25)
+    recorder('fuse.open', ('/h1/dc=ie/cn', 0), -errno.ENOENT, None, 12.0, 1)
+    recorder('fuse.read', ('/h1/dc=ie/cn', 4096, 8192, None), 'text', None,
+             13.0, 2)
+    recorder('fuse.release', ('/h1/dc=ie/cn', 0, None), None, ValueError(),
+             14.0, 3)
+    recorder('ldap.search', ('h1', 'dc=ie', False, True), [], None, 15.0, 4)
+    recorder.close()
+
+    assert list(read_records(path)) == [
+        Record(10.0, 0.5, 'getattr', 0, 0, 0, '/h1/dc=ie'),
+        Record(11.0, 0.25, 'readdir', 0, 0, 0, '/h1'),
+        Record(12.0, 1, 'open', -errno.ENOENT, 0, 0, '/h1/dc=ie/cn'),
+        Record(13.0, 2, 'read', 0, 4096, 8192, '/h1/dc=ie/cn'),
+        Record(14.0, 3, 'release', -1, 0, 0, '/h1/dc=ie/cn')]
+
+
+def test_not_started(tmpdir):
+    recorder = Recorder(str(tmpdir.join('ops.rec')))
+    recorder('fuse.getattr', ('/',), 0, None, 10.0, 0.5)
+    recorder.close()
+    assert not tmpdir.listdir()
+
+
+def test_truncated(tmpdir):
+    path = str(tmpdir.join('ops.rec'))
+    recorder = Recorder(path)
+    recorder.start()
+    recorder('fuse.getattr', ('/a',), 0, None, 10.0, 0.5)
+    recorder('fuse.getattr', ('/b',), 0, None, 10.0, 0.5)
+    recorder.close()
+    data = tmpdir.join('ops.rec').read('rb')
+    tmpdir.join('ops.rec').write(data[:-1], 'wb')
+    assert [record.path for record in read_records(path)] == ['/a']
+
+
+def test_bad_file(tmpdir):
+    tmpdir.join('ops.rec').write('not a record file')
+    with pytest.raises(ValueError):
+        list(read_records(str(tmpdir.join('ops.rec'))))
@@ -0,0 +1,56 @@
+
+import errno
+import mock
+from ldapfs import replay
+from ldapfs.recorder import Record
+
+
+def records():
+    return [Record(10.0, 0.001, 'getattr', 0, 0, 0, '/h1'),
+            Record(10.1, 0.002, 'readdir', 0, 0, 0, '/h1'),
+            Record(10.2, 0.001, 'open', 0, 0, 0, '/h1/dc=ie/cn'),
+            Record(10.3, 0.001, 'read', 0, 10, 0, '/h1/dc=ie/cn'),
+            Record(10.4, 0.001, 'release', 0, 0, 0, '/h1/dc=ie/cn'),
+            Record(10.5, 0.001, 'getattr', -errno.ENOENT, 0, 0, '/h2')]
+
+
+def test_replay():
+    ldapfs = mock.Mock()
+    ldapfs.getattr.side_effect = [object(), -errno.ENOENT]
+    ldapfs.readdir.return_value = iter(['a', 'b'])
+    fh = ldapfs.open.return_value
+
+    replayed, recorded = replay.replay(ldapfs, records())
+
+    ldapfs.readdir.assert_called_once_with('/h1', 0)
+    ldapfs.read.assert_called_once_with('/h1/dc=ie/cn', 10, 0, fh)
+    ldapfs.release.assert_called_once_with('/h1/dc=ie/cn', 0, fh)
+    for stats in (replayed, recorded):
+        assert stats.histograms['fuse.getattr'].count == 2
+        assert stats.histograms['fuse.getattr'].errors == 1
+        assert stats.histograms['fuse.read'].count == 1
+    assert recorded.histograms['fuse.readdir'].max == 0.002
+
+
+def test_replay_exception():
+    ldapfs = mock.Mock()
+    ldapfs.getattr.side_effect = ValueError()
+    replayed, _ = replay.replay(ldapfs, records()[:1])
+    assert replayed.histograms['fuse.getattr'].errors == 1
+
+
+@mock.patch('ldapfs.replay.sleep')
+def test_replay_speed(sleep):
+    ldapfs = mock.Mock()
+    ldapfs.getattr.return_value = 0
+    with mock.patch('ldapfs.replay.time', return_value=100.0):
+        replay.replay(ldapfs, records()[:3], speed=2)
+    delays = [call[0][0] for call in sleep.call_args_list]
+    assert [round(delay, 3) for delay in delays] == [0.05, 0.1]
+
+
+def test_report():
+    replayed, recorded = replay.replay(mock.Mock(), records()[:2])
+    text = replay.report(replayed, recorded, 0.5)
+    assert text.startswith('Replayed 2 operations in 0.500s (4.0 ops/s)')
+    assert 'Recorded latencies:' in text
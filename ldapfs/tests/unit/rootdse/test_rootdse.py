@@ -0,0 +1,27 @@
+
+from ldapfs.rootdse import RootDSE
+
+ATTRS = {'supportedControl': [RootDSE.CONTROLS['paged_results'],
+                              RootDSE.CONTROLS['vlv'], '1.2.3.4'],
+         'supportedextension': [RootDSE.EXTENSIONS['who_am_i']],
+         'namingContexts': ['dc=example,dc=com', '']}
+
+
+def test_capabilities():
+    root_dse = RootDSE(ATTRS)
+    assert root_dse.supports('paged_results')
+    assert root_dse.supports('vlv')
+    assert root_dse.supports('who_am_i')
+    assert not root_dse.supports('server_side_sort')
+    assert not root_dse.supports('unknown')
+    assert '1.2.3.4' in root_dse.controls
+    assert root_dse.capabilities['tree_delete'] is False
+    assert root_dse.naming_contexts == ['dc=example,dc=com']
+    assert str(root_dse) == 'paged_results, vlv, who_am_i'
+
+
+def test_empty():
+    root_dse = RootDSE()
+    assert not any(root_dse.capabilities.values())
+    assert root_dse.naming_contexts == []
+    assert str(root_dse) == 'none'
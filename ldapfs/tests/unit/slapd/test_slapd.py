@@ -0,0 +1,48 @@
+
+import mock
+from ldapfs import dit
+from ldapfs.ldapconf import LdapConfigFile
+from ldapfs.fakeldap import Directory
+from ldapfs.slapd import Slapd
+
+
+def server(tmpdir):
+    server = Slapd(['dc=example,dc=com', 'o=test'],
+                   dit.parse_shape('depth=1, fanout=2, group_size=3'))
+    server.dir = str(tmpdir)
+    server.port = 3890
+    return server
+
+
+def test_write_config(tmpdir):
+    path = str(tmpdir.join('ldapfs.cfg'))
+    server(tmpdir).write_config(path, {'stats': 'false'},
+                                {'fake_latency': 5})
+    config = LdapConfigFile(path)
+    assert config.get_sections() == ['ldapfs', 'slapd']
+    base = config.get('ldapfs')
+    assert base['stats'] == 'false'
+    assert base['log_file'] == str(tmpdir.join('ldapfs.log'))
+    host = config.get('slapd', parse_config=[
+        ('base_dns', LdapConfigFile.validate_dns)])
+    assert host['host'] == '127.0.0.1'
+    assert host['port'] == '3890'
+    assert host['bind_dn'] == 'cn=admin,dc=example,dc=com'
+    assert host['base_dns'] == ['dc=example,dc=com', 'o=test']
+    assert host['fake_latency'] == '5'
+
+
+def test_write_ldif(tmpdir):
+    slapd = server(tmpdir)
+    path = str(tmpdir.join('data.ldif'))
+    with open(path, 'w') as ldif_file:
+        slapd._write_ldif(ldif_file)
+    directory = Directory()
+    directory.load_ldif(path)
+    assert len(directory.entries) == 2 * dit.count(slapd.shape)
+    assert directory.entries['o=test'][1]['o'] == ['test']
+
+
+@mock.patch('os.access', return_value=False)
+def test_not_installed(_):
+    assert Slapd.find() is None
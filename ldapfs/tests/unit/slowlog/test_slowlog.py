@@ -0,0 +1,46 @@
+
+import logging
+from ldapfs.slowlog import SlowLog
+
+
+def search(slow_log, dn, children=False, elapsed=0.1, error=None):
+    slow_log('ldap.search', ('host1', dn, children, True, None),
+             None if error else ['entry'], error, 0, elapsed)
+
+
+def test_fast(caplog):
+    slow_log = SlowLog(0.5)
+    search(slow_log, 'cn=x')
+    slow_log('fuse.getattr', ('/path',), 0, None, 0, 0.1)
+    assert not caplog.records
+
+
+def test_slow(caplog):
+    caplog.set_level(logging.WARNING)
+    slow_log = SlowLog(0.5)
+    search(slow_log, 'cn=x')
+    search(slow_log, 'cn=y', children=True, error=ValueError())
+    slow_log('fuse.readdir', ('/path', 0), [], None, 0, 0.7)
+
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert "readdir('/path', 0) took 700.0ms with 2 LDAP searches" in message
+    assert 'dn=cn=x scope=base attrsonly=True -> 1 entries' in message
+    assert 'dn=cn=y scope=onelevel' in message
+    assert 'error ValueError' in message
+
+
+def test_searches_reset(caplog):
+    caplog.set_level(logging.WARNING)
+    slow_log = SlowLog(0.5)
+    search(slow_log, 'cn=x')
+    slow_log('fuse.getattr', ('/path1',), 0, None, 0, 0.1)
+    slow_log('fuse.getattr', ('/path2',), 0, None, 0, 0.7)
+    assert 'with 0 LDAP searches' in caplog.records[0].getMessage()
+
+
+def test_searches_capped():
+    slow_log = SlowLog(0.5)
+    for _ in range(SlowLog.MAX_SEARCHES + 10):
+        search(slow_log, 'cn=x')
+    assert len(slow_log.context.searches) == SlowLog.MAX_SEARCHES
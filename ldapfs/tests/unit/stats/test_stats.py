@@ -0,0 +1,81 @@
+
+import pytest
+from ldapfs.stats import Histogram, Stats
+
+
+def pytest_generate_tests(metafunc):
+    # pytest has various ways to parametrize tests. Here I've used one global
+    # function per argument. The function is expected to return a list of
+    # values. The test function will be run once for each value.
+    for argname in metafunc.funcargnames:
+        argvalues = globals()['funcarg_{}'.format(argname)]()
+        metafunc.parametrize(argname, argvalues)
+
+
+def funcarg_latencies():
+    # (latencies recorded, percent, expected upper bound)
+    return [([], 50, 0.0),
+            ([0.0000005], 50, 0.0000005),
+            ([0.001] * 100, 50, 0.001),
+            ([0.001] * 90 + [0.1] * 10, 50, 0.001024),
+            ([0.001] * 90 + [0.1] * 10, 90, 0.001024),
+            ([0.001] * 90 + [0.1] * 10, 99, 0.1),
+            ([0.001] * 98 + [2.0] * 2, 99, 2.0),
+            ([10 ** 7], 50, 10 ** 7)]
+
+
+def test_percentile(latencies):
+    values, percent, expected = latencies
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.count == len(values)
+    assert histogram.percentile(percent) == pytest.approx(expected)
+    if values:
+        assert histogram.max == max(values)
+        assert histogram.mean() == pytest.approx(sum(values) / len(values))
+
+
+def test_errors():
+    histogram = Histogram()
+    histogram.record(0.1)
+    histogram.record(0.1, error=True)
+    assert (histogram.count, histogram.errors) == (2, 1)
+
+
+def test_merge():
+    histogram = Histogram()
+    histogram.record(0.001)
+    other = Histogram()
+    other.record(0.1, error=True)
+    other.record(0.1)
+    histogram.merge(other)
+    assert (histogram.count, histogram.errors) == (3, 1)
+    assert histogram.max == 0.1
+    assert histogram.mean() == pytest.approx(0.201 / 3)
+    assert histogram.percentile(50) == pytest.approx(0.1)
+
+
+def test_stats_keys():
+    stats = Stats()
+    stats('fuse.getattr', ('/path',), 0, None, 0, 0.001)
+    stats('fuse.getattr', ('/path',), -2, None, 0, 0.001)
+    stats('ldap.search', ('host1', 'dn'), [], None, 0, 0.001)
+    stats('ldap.search', ('host2', 'dn'), None, ValueError(), 0, 0.001)
+    stats('ldap.open', (), None, None, 0, 0.001)
+
+    assert sorted(stats.histograms) == ['fuse.getattr', 'ldap.open',
+                                        'ldap.search[host1]',
+                                        'ldap.search[host2]']
+    assert stats.histograms['fuse.getattr'].errors == 1
+    assert stats.histograms['ldap.search[host1]'].errors == 0
+    assert stats.histograms['ldap.search[host2]'].errors == 1
+
+
+def test_stats_text():
+    stats = Stats()
+    assert len(stats.text().splitlines()) == 1
+    stats('fuse.read', ('/path', 10, 0), 'text', None, 0, 0.002)
+    lines = stats.text().splitlines()
+    assert len(lines) == 2
+    assert lines[1].split()[:3] == ['fuse.read', '1', '0']
@@ -0,0 +1,77 @@
+
+from ldapfs.trace import Tracer
+
+
+def pytest_generate_tests(metafunc):
+    # pytest has various ways to parametrize tests. Here I've used one global
+    # function per argument. The function is expected to return a list of
+    # values. The test function will be run once for each value.
+    for argname in metafunc.funcargnames:
+        fn = globals().get('funcarg_{}'.format(argname))
+        if fn:
+            argvalues = globals()['funcarg_{}'.format(argname)]()
+            metafunc.parametrize(argname, argvalues)
+
+
+def funcarg_calls():
+    # (ring buffer size, number of calls made)
+    return [(5, 0), (5, 3), (5, 5), (5, 12), (1, 3)]
+
+
+def make_tracer(tmpdir, size, ncalls):
+    trace_file = str(tmpdir.join('trace'))
+    tracer = Tracer(trace_file, size)
+    for i in range(ncalls):
+        tracer('call{}'.format(i), ('/path', i), 'x' * 1000, None, 0, 0.001)
+    return trace_file, tracer
+
+
+def test_ring_buffer(tmpdir, calls):
+    size, ncalls = calls
+    _, tracer = make_tracer(tmpdir, size, ncalls)
+    names = sorted([record[3] for record in tracer.records if record])
+    expected = ['call{}'.format(i)
+                for i in range(max(0, ncalls - size), ncalls)]
+    assert names == sorted(expected)
+
+
+def test_dump(tmpdir, calls):
+    size, ncalls = calls
+    trace_file, tracer = make_tracer(tmpdir, size, ncalls)
+    tracer.dump()
+    lines = open(trace_file).read().splitlines()
+
+    assert lines[0].startswith('# Trace dump')
+    assert len(lines) == 1 + min(size, ncalls)
+    # Oldest call first
+    for i, line in enumerate(lines[1:]):
+        assert 'call{}('.format(max(0, ncalls - size) + i) in line
+        assert len(line) < 2 * Tracer.MAX_REPR
+
+
+def test_dump_error(tmpdir):
+    trace_file = str(tmpdir.join('trace'))
+    tracer = Tracer(trace_file, 2)
+    tracer('fail', (), None, ValueError('bad value'), 0, 0.5)
+    tracer.dump()
+    assert 'raised ValueError: bad value' in open(trace_file).read()
+
+
+def test_dump_appends(tmpdir):
+    trace_file, tracer = make_tracer(tmpdir, 2, 2)
+    tracer.dump()
+    tracer.dump()
+    assert open(trace_file).read().count('# Trace dump') == 2
+
+
+def test_record_summary(tmpdir):
+    tracer = Tracer(str(tmpdir.join('trace')), 2)
+    handle = object()
+    tracer('read', ('/path', 10, handle), 'x' * 100000, None, 0, 0.5)
+    _, _, _, _, args, result, _ = tracer.records[0]
+    # Large values aren't kept, only numbers and truncated text
+    assert args == ("'/path'", 10, str(handle))
+    assert len(result) == Tracer.MAX_REPR + len('...')
+    tracer('readdir', ('/path', 0), ['e{}'.format(i) for i in range(100)],
+           None, 0, 0.5)
+    assert tracer.records[1][5].endswith('e19, ...]')
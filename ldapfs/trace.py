@@ -1,84 +1,110 @@
 #!/usr/bin/env python
 
-"""Function tracing using sys.settrace."""
+"""Low overhead call tracing into a ring buffer.
+
+Calls are recorded by an instrument.Instrument recorder, so only the
+instrumented FUSE entry points and LDAP calls are traced."""
 
 import os
 import sys
+import itertools
 import logging
-import inspect
-
+from time import time, strftime, localtime
 
 LOG = logging.getLogger(__name__)
 
 
 class Tracer(object):
-    """Trace functions with args and return values.
+    """Trace calls with args, results and durations.
 
-       Setup with: sys.settrace(Tracer(trace_file, filter_dir))
+    Each call is stored as a tuple in a preallocated ring buffer holding the
+    most recent calls. Numbers are kept as they are and other args and
+    results as truncated text, so the buffer never holds on to search
+    results or file contents. Nothing is written until the buffer is dumped,
+    which keeps the cost per call low enough to leave on under load.
+
+       Setup with: instrument.add(Tracer(trace_file))
     """
 
-    def __init__(self, trace_file, filter_dir):
-        self.filter_dir = filter_dir
-        if trace_file == "-":
-            handler = logging.StreamHandler()
-        else:
-            if os.path.isfile(trace_file):
-                os.remove(trace_file)
-            handler = logging.FileHandler(trace_file)
-        handler.setLevel(logging.DEBUG)
-        handler.setFormatter(logging.Formatter('%(message)s'))
-        LOG.addHandler(handler)
-
-    def __call__(self, frame, event, arg):
-        """Trace callback used wtih sys.settrace."""
-        if event not in ('call', 'return'):
-            return self
-
-        # Return if the called or calling file path doesn't match the filter
-        path = frame.f_code.co_filename
-        if self.filter_dir and not path.startswith(self.filter_dir) and \
-           (not frame.f_back or
-            not frame.f_back.f_code.co_filename.startswith(self.filter_dir)):
-            return self
-
-        name = frame.f_code.co_name
-        if 'self' in frame.f_locals:
-            namespace = frame.f_locals['self'].__class__.__name__
+    DEFAULT_SIZE = 10000        # number of calls kept
+    MAX_REPR = 200              # max length of formatted args and results
+    MAX_ITEMS = 20              # max list items formatted
+    # Args and results kept in the buffer as they are rather than as text
+    SCALARS = (int, long, float, type(None))
+
+    def __init__(self, trace_file, size=DEFAULT_SIZE):
+        self.trace_file = trace_file
+        self.size = size
+        self.records = [None] * size
+        # next() on an itertools.count is atomic so no lock is needed
+        self.counter = itertools.count()
+        if trace_file != '-' and os.path.isfile(trace_file):
+            os.remove(trace_file)
+
+    def __call__(self, name, args, result, error, start, elapsed):
+        """Record a call in the ring buffer (an Instrument recorder)."""
+        seq = next(self.counter)
+        self.records[seq % self.size] = (
+            seq, start, elapsed, name,
+            tuple([self._summary(arg) for arg in args]),
+            self._summary(result), error)
+
+    def dump(self):
+        """Write the calls currently in the ring buffer to the trace file."""
+        records = sorted(record for record in self.records if record)
+        if self.trace_file == '-':
+            self._write(sys.stdout, records)
         else:
-            namespace = os.path.basename(path)
-
-        # Get the function args from the stack frame
-        (arg_names, varg_name, kw_name, f_locals) = inspect.getargvalues(frame)
-        if name == '__init__' and 'self' in arg_names:
-            # Don't try to format self. The object will not be constructed
-            # yet. Print a repr instead.
-            arg_names.remove('self')
-            args = ['self={}'.format(repr(f_locals['self']))]
+            try:
+                with open(self.trace_file, 'a') as trace_file:
+                    self._write(trace_file, records)
+            except IOError as ex:
+                LOG.error('Error writing trace file %s: %s',
+                          self.trace_file, ex)
+
+    def _write(self, trace_file, records):
+        """Write the given records to an open file."""
+        trace_file.write('# Trace dump at {} ({} calls)\n'
+                         .format(self._format_time(time()), len(records)))
+        for _, start, elapsed, name, args, result, error in records:
+            # Anything but a number was formatted when recorded
+            args = ', '.join([str(arg) for arg in args])
+            if error is None:
+                outcome = str(result)
+            else:
+                outcome = 'raised {}: {}'.format(error.__class__.__name__,
+                                                 error)
+            trace_file.write('{} {:9.3f}ms {}({}) -> {}\n'
+                             .format(self._format_time(start),
+                                     elapsed * 1000, name, args, outcome))
+        trace_file.flush()
+
+    @staticmethod
+    def _format_time(timestamp):
+        """Format the given timestamp with millisecond precision."""
+        return '{}.{:03d}'.format(strftime('%H:%M:%S', localtime(timestamp)),
+                                  int(timestamp * 1000) % 1000)
+
+    @classmethod
+    def _summary(cls, value):
+        """Return what is kept of an arg or result until it is dumped."""
+        if isinstance(value, cls.SCALARS):
+            return value
+        return cls._format_value(value)
+
+    @classmethod
+    def _format_value(cls, value):
+        """Format an arg or result, truncating long values."""
+        if isinstance(value, list):
+            # e.g. readdir results, show the names of the first few entries
+            text = '[{}{}]'.format(
+                ', '.join([str(getattr(item, 'name', item))
+                           for item in value[:cls.MAX_ITEMS]]),
+                ', ...' if len(value) > cls.MAX_ITEMS else '')
+        elif isinstance(value, basestring):
+            text = repr(value[:cls.MAX_REPR + 1])
         else:
-            args = []
-        args.extend(['{}={}'.format(aname, f_locals[aname])
-                    for aname in arg_names])
-        if varg_name:
-            args.append('{}={}'.format(varg_name, f_locals[varg_name]))
-        if kw_name:
-            args.append('{}={}'.format(kw_name, f_locals[kw_name]))
-
-        if event == 'call':
-            msg = '{}.{}:{}({})' \
-                  .format(namespace, name, frame.f_lineno, ', '.join(args))
-        elif event == 'return':
-            msg = '{}.{}:{}({}) -> {}' \
-                  .format(namespace, name, frame.f_lineno, ', '.join(args),
-                          str(arg))
-        LOG.debug(msg)
-        return self
-
-
-def start(trace_file, filter_dir):
-    """Start tracing execution."""
-    sys.settrace(Tracer(trace_file, filter_dir))
-
-
-def stop():
-    """Stop tracing execution."""
-    sys.settrace(None)
+            text = str(value)
+        if len(text) > cls.MAX_REPR:
+            text = text[:cls.MAX_REPR] + '...'
+        return text
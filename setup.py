@@ -11,7 +11,8 @@ __long_description__ = __description__
 
 __install_requires__ = ['python-ldap', 'fuse-python', 'mock', 'coverage',
                         'pytest', 'pytest-cov']
-__scripts__ = ['bin/ldapfsd']
+__scripts__ = ['bin/ldapfsd', 'bin/ldapfs-replay', 'bin/ldapfs-bench',
+               'bin/ldapfs-load']
 __data_files__ = [('etc/ldapfs', ['etc/ldapfs.cfg'])]
 
 